@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 
 import asyncio
+import ctypes
+import ctypes.util
 from pathlib import Path
 import json
-import glob
+import os
+import struct
 import sys
 import logging
-import os
 import socket
 import argparse
 import termios
@@ -29,8 +31,21 @@ class DisableEcho:
 
 logger = logging.getLogger(__name__)
 
-done_files = set()
-file_gone = object()
+# Wait this long after the first request for others to batch with it
+BATCH_WINDOW = 1.0
+
+# Only used when inotify isn't available
+POLL_INTERVAL = 0.5
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+INOTIFY_EVENT = struct.Struct("iIII")
 
 
 async def connect_stdin() -> asyncio.StreamReader:
@@ -41,71 +56,295 @@ async def connect_stdin() -> asyncio.StreamReader:
     return reader
 
 
-async def monitor_path(path):
-    while os.path.exists(path):
-        await asyncio.sleep(0.2)
-    return file_gone
+def format_scans(scans):
+    return ", ".join(f"{name} {status}" for name, status in scans.items())
 
 
-async def handle_request(request, response_path):
-    stdin = await connect_stdin()
+def read_request(path):
+    try:
+        with open(path, "rb") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def batch_key(request):
+    # Requests for the same certificate can share a PIN, but a token agent
+    # login is for a session rather than for files so it's always on its own
+    if "session_window" in request:
+        return None
+    return request.get("certificate_id", request["certificate"])
+
+
+def print_request(request):
+    file = request.get("file") or "program"
+    print(f"- {request['user']}: {file} {request['description']!r}")
+    if "scans" in request:
+        print(f"  Scans: {format_scans(request['scans'])}")
+
+
+class RequestWatcher:
+    """Keeps track of the pending requests as they're written and removed.
+
+    The server writes a request by renaming a finished file into place and
+    removes it when it's no longer waiting for an answer, so inotify tells us
+    about new requests, updates and withdrawals without looking at the
+    directory again. Only files that currently exist are remembered.
+    """
+
+    def __init__(self, req_dir: Path):
+        self.req_dir = req_dir
+        self.requests: dict[Path, dict] = {}
+        # Requests that were shown, forgotten when the file is removed
+        self.handled: set[Path] = set()
+        self.waiters: list[asyncio.Future] = []
+        self.fd = None
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+
+        try:
+            self.fd = inotify_watch(
+                self.req_dir, IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+            )
+        except OSError as e:
+            logger.warning(f"inotify isn't available, polling instead: {e}")
+            loop.create_task(self.poll())
+        else:
+            loop.add_reader(self.fd, self.read_events)
+
+        self.rescan()
+
+    def pending(self) -> list[Path]:
+        return [path for path in self.requests if path not in self.handled]
+
+    async def changed(self):
+        """Wait until a request is added, updated or removed."""
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        await waiter
+
+    def notify(self):
+        for waiter in self.waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self.waiters.clear()
+
+    def load(self, path: Path):
+        request = read_request(path)
+        if request is None:
+            self.remove(path)
+        else:
+            self.requests[path] = request
+
+    def remove(self, path: Path):
+        self.requests.pop(path, None)
+        self.handled.discard(path)
+
+    def rescan(self):
+        paths = set(self.req_dir.glob("[!.]*"))
+        for path in set(self.requests) - paths:
+            self.remove(path)
+        for path in sorted(paths):
+            self.load(path)
+        self.notify()
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0").decode()
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.rescan()
+                return
+            if not name or name.startswith("."):
+                continue
+
+            path = self.req_dir / name
+            if mask & (IN_MOVED_TO | IN_CLOSE_WRITE):
+                self.load(path)
+            else:
+                self.remove(path)
+
+        self.notify()
+
+    async def poll(self):
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            self.rescan()
+
+
+def inotify_watch(path: Path, mask: int) -> int:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError("inotify_init1 not found")
+
+    fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+    if libc.inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+        errno = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(errno, os.strerror(errno), str(path))
+
+    return fd
+
+
+class Batch:
+    """Pending requests for one certificate, approved with a single PIN."""
+
+    def __init__(self, watcher: RequestWatcher, first: Path):
+        self.watcher = watcher
+        request = watcher.requests.get(first)
+        self.requests = {first: request} if request else {}
+        self.key = batch_key(request) if request else None
+        self.waiting: set[Path] = set()
+
+    def add_new(self, announce=True):
+        """Add requests for the same certificate that arrived since."""
+        for path in self.watcher.pending():
+            if path in self.requests:
+                continue
+
+            request = self.watcher.requests[path]
+            if self.key is not None and batch_key(request) == self.key:
+                self.requests[path] = request
+                if announce:
+                    print("Added to this batch:")
+                    print_request(request)
+            elif announce and path not in self.waiting:
+                self.waiting.add(path)
+                print("Waiting until this one is answered:")
+                print_request(request)
+
+    def refresh(self):
+        """Drop withdrawn requests and show scan progress."""
+        for path, request in list(self.requests.items()):
+            updated = self.watcher.requests.get(path)
+            if updated is None:
+                print(f"Withdrawn: {request.get('file') or path.name}")
+                del self.requests[path]
+            elif updated.get("scans") != request.get("scans"):
+                print(f"Scans of {updated.get('file') or path.name}: ", end="")
+                print(format_scans(updated["scans"]))
+                self.requests[path] = updated
+        self.waiting &= set(self.watcher.requests)
+
+    async def monitor(self):
+        while self.requests:
+            await self.watcher.changed()
+            self.add_new()
+            self.refresh()
+
+
+def send_response(response_path, response):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.connect(str(response_path))
+        sock.send(json.dumps(response).encode())
+    finally:
+        sock.close()
+
+
+async def read_pin(stdin):
+    with DisableEcho():
+        return (await stdin.readline()).decode().strip()
+
+
+async def handle_batch(batch, stdin, resp_dir: Path):
+    first = next(iter(batch.requests.values()))
 
     print(end="\a")
-    print(f"User {request['user']} wants to sign a program.")
-    print(f"Selected certificate: {request['certificate']}.")
+    if len(batch.requests) == 1:
+        print(f"User {first['user']} wants to sign a program.")
+    else:
+        print(f"{len(batch.requests)} programs are waiting to be signed.")
+    print(f"Selected certificate: {first['certificate']}.")
     print()
-    print(f"This is the program description: {request['description']!r}")
+    for request in batch.requests.values():
+        print_request(request)
     print()
-    print("Enter the token password to continue. 'q + enter' to cancel.")
+    if "scans" in first:
+        print("The password is only used once all scans of a program passed.")
+        print()
+    if "session_window" in first:
+        minutes = round(first["session_window"] / 60)
+        print(f"The token stays unlocked for {minutes} minutes, later requests won't ask again.")
+        print()
+    if len(batch.requests) == 1:
+        print("Enter the token password to continue. 'q + enter' to cancel.")
+    else:
+        print("Enter the token password to approve all of them. 'q + enter' to cancel.")
     print()
 
-    with DisableEcho():
-        inp = (await stdin.readline()).decode().strip()
+    monitor = asyncio.create_task(batch.monitor())
+    pin = asyncio.create_task(read_pin(stdin))
+
+    await asyncio.wait([monitor, pin], return_when=asyncio.FIRST_COMPLETED)
+
+    monitor.cancel()
+    await asyncio.gather(monitor, return_exceptions=True)
+
+    if not pin.done():
+        pin.cancel()
+        await asyncio.gather(pin, return_exceptions=True)
+        print("Gone")
+        return
 
+    inp = pin.result()
     if inp.lower() == "q":
         response = {"result": "cancelled"}
     else:
         response = {"result": "approve", "code": inp}
 
-    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
-    sock.connect(str(response_path))
-    sock.send(json.dumps(response).encode())
+    # Every request in the batch gets the answer and is logged on its own
+    for path in batch.requests:
+        try:
+            send_response(resp_dir / path.name, response)
+        except OSError:
+            print(f"Withdrawn: {batch.requests[path].get('file') or path.name}")
 
     print("Done", end=5*"\n")
 
 
-async def handle_file(request_path, response_path):
-    with open(request_path, "rb") as f:
-        request = json.load(f)
-
-    file_mon = asyncio.create_task(monitor_path(request_path))
-    request_task = asyncio.create_task(handle_request(request, response_path))
-
-    done, pending = await asyncio.wait([file_mon, request_task], return_when=asyncio.FIRST_COMPLETED)
-
-    if request_task in pending:
-        print("Gone")
-
-    request_task.cancel()
-    file_mon.cancel()
-    await asyncio.gather(file_mon, request_task, return_exceptions=True)
-
-
 async def file_monitor(req_dir: Path, resp_dir: Path):
-    while True:
-        files = set(req_dir.glob("[!.]*")) - done_files
-        if files:
-            try:
-                file = next(iter(files))
-                resp = resp_dir / file.name
-                await handle_file(file, resp)
-            except:
-                logger.exception(f"Failed request {file}")
-            finally:
-                done_files.add(file)
-        else:
-            await asyncio.sleep(0.5)
+    stdin = await connect_stdin()
+    watcher = RequestWatcher(req_dir)
+    watcher.start()
 
+    while True:
+        files = watcher.pending()
+        if not files:
+            await watcher.changed()
+            continue
+
+        batch = None
+        try:
+            batch = Batch(watcher, files[0])
+
+            # Give the other requests of a release a moment to come in
+            await asyncio.sleep(BATCH_WINDOW)
+            batch.add_new(announce=False)
+            batch.refresh()
+
+            if batch.requests:
+                await handle_batch(batch, stdin, resp_dir)
+        except:
+            logger.exception(f"Failed request {files[0]}")
+        finally:
+            # Only remembered while the file exists, see RequestWatcher.remove
+            handled = {files[0], *(batch.requests if batch else ())}
+            watcher.handled.update(handled & set(watcher.requests))
 
 
 async def main():
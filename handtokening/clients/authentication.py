@@ -1,15 +1,19 @@
 from base64 import b64decode
+import copy
+from datetime import datetime, timedelta
 from functools import lru_cache
 import hmac
+import threading
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import PermissionDenied
+from django.db.models import F
 from django.http import HttpRequest
 from django.utils import timezone
 from rest_framework import authentication
 
-from .models import ClientSecret, new_secret, encode_secret
-
+from .models import ClientSecret, CredentialGeneration, new_secret, encode_secret
 
 User = get_user_model()
 
@@ -19,6 +23,115 @@ def fake_pass():
     return encode_secret(new_secret())
 
 
+class CredentialCache:
+    """Credentials this worker process verified recently.
+
+    Saves the database queries for every request of a client. Entries expire
+    after CLIENT_AUTH_CACHE_TTL seconds, or when the secret does, and are all
+    dropped when any client, client secret or user changes (see signals.py).
+    Other processes, on this node or others, notice that through the
+    generation in the database, which is bumped on every change. Reading it
+    is a single primary key lookup instead of the user and secret queries.
+    """
+
+    # Only verified credentials are cached, but don't let it grow unbounded
+    max_entries = 1000
+
+    def __init__(self):
+        self.entries: dict[tuple[str, str], tuple[User, datetime]] = {}
+        self.generation = None
+        self.lock = threading.Lock()
+
+    def current_generation(self) -> int | None:
+        return (
+            CredentialGeneration.objects.filter(pk=1)
+            .values_list("generation", flat=True)
+            .first()
+        )
+
+    def get(self, name: str, encoded_secret: str) -> tuple[User | None, object]:
+        """Return the cached user and the generation to pass to put."""
+        generation = self.current_generation()
+
+        with self.lock:
+            if generation != self.generation:
+                self.entries.clear()
+                self.generation = generation
+
+            entry = self.entries.get((name, encoded_secret))
+            if entry and entry[1] > timezone.now():
+                return copy.copy(entry[0]), generation
+
+        return None, generation
+
+    def put(
+        self,
+        name: str,
+        encoded_secret: str,
+        user: User,
+        valid_until: datetime,
+        generation,
+    ):
+        ttl = client_auth_cache_ttl()
+        if ttl <= 0:
+            return
+
+        expires = min(timezone.now() + timedelta(seconds=ttl), valid_until)
+        with self.lock:
+            # Don't cache what was verified before the last change
+            if generation != self.generation:
+                return
+
+            if len(self.entries) >= self.max_entries:
+                self.entries.clear()
+            self.entries[(name, encoded_secret)] = (copy.copy(user), expires)
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+
+        CredentialGeneration.objects.get_or_create(pk=1)
+        CredentialGeneration.objects.filter(pk=1).update(generation=F("generation") + 1)
+
+
+credential_cache = CredentialCache()
+
+
+def client_auth_cache_ttl() -> float:
+    ttl = getattr(settings, "CLIENT_AUTH_CACHE_TTL", None)
+    return 60 if ttl is None else float(ttl)
+
+
+def verify_credentials(
+    name: str, encoded_secret: str
+) -> tuple[User | None, datetime | None]:
+    """Return the client's user and when the matching secret expires."""
+    user = (
+        User.objects.filter(is_active=True, client__isnull=False, username=name)
+        .select_related("client")
+        .first()
+    )
+
+    if user:
+        secrets = list(
+            ClientSecret.objects.filter(
+                client=user.client, valid_until__gt=timezone.now()
+            )
+        )
+    else:
+        secrets = []
+
+    # Compare against every secret so it doesn't matter which one matched
+    valid_until = None
+    for secret in secrets:
+        if hmac.compare_digest(encoded_secret, secret.secret):
+            valid_until = secret.valid_until
+
+    if valid_until is None:
+        return None, None
+    return user, valid_until
+
+
 # Django authentication
 class ClientAuthMiddleware:
     def __init__(self, get_response):
@@ -27,25 +140,20 @@ class ClientAuthMiddleware:
     def __call__(self, request: HttpRequest):
         auth: str = request.META.get("HTTP_AUTHORIZATION") or ""
         if auth.startswith("Basic "):
-            # Delete all expired client secrets
-            ClientSecret.objects.filter(valid_until__lt=timezone.now()).delete()
-
             name, _, text_pwd = (
                 b64decode(auth.removeprefix("Basic ").strip()).decode().partition(":")
             )
-            user = (
-                User.objects.filter(is_active=True, client__isnull=False, username=name)
-                .select_related("client")
-                .first()
-            )
             encoded_pwd = encode_secret(text_pwd)
 
-            if user:
-                secrets = list(ClientSecret.objects.filter(client=user.client))
-            else:
-                secrets = []
+            user, generation = credential_cache.get(name, encoded_pwd)
+            if user is None:
+                user, valid_until = verify_credentials(name, encoded_pwd)
+                if user:
+                    credential_cache.put(
+                        name, encoded_pwd, user, valid_until, generation
+                    )
 
-            if any(hmac.compare_digest(encoded_pwd, s.secret) for s in secrets):
+            if user:
                 # TODO: revoke credentials if http
                 request.user = user
             else:
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from handtokening.clients.models import delete_expired_secrets
+
+
+class Command(BaseCommand):
+    help = "Delete client secrets that expired"
+
+    def handle(self, *args, **kwargs):
+        count = delete_expired_secrets()
+        self.stdout.write(f"Deleted {count} expired secrets")
@@ -50,3 +50,18 @@ class ClientSecret(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     valid_for = models.DurationField()
     valid_until = models.DateTimeField()
+
+
+def delete_expired_secrets() -> int:
+    count, _ = ClientSecret.objects.filter(valid_until__lte=timezone.now()).delete()
+    return count
+
+
+class CredentialGeneration(models.Model):
+    """Bumped on every change to the client credentials.
+
+    A single row, shared by every worker process on every node so their
+    credential caches are cleared together (see authentication.py).
+    """
+
+    generation = models.PositiveBigIntegerField(default=0)
@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import credential_cache
+from .models import Client, ClientSecret
+
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=ClientSecret)
+@receiver(post_delete, sender=ClientSecret)
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_credential_cache(sender, **kwargs):
+    # Revoked secrets and deactivated users must stop working right away
+    credential_cache.invalidate()
@@ -1,10 +1,13 @@
 import base64
+import io
 from datetime import timedelta
 
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
 from django.utils import timezone
 
+from handtokening.clients.authentication import CredentialCache, credential_cache
 from handtokening.clients.models import Client, ClientSecret
 
 
@@ -23,6 +26,9 @@ class MiddlewareTest(TestCase):
             user=cls.user, default_secret_duration=timedelta(days=1)
         )
 
+    def setUp(self):
+        credential_cache.invalidate()
+
     def test_client_doesnt_exist(self):
         response = self.client.get(
             "/",
@@ -69,3 +75,55 @@ class MiddlewareTest(TestCase):
             headers={"authorization": basic_auth("signer", secret)},
         )
         self.assertEqual(response.status_code, 403)
+
+    def request(self, secret):
+        return self.client.get(
+            "/", headers={"authorization": basic_auth("signer", secret)}
+        )
+
+    def test_cache(self):
+        self.sign_client.set_new_secret()
+        secret = self.sign_client.new_secret
+
+        self.assertEqual(self.request(secret).status_code, 404)
+        # Only the generation is read
+        with self.assertNumQueries(1):
+            self.assertEqual(self.request(secret).status_code, 404)
+
+        # Another process changed a secret
+        CredentialCache().invalidate()
+        with self.assertNumQueries(3):
+            self.assertEqual(self.request(secret).status_code, 404)
+
+    def test_cache_client_saved(self):
+        self.sign_client.set_new_secret()
+        secret = self.sign_client.new_secret
+        self.assertEqual(self.request(secret).status_code, 404)
+
+        # Saving the client, e.g. in the admin, clears every process's cache
+        generation = credential_cache.current_generation()
+        self.sign_client.save()
+        self.assertEqual(credential_cache.current_generation(), generation + 1)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.request(secret).status_code, 403)
+
+    def test_cache_revoked(self):
+        self.sign_client.set_new_secret()
+        secret = self.sign_client.new_secret
+
+        self.assertEqual(self.request(secret).status_code, 404)
+
+        ClientSecret.objects.filter(client=self.sign_client).delete()
+        self.assertEqual(self.request(secret).status_code, 403)
+
+    def test_delete_expired_secrets(self):
+        self.sign_client.set_new_secret()
+        self.sign_client.set_new_secret()
+        ClientSecret.objects.filter(id=ClientSecret.objects.earliest("id").id).update(
+            valid_until=timezone.now()
+        )
+
+        call_command("delete_expired_client_secrets", stdout=io.StringIO())
+        self.assertEqual(ClientSecret.objects.count(), 1)
@@ -1,6 +1,8 @@
 import os
 import platform
 
+from .util import env_bool
+
 platform_name = platform.platform()
 
 # Application definition
@@ -136,5 +138,83 @@ path_config(
 if "OSSLSIGNCODE_PATH" in os.environ:
     OSSLSIGNCODE_PATH = os.environ["OSSLSIGNCODE_PATH"]
 
+if "OPENSSL_PATH" in os.environ:
+    OPENSSL_PATH = os.environ["OPENSSL_PATH"]
+
 if "CLAMSCAN_PATH" in os.environ:
     CLAMSCAN_PATH = os.environ["CLAMSCAN_PATH"]
+
+if "CLAMD_SOCKET" in os.environ:
+    CLAMD_SOCKET = os.environ["CLAMD_SOCKET"]
+
+if "CLAMD_TIMEOUT" in os.environ:
+    CLAMD_TIMEOUT = float(os.environ["CLAMD_TIMEOUT"])
+
+if "CLIENT_AUTH_CACHE_TTL" in os.environ:
+    CLIENT_AUTH_CACHE_TTL = float(os.environ["CLIENT_AUTH_CACHE_TTL"])
+
+if "SIGNING_JOB_WORKERS" in os.environ:
+    SIGNING_JOB_WORKERS = int(os.environ["SIGNING_JOB_WORKERS"])
+
+if "SIGNING_JOB_TIMEOUT" in os.environ:
+    SIGNING_JOB_TIMEOUT = int(os.environ["SIGNING_JOB_TIMEOUT"])
+
+if "BATCH_SIGNING_WORKERS" in os.environ:
+    BATCH_SIGNING_WORKERS = int(os.environ["BATCH_SIGNING_WORKERS"])
+
+if "ARCHIVE_MAX_MEMBERS" in os.environ:
+    ARCHIVE_MAX_MEMBERS = int(os.environ["ARCHIVE_MAX_MEMBERS"])
+
+if "ARCHIVE_MAX_SIZE" in os.environ:
+    ARCHIVE_MAX_SIZE = int(os.environ["ARCHIVE_MAX_SIZE"])
+
+if "ARCHIVE_MAX_COMPRESSION_RATIO" in os.environ:
+    ARCHIVE_MAX_COMPRESSION_RATIO = float(os.environ["ARCHIVE_MAX_COMPRESSION_RATIO"])
+
+if "SIGNING_LOG_WRITER" in os.environ:
+    SIGNING_LOG_WRITER = env_bool("SIGNING_LOG_WRITER", False)
+
+if "FILE_KEY_SIGNING_CONCURRENCY" in os.environ:
+    FILE_KEY_SIGNING_CONCURRENCY = int(os.environ["FILE_KEY_SIGNING_CONCURRENCY"])
+
+if "SIGNING_QUEUE_MAX_DEPTH" in os.environ:
+    SIGNING_QUEUE_MAX_DEPTH = int(os.environ["SIGNING_QUEUE_MAX_DEPTH"])
+
+if "SIGNING_QUEUE_TIMEOUT" in os.environ:
+    SIGNING_QUEUE_TIMEOUT = float(os.environ["SIGNING_QUEUE_TIMEOUT"])
+
+if "SIGNING_QUEUE_RETRY_AFTER" in os.environ:
+    SIGNING_QUEUE_RETRY_AFTER = int(os.environ["SIGNING_QUEUE_RETRY_AFTER"])
+
+if "TSA_FAILURE_THRESHOLD" in os.environ:
+    TSA_FAILURE_THRESHOLD = int(os.environ["TSA_FAILURE_THRESHOLD"])
+
+if "TSA_CIRCUIT_BREAK" in os.environ:
+    TSA_CIRCUIT_BREAK = int(os.environ["TSA_CIRCUIT_BREAK"])
+
+if "TSA_HEDGING" in os.environ:
+    TSA_HEDGING = int(os.environ["TSA_HEDGING"])
+
+if "TSA_PROBE_TIMEOUT" in os.environ:
+    TSA_PROBE_TIMEOUT = float(os.environ["TSA_PROBE_TIMEOUT"])
+
+if "TOKEN_SESSION_WINDOW" in os.environ:
+    TOKEN_SESSION_WINDOW = float(os.environ["TOKEN_SESSION_WINDOW"])
+
+if "VIRUS_TOTAL_REQUESTS_PER_MINUTE" in os.environ:
+    VIRUS_TOTAL_REQUESTS_PER_MINUTE = int(os.environ["VIRUS_TOTAL_REQUESTS_PER_MINUTE"])
+
+if "VIRUS_TOTAL_REQUESTS_PER_DAY" in os.environ:
+    VIRUS_TOTAL_REQUESTS_PER_DAY = int(os.environ["VIRUS_TOTAL_REQUESTS_PER_DAY"])
+
+if "OUTPUT_CACHE_TTL" in os.environ:
+    OUTPUT_CACHE_TTL = int(os.environ["OUTPUT_CACHE_TTL"])
+
+if "OUTPUT_CACHE_MAX_SIZE" in os.environ:
+    OUTPUT_CACHE_MAX_SIZE = int(os.environ["OUTPUT_CACHE_MAX_SIZE"])
+
+if "FILE_RETENTION_DAYS" in os.environ:
+    FILE_RETENTION_DAYS = float(os.environ["FILE_RETENTION_DAYS"])
+
+if "MAINTENANCE_IN_PROCESS" in os.environ:
+    MAINTENANCE_IN_PROCESS = env_bool("MAINTENANCE_IN_PROCESS", True)
@@ -14,6 +14,7 @@ from pathlib import Path
 import os
 
 from .base import *
+from .util import postgresql_database
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
@@ -42,6 +43,9 @@ DATABASES = {
     }
 }
 
+if os.environ.get("DATABASE_BACKEND") == "postgresql":
+    DATABASES["default"] = postgresql_database()
+
 STATE_DIRECTORY = "/tmp/handtokening"
 PIN_COMMS_LOCATION = "/tmp/handtokening"
 
@@ -54,3 +58,8 @@ elif (BASE_DIR / "vt-api").exists():
         VIRUS_TOTAL_API_KEY = f.read().strip()
 
 TEST_CERTIFICATE_DIRECTORY = BASE_DIR / "certs"
+
+# Keep the development server and tests free of background housekeeping, run
+# `manage.py run_maintenance --once` when needed
+if "MAINTENANCE_IN_PROCESS" not in os.environ:
+    MAINTENANCE_IN_PROCESS = False
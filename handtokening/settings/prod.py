@@ -1,7 +1,9 @@
 from os import environ
 from pathlib import Path
 
-from .util import env_bool
+from django.core.exceptions import ImproperlyConfigured
+
+from .util import env_bool, postgresql_database, sqlite_init_command
 from .base import *
 
 DEBUG = env_bool("UNSAFE_DEBUG", False)
@@ -17,12 +19,37 @@ if (vt_path := config_dir / "vt-api").exists():
     with open(vt_path) as f:
         VIRUS_TOTAL_API_KEY = f.read().strip()
 
-DATABASES = {
-    "default": {
+database_backend = environ.get("DATABASE_BACKEND") or "sqlite"
+
+if database_backend == "sqlite":
+    # Every signing request writes to the database, with several workers they
+    # have to wait on each other. WAL lets readers continue while one writes.
+    database = {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": state_dir / "db.sqlite3",
+        "CONN_MAX_AGE": int(environ.get("CONN_MAX_AGE") or 60),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            "timeout": float(environ.get("SQLITE_BUSY_TIMEOUT") or 30),
+            # Take the write lock when the transaction starts, so waiting for
+            # it respects the timeout instead of failing with "database is
+            # locked" when a read transaction tries to write
+            "transaction_mode": environ.get("SQLITE_TRANSACTION_MODE") or "IMMEDIATE",
+            "init_command": sqlite_init_command(
+                journal_mode=environ.get("SQLITE_JOURNAL_MODE") or "WAL",
+                synchronous=environ.get("SQLITE_SYNCHRONOUS") or "NORMAL",
+                mmap_size=int(environ.get("SQLITE_MMAP_SIZE") or 256 * 1024 * 1024),
+            ),
+        },
     }
-}
+elif database_backend == "postgresql":
+    database = postgresql_database()
+else:
+    raise ImproperlyConfigured(
+        f"DATABASE_BACKEND must be 'sqlite' or 'postgresql', not {database_backend!r}"
+    )
+
+DATABASES = {"default": database}
 
 if "STATIC_ROOT" in environ:
     STATIC_ROOT = environ["STATIC_ROOT"]
@@ -59,8 +86,6 @@ if "IPWARE_META_PRECEDENCE_ORDER" in environ:
 else:
     IPWARE_META_PRECEDENCE_ORDER = ["REMOTE_ADDR"]
 
-DISABLE_SERVER_SIDE_CURSORS = env_bool("DISABLE_SERVER_SIDE_CURSORS", False)
-
 if "ALLOWED_HOSTS" in environ:
     ALLOWED_HOSTS = environ["ALLOWED_HOSTS"].split(",")
 
@@ -27,3 +27,57 @@ def env_bool(name: str, default: bool) -> bool:
             default,
         )
         return default
+
+
+sqlite_journal_modes = ["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"]
+sqlite_synchronous_values = ["OFF", "NORMAL", "FULL", "EXTRA"]
+
+
+def sqlite_init_command(journal_mode: str, synchronous: str, mmap_size: int) -> str:
+    """PRAGMA statements run on every new SQLite connection."""
+    journal_mode = journal_mode.strip().upper()
+    if journal_mode not in sqlite_journal_modes:
+        raise ValueError(f"Unknown SQLite journal mode {journal_mode!r}")
+
+    synchronous = synchronous.strip().upper()
+    if synchronous not in sqlite_synchronous_values:
+        raise ValueError(f"Unknown SQLite synchronous setting {synchronous!r}")
+
+    return "; ".join(
+        [
+            f"PRAGMA journal_mode={journal_mode}",
+            f"PRAGMA synchronous={synchronous}",
+            f"PRAGMA mmap_size={int(mmap_size)}",
+        ]
+    )
+
+
+def postgresql_database() -> dict:
+    """PostgreSQL connection for DATABASE_BACKEND=postgresql.
+
+    The server, user, password, and TLS settings come from libpq's own
+    environment variables (PGHOST, PGUSER, PGPASSWORD or PGPASSFILE,
+    PGSSLMODE, ...). Each process gets a pool of connections, which its
+    request and background threads share.
+    """
+    database = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": environ.get("PGDATABASE") or "handtokening",
+        # Needed behind PgBouncer in transaction pooling mode
+        "DISABLE_SERVER_SIDE_CURSORS": env_bool("DISABLE_SERVER_SIDE_CURSORS", False),
+        "OPTIONS": {},
+    }
+
+    if env_bool("DATABASE_POOL", True):
+        # Connections are returned to the pool instead of being kept by a
+        # thread, so CONN_MAX_AGE doesn't apply
+        database["OPTIONS"]["pool"] = {
+            "min_size": int(environ.get("DATABASE_POOL_MIN_SIZE") or 2),
+            "max_size": int(environ.get("DATABASE_POOL_MAX_SIZE") or 10),
+            "timeout": float(environ.get("DATABASE_POOL_TIMEOUT") or 30),
+        }
+    else:
+        database["CONN_MAX_AGE"] = int(environ.get("CONN_MAX_AGE") or 60)
+        database["CONN_HEALTH_CHECKS"] = True
+
+    return database
@@ -1,18 +1,26 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
 from django.utils.html import format_html
 from django.template.loader import render_to_string
-from django.db.models import Count, Q
 
+from .maintenance import TASKS
 from .models import (
     Certificate,
+    MaintenanceTask,
     TimestampServer,
     SigningProfile,
     SigningProfileAccess,
+    SigningBatch,
     SigningLog,
     VirusTotalAnalysis,
     VirusTotalEngineResult,
+    VirusTotalSubmission,
 )
+from .timings import GROUP_FIELDS, WINDOWS, stage_latencies
 from handtokening.admin import ReadOnlyAdminMixin
 
 
@@ -23,7 +31,62 @@ class CertificateAdmin(admin.ModelAdmin):
 
 @admin.register(TimestampServer)
 class TimestampServerAdmin(admin.ModelAdmin):
-    list_display = ["name", "url", "is_enabled"]
+    list_display = [
+        "name",
+        "url",
+        "is_enabled",
+        "success_rate_display",
+        "latency_display",
+        "circuit_display",
+        "last_success",
+        "last_failure",
+    ]
+
+    fieldsets = [
+        (None, {"fields": ["name", "url", "is_enabled"]}),
+        (
+            "Health",
+            {
+                "fields": [
+                    "success_count",
+                    "failure_count",
+                    "consecutive_failures",
+                    "average_latency",
+                    "last_success",
+                    "last_failure",
+                    "last_error",
+                    "circuit_open_until",
+                ]
+            },
+        ),
+    ]
+
+    readonly_fields = [
+        "success_count",
+        "failure_count",
+        "consecutive_failures",
+        "average_latency",
+        "last_success",
+        "last_failure",
+        "last_error",
+        "circuit_open_until",
+    ]
+
+    @admin.display(description="Success rate")
+    def success_rate_display(self, obj: TimestampServer):
+        if obj.success_rate is None:
+            return "-"
+        return f"{obj.success_rate:.0%} of {obj.success_count + obj.failure_count}"
+
+    @admin.display(description="Latency", ordering="average_latency")
+    def latency_display(self, obj: TimestampServer):
+        if obj.average_latency is None:
+            return "-"
+        return f"{obj.average_latency:.2f}s"
+
+    @admin.display(description="Circuit")
+    def circuit_display(self, obj: TimestampServer):
+        return "Open" if obj.is_circuit_open else "Closed"
 
 
 class SigningProfileAccessInline(admin.TabularInline):
@@ -83,8 +146,13 @@ class SigningLogAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
                     "description",
                     "url",
                     "submitted_file_name",
-                    "result",
+                    ("is_job", "response_type"),
+                    "batch",
+                    ("result", "result_detail"),
                     "exception",
+                    ("cache_status", "cache_source"),
+                    "scan_timings",
+                    "stage_timings",
                 ]
             },
         ),
@@ -96,17 +164,61 @@ class SigningLogAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
                     "in_path",
                     "in_file_size",
                     "in_file_sha256",
+                    "signed_digest",
                     "out_path",
                     "out_file_size",
                     "out_file_sha256",
+                    "cache_key",
                 ],
             },
         ),
     ]
 
+    change_list_template = "signing/signinglog_change_list.html"
+
     def get_queryset(self, request):
         return super().get_queryset(request).select_related("vt_analysis")
 
+    def get_urls(self):
+        return [
+            path(
+                "latency/",
+                self.admin_site.admin_view(self.latency_view),
+                name="signing_signinglog_latency",
+            ),
+            *super().get_urls(),
+        ]
+
+    def latency_view(self, request):
+        """Percentiles of the time spent in each stage, see timings.py."""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        window = request.GET.get("window")
+        if window not in WINDOWS:
+            window = "24h"
+        group_by = request.GET.get("group")
+        if group_by not in GROUP_FIELDS:
+            group_by = "stage"
+
+        since = timezone.now() - WINDOWS[window]
+
+        return TemplateResponse(
+            request,
+            "signing/latency.html",
+            {
+                **self.admin_site.each_context(request),
+                "title": "Signing latency",
+                "opts": self.model._meta,
+                "windows": list(WINDOWS),
+                "window": window,
+                "groups": list(GROUP_FIELDS),
+                "group_by": group_by,
+                "since": since,
+                "latencies": stage_latencies(since, group_by),
+            },
+        )
+
     def get_fieldsets(self, request, obj):
         fieldsets = self.fieldsets.copy()
         if obj.vt_analysis:
@@ -160,6 +272,40 @@ class SigningLogAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
             return "-"
 
 
+class SigningBatchLogInline(admin.TabularInline):
+    model = SigningLog
+    fields = ["submitted_file_name", "certificate_name", "result", "result_detail"]
+    readonly_fields = fields
+    show_change_link = True
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(SigningBatch)
+class SigningBatchAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
+    list_display = [
+        "client_name",
+        "ip",
+        "created",
+        "submitted_file_name",
+        "file_count",
+        "signing_profile_name",
+        "result",
+    ]
+
+    list_filter = [
+        "created",
+        "client_name",
+        "signing_profile_name",
+        "result",
+    ]
+
+    inlines = (SigningBatchLogInline,)
+
+
 @admin.register(VirusTotalAnalysis)
 class VirusTotalAnalysisAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
     list_display = [
@@ -167,7 +313,8 @@ class VirusTotalAnalysisAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
         "date",
         "url",
         "analysis_time",
-        "bad_count",
+        "api_calls",
+        "bad_display",
     ]
 
     fields = [
@@ -175,6 +322,7 @@ class VirusTotalAnalysisAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
         "date",
         "url",
         "analysis_time",
+        "api_calls",
         "engine_results",
     ]
 
@@ -191,21 +339,54 @@ class VirusTotalAnalysisAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
         results.sort(key=lambda r: not r.bad)
         return render_vt_results_table(results)
 
-    @admin.display(ordering="bad_count")
-    def bad_count(self, obj):
+    @admin.display(description="Bad count", ordering="bad_count")
+    def bad_display(self, obj):
         return f"{obj.bad_count}/{obj.total_count}"
 
-    def get_queryset(self, request):
-        return (
-            super()
-            .get_queryset(request)
-            .annotate(
-                bad_count=Count(
-                    "results",
-                    filter=Q(
-                        results__category__in=VirusTotalEngineResult.bad_categories
-                    ),
-                ),
-                total_count=Count("results"),
-            )
-        )
+
+@admin.register(VirusTotalSubmission)
+class VirusTotalSubmissionAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
+    list_display = [
+        "sha256",
+        "status",
+        "host",
+        "queued",
+        "next_poll",
+        "api_calls",
+        "analysis",
+    ]
+
+    list_filter = ["status", "host"]
+
+
+@admin.register(MaintenanceTask)
+class MaintenanceTaskAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
+    list_display = [
+        "name",
+        "interval_display",
+        "last_started",
+        "duration_display",
+        "status_display",
+        "next_run",
+        "run_count",
+        "failure_count",
+    ]
+
+    @admin.display(description="Interval")
+    def interval_display(self, obj: MaintenanceTask):
+        # Per-server tasks are recorded as name@host
+        name = obj.name.partition("@")[0]
+        for task in TASKS:
+            if task.name == name:
+                return task.interval
+        return "-"
+
+    @admin.display(description="Duration", ordering="last_duration")
+    def duration_display(self, obj: MaintenanceTask):
+        if obj.last_duration is None:
+            return "-"
+        return f"{obj.last_duration:.2f}s"
+
+    @admin.display(description="Last result")
+    def status_display(self, obj: MaintenanceTask):
+        return obj.last_error or obj.last_output or "-"
@@ -2,6 +2,7 @@ import logging
 from pathlib import Path
 
 from django.apps import AppConfig
+from django.core.signals import request_started
 from .conf import config
 
 
@@ -26,6 +27,8 @@ def set_up_directories():
 
     try_create_dir(config.STATE_DIRECTORY / "in")
     try_create_dir(config.STATE_DIRECTORY / "out")
+    try_create_dir(config.STATE_DIRECTORY / "locks")
+    try_create_dir(config.STATE_DIRECTORY / "queue")
     try_create_dir(config.TEST_CERTIFICATE_DIRECTORY)
 
 
@@ -34,4 +37,11 @@ class CertificatesConfig(AppConfig):
     name = "handtokening.signing"
 
     def ready(self):
+        from . import signals  # noqa: F401
+
         set_up_directories()
+
+        if config.MAINTENANCE_IN_PROCESS:
+            from .maintenance import start_maintenance
+
+            request_started.connect(start_maintenance, dispatch_uid="maintenance")
@@ -0,0 +1,48 @@
+"""Limits on the zip archives uploaded for batch and catalog signing.
+
+The limits are checked against the archive's central directory before any
+member is extracted. zipfile doesn't read past a member's declared file_size,
+so the sizes in the directory can be trusted.
+"""
+
+import zipfile
+
+from .conf import config
+
+
+# Small members are left out of the compression ratio check, a few kB of zeros
+# compress better than any ratio worth setting
+RATIO_MIN_FILE_SIZE = 1024 * 1024
+
+
+class ArchiveLimitExceeded(Exception):
+    pass
+
+
+def check_archive_limits(archive: zipfile.ZipFile):
+    """Raise ArchiveLimitExceeded if the archive exceeds one of the limits.
+
+    See ARCHIVE_MAX_MEMBERS, ARCHIVE_MAX_SIZE and
+    ARCHIVE_MAX_COMPRESSION_RATIO, 0 disables a limit.
+    """
+    members = [info for info in archive.infolist() if not info.is_dir()]
+
+    max_members = config.ARCHIVE_MAX_MEMBERS
+    if max_members and len(members) > max_members:
+        raise ArchiveLimitExceeded(f"The archive has more than {max_members} files")
+
+    max_size = config.ARCHIVE_MAX_SIZE
+    if max_size and sum(info.file_size for info in members) > max_size:
+        raise ArchiveLimitExceeded(
+            f"The archive's files are larger than {max_size} bytes in total"
+        )
+
+    max_ratio = config.ARCHIVE_MAX_COMPRESSION_RATIO
+    if max_ratio:
+        for info in members:
+            if info.file_size < RATIO_MIN_FILE_SIZE:
+                continue
+            if info.file_size > max(info.compress_size, 1) * max_ratio:
+                raise ArchiveLimitExceeded(
+                    f"{info.filename} is compressed more than {max_ratio:g} times"
+                )
@@ -0,0 +1,247 @@
+"""Authenticode structures for building signatures without osslsigncode.
+
+Used for digest signing: the client runs `osslsigncode extract-data` on its
+file and only uploads the resulting data content, which contains the
+Authenticode digest. The signature built here can be attached to the original
+file with `osslsigncode attach-signature`.
+"""
+
+from datetime import datetime, timezone
+import hashlib
+
+from asn1crypto import algos, cms, core, pem, x509
+
+
+SPC_INDIRECT_DATA = "1.3.6.1.4.1.311.2.1.4"
+SPC_STATEMENT_TYPE = "1.3.6.1.4.1.311.2.1.11"
+SPC_SP_OPUS_INFO = "1.3.6.1.4.1.311.2.1.12"
+SPC_PE_IMAGE_DATA = "1.3.6.1.4.1.311.2.1.15"
+SPC_INDIVIDUAL_CODE_SIGNING = "1.3.6.1.4.1.311.2.1.21"
+SPC_SIPINFO = "1.3.6.1.4.1.311.2.1.30"
+
+# Data types osslsigncode puts in the SpcIndirectDataContent: PE files use
+# SpcPeImageData, the other formats (MSI, CAB, scripts, ...) use SpcSipInfo.
+SUPPORTED_DATA_TYPES = [SPC_PE_IMAGE_DATA, SPC_SIPINFO]
+
+SUPPORTED_DIGEST_ALGORITHMS = ["sha256", "sha384", "sha512"]
+
+
+class SpcString(core.Choice):
+    _alternatives = [
+        ("unicode", core.BMPString, {"implicit": 0}),
+        ("ascii", core.IA5String, {"implicit": 1}),
+    ]
+
+
+class SpcSerializedObject(core.Sequence):
+    _fields = [
+        ("class_id", core.OctetString),
+        ("serialized_data", core.OctetString),
+    ]
+
+
+class SpcLink(core.Choice):
+    _alternatives = [
+        ("url", core.IA5String, {"implicit": 0}),
+        ("moniker", SpcSerializedObject, {"implicit": 1}),
+        ("file", SpcString, {"explicit": 2}),
+    ]
+
+
+class SpcAttributeTypeAndOptionalValue(core.Sequence):
+    _fields = [
+        ("type", core.ObjectIdentifier),
+        ("value", core.Any, {"optional": True}),
+    ]
+
+
+class SpcIndirectDataContent(core.Sequence):
+    _fields = [
+        ("data", SpcAttributeTypeAndOptionalValue),
+        ("message_digest", algos.DigestInfo),
+    ]
+
+
+class SpcSpOpusInfo(core.Sequence):
+    _fields = [
+        ("program_name", SpcString, {"explicit": 0, "optional": True}),
+        ("more_info", SpcLink, {"explicit": 1, "optional": True}),
+    ]
+
+
+class SpcStatementType(core.SequenceOf):
+    _child_spec = core.ObjectIdentifier
+
+
+class SetOfSpcSpOpusInfo(core.SetOf):
+    _child_spec = SpcSpOpusInfo
+
+
+class SetOfSpcStatementType(core.SetOf):
+    _child_spec = SpcStatementType
+
+
+# Teach asn1crypto about the Authenticode content type and attributes
+cms.ContentType._map[SPC_INDIRECT_DATA] = "spc_indirect_data"
+cms.ContentInfo._oid_specs["spc_indirect_data"] = SpcIndirectDataContent
+cms.CMSAttributeType._map[SPC_SP_OPUS_INFO] = "spc_sp_opus_info"
+cms.CMSAttribute._oid_specs["spc_sp_opus_info"] = SetOfSpcSpOpusInfo
+cms.CMSAttributeType._map[SPC_STATEMENT_TYPE] = "spc_statement_type"
+cms.CMSAttribute._oid_specs["spc_statement_type"] = SetOfSpcStatementType
+
+
+class InvalidDataContent(ValueError):
+    pass
+
+
+def load_data_content(data: bytes) -> SpcIndirectDataContent:
+    """Load the output of `osslsigncode extract-data`.
+
+    That's a PKCS #7 data ContentInfo with the DER encoded SpcIndirectDataContent
+    inside of it. Both the DER and PEM (`-pem`) output are accepted.
+    """
+    try:
+        if pem.detect(data):
+            _, _, data = pem.unarmor(data)
+
+        content_info = cms.ContentInfo.load(data, strict=True)
+        if content_info["content_type"].native != "data":
+            raise InvalidDataContent(
+                f"Expected PKCS #7 data, got {content_info['content_type'].dotted}"
+            )
+
+        indirect_data = SpcIndirectDataContent.load(
+            content_info["content"].native, strict=True
+        )
+
+        data_type = indirect_data["data"]["type"].dotted
+        digest_algorithm = indirect_data["message_digest"]["digest_algorithm"]
+        digest = indirect_data["message_digest"]["digest"].native
+    except InvalidDataContent:
+        raise
+    except (ValueError, TypeError) as exc:
+        raise InvalidDataContent(f"Couldn't parse data content: {exc}") from exc
+
+    if data_type not in SUPPORTED_DATA_TYPES:
+        raise InvalidDataContent(f"Unsupported data type: {data_type}")
+
+    if digest_algorithm["algorithm"].native not in SUPPORTED_DIGEST_ALGORITHMS:
+        raise InvalidDataContent(
+            f"Unsupported digest algorithm: {digest_algorithm['algorithm'].native}"
+        )
+
+    if len(digest) != hashlib.new(digest_algorithm["algorithm"].native).digest_size:
+        raise InvalidDataContent("Digest length doesn't match its algorithm")
+
+    return indirect_data
+
+
+def get_digest_algorithm(indirect_data: SpcIndirectDataContent) -> str:
+    return indirect_data["message_digest"]["digest_algorithm"]["algorithm"].native
+
+
+def get_digest(indirect_data: SpcIndirectDataContent) -> bytes:
+    return indirect_data["message_digest"]["digest"].native
+
+
+def build_signed_attributes(
+    indirect_data: SpcIndirectDataContent,
+    description: str | None = None,
+    url: str | None = None,
+    signing_time: datetime | None = None,
+) -> cms.CMSAttributes:
+    """The attributes osslsigncode adds when signing, signing time included."""
+    digest_algorithm = get_digest_algorithm(indirect_data)
+
+    # The message digest covers the content octets, without the outer tag and
+    # length of the SpcIndirectDataContent sequence.
+    message_digest = hashlib.new(digest_algorithm, indirect_data.contents).digest()
+
+    # asn1crypto can't encode a sequence without any of its optional fields
+    opus_info = SpcSpOpusInfo.load(b"\x30\x00")
+    if description:
+        opus_info["program_name"] = SpcString(name="unicode", value=description)
+    if url:
+        opus_info["more_info"] = SpcLink(name="url", value=url)
+
+    return cms.CMSAttributes(
+        [
+            {"type": "content_type", "values": ["spc_indirect_data"]},
+            {
+                "type": "signing_time",
+                "values": [
+                    cms.Time(
+                        name="utc_time",
+                        value=signing_time or datetime.now(timezone.utc),
+                    )
+                ],
+            },
+            {"type": "spc_sp_opus_info", "values": [opus_info]},
+            {
+                "type": "spc_statement_type",
+                "values": [[SPC_INDIVIDUAL_CODE_SIGNING]],
+            },
+            {"type": "message_digest", "values": [message_digest]},
+        ]
+    )
+
+
+def signature_algorithm(certificate: x509.Certificate, digest_algorithm: str) -> str:
+    key_algorithm = certificate.public_key.algorithm
+    if key_algorithm == "rsa":
+        return "rsassa_pkcs1v15"
+    elif key_algorithm == "ec":
+        return f"{digest_algorithm}_ecdsa"
+    else:
+        raise ValueError(f"Unsupported key algorithm: {key_algorithm}")
+
+
+def build_signed_data(
+    indirect_data: SpcIndirectDataContent,
+    signed_attributes: cms.CMSAttributes,
+    signature: bytes,
+    certificates: list[x509.Certificate],
+) -> bytes:
+    """Build the DER encoded PKCS #7 SignedData ContentInfo.
+
+    The first certificate must be the signing certificate, the rest is included
+    as its chain.
+    """
+    signing_certificate = certificates[0]
+    digest_algorithm = get_digest_algorithm(indirect_data)
+
+    signer_info = cms.SignerInfo(
+        {
+            "version": "v1",
+            "sid": cms.SignerIdentifier(
+                name="issuer_and_serial_number",
+                value={
+                    "issuer": signing_certificate.issuer,
+                    "serial_number": signing_certificate.serial_number,
+                },
+            ),
+            "digest_algorithm": {"algorithm": digest_algorithm},
+            "signed_attrs": signed_attributes,
+            "signature_algorithm": {
+                "algorithm": signature_algorithm(signing_certificate, digest_algorithm)
+            },
+            "signature": signature,
+        }
+    )
+
+    signed_data = cms.SignedData(
+        {
+            "version": "v1",
+            "digest_algorithms": [{"algorithm": digest_algorithm}],
+            "encap_content_info": {
+                "content_type": "spc_indirect_data",
+                "content": indirect_data,
+            },
+            "certificates": certificates,
+            "signer_infos": [signer_info],
+        }
+    )
+
+    return cms.ContentInfo(
+        {"content_type": "signed_data", "content": signed_data}
+    ).dump()
@@ -0,0 +1,313 @@
+"""Signing the files in a zip archive together.
+
+Every supported file in the archive goes through its own SigningPipeline and
+gets its own SigningLog, but they're all signed with the same certificate.
+Their PIN requests are written while the rest of the archive is still being
+scanned, so the PIN agent shows them as one batch and the operator approves
+them with a single PIN. The signed archive is written to the response as it's
+built, with the other files in the archive copied unchanged.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from pathlib import Path
+from typing import Iterator
+import zipfile
+
+from django.db import close_old_connections, connection
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.text import slugify
+from ipware import get_client_ip
+from rest_framework.request import Request
+
+from .archives import ArchiveLimitExceeded, check_archive_limits
+from .conf import config
+from .models import SigningBatch, SigningLog
+from .pipeline import (
+    SUPPORTED_FILE_EXTENSIONS,
+    SigningCancelled,
+    SigningError,
+    SigningPipeline,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Archive members are copied in pieces of this size
+CHUNK_SIZE = 64 * 1024
+
+
+class BatchSigningFailed(SigningError):
+    """One of the files in the batch couldn't be signed."""
+
+    def __init__(self, message: str, cause: Exception):
+        super().__init__(message)
+        if isinstance(cause, SigningError):
+            self.result = cause.result
+            self.status_code = cause.status_code
+            self.headers = cause.headers
+        else:
+            self.result = SigningLog.Result.INTERNAL_ERROR
+            self.status_code = 500
+
+
+class ArchiveMember:
+    """A file in the archive, read by SigningPipeline.prepare like an upload."""
+
+    def __init__(self, archive: zipfile.ZipFile, info: zipfile.ZipInfo):
+        self.archive = archive
+        self.info = info
+
+    def chunks(self) -> Iterator[bytes]:
+        with self.archive.open(self.info) as f:
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
+
+
+def is_signable(info: zipfile.ZipInfo) -> bool:
+    _, _, extension = info.filename.rpartition(".")
+    return not info.is_dir() and extension.lower() in SUPPORTED_FILE_EXTENSIONS
+
+
+class StreamWriter:
+    """Unseekable file that collects what zipfile writes for a generator."""
+
+    def __init__(self):
+        self.chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_archive(in_path: Path, replacements: dict[int, Path]) -> Iterator[bytes]:
+    """Yield a copy of the archive with some members' content replaced.
+
+    `replacements` maps the index of a member in the archive to the file to
+    store instead. Only a chunk at a time is kept in memory.
+    """
+    out = StreamWriter()
+    result = zipfile.ZipFile(out, "w")
+
+    with zipfile.ZipFile(in_path) as archive:
+        for index, info in enumerate(archive.infolist()):
+            member = zipfile.ZipInfo(info.filename, info.date_time)
+            member.external_attr = info.external_attr
+
+            if info.is_dir():
+                result.writestr(member, b"")
+                continue
+
+            member.compress_type = zipfile.ZIP_DEFLATED
+            if index in replacements:
+                source = open(replacements[index], "rb")
+                member.file_size = replacements[index].stat().st_size
+            else:
+                source = archive.open(info)
+                member.file_size = info.file_size
+
+            with source, result.open(member, "w") as dest:
+                while chunk := source.read(CHUNK_SIZE):
+                    dest.write(chunk)
+                    if data := out.take():
+                        yield data
+
+            if data := out.take():
+                yield data
+
+    result.close()
+    yield out.take()
+
+
+class BatchSigning:
+    """Sign the supported files in a zip archive under a single PIN approval.
+
+    Like SigningPipeline, errors should be passed to record_error and finish
+    must always be called to write the final state to the SigningBatch and
+    the files' SigningLogs.
+    """
+
+    def __init__(self, batch: SigningBatch, request: Request, query: dict):
+        self.batch = batch
+        self.request = request
+        self.query = query
+
+        self.in_path: Path | None = None
+        # Pipeline of every signed file by the index of the archive member
+        self.pipelines: dict[int, SigningPipeline] = {}
+
+    @classmethod
+    def from_request(cls, request: Request, query: dict, file_name: str):
+        ip, _ = get_client_ip(request)
+        batch = SigningBatch.objects.create(
+            ip=ip,
+            user_agent=request.META.get("HTTP_USER_AGENT"),
+            client=request.user.client,
+            client_name=request.user.username,
+            signing_profile_name=query["signing-profile"],
+            description=query.get("description"),
+            submitted_file_name=file_name,
+        )
+
+        return cls(batch, request, query)
+
+    @property
+    def base_name(self) -> str:
+        file_name = self.batch.submitted_file_name
+        return f"{self.batch.id}-{slugify(file_name.rpartition('.')[0] or file_name)}"
+
+    def prepare(self, incoming_file):
+        """Receive the archive and prepare a pipeline for each file to sign."""
+        batch = self.batch
+
+        self.in_path = config.STATE_DIRECTORY / "in" / f"{self.base_name}.zip"
+        with open(self.in_path, "wb") as f:
+            for chunk in incoming_file.chunks():
+                f.write(chunk)
+
+        batch.in_path = str(self.in_path)
+        batch.in_file_size = self.in_path.stat().st_size
+
+        try:
+            archive = zipfile.ZipFile(self.in_path)
+        except zipfile.BadZipFile as exc:
+            raise SigningError("Not a valid zip archive") from exc
+
+        with archive:
+            try:
+                check_archive_limits(archive)
+            except ArchiveLimitExceeded as exc:
+                raise SigningError(str(exc)) from exc
+
+            members = [
+                (index, info)
+                for index, info in enumerate(archive.infolist())
+                if is_signable(info)
+            ]
+            if not members:
+                raise SigningError("No files to sign in the archive")
+
+            batch.file_count = len(members)
+
+            certificate = None
+            for index, info in members:
+                pipeline = SigningPipeline.from_request(
+                    self.request, self.query, info.filename
+                )
+                pipeline.signing_log.batch = batch
+                pipeline.certificate = certificate
+                self.pipelines[index] = pipeline
+
+                try:
+                    pipeline.prepare(ArchiveMember(archive, info))
+                except Exception as exc:
+                    pipeline.record_error(exc)
+                    if isinstance(exc, SigningError):
+                        raise BatchSigningFailed(
+                            f"{info.filename}: {exc}", exc
+                        ) from exc
+                    raise
+
+                certificate = pipeline.certificate
+
+    def sign_file(self, pipeline: SigningPipeline) -> Exception | None:
+        try:
+            pipeline.sign()
+        except Exception as exc:
+            pipeline.record_error(exc)
+            if not isinstance(exc, SigningError):
+                logger.exception("Signing %s failed", pipeline.signing_log.id)
+            return exc
+
+        return None
+
+    def _sign_file_in_thread(self, pipeline: SigningPipeline) -> Exception | None:
+        close_old_connections()
+        try:
+            return self.sign_file(pipeline)
+        finally:
+            connection.close()
+
+    def sign(self):
+        """Sign the files, BATCH_SIGNING_WORKERS at a time.
+
+        The signing slots still limit how many use the token at once, the
+        others are scanned in the meantime.
+        """
+        pipelines = list(self.pipelines.values())
+
+        if config.BATCH_SIGNING_WORKERS <= 0:
+            errors = [self.sign_file(pipeline) for pipeline in pipelines]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=config.BATCH_SIGNING_WORKERS,
+                thread_name_prefix="signing-batch",
+            ) as executor:
+                errors = list(executor.map(self._sign_file_in_thread, pipelines))
+
+        failed = [(pipeline, exc) for pipeline, exc in zip(pipelines, errors) if exc]
+        if failed:
+            pipeline, exc = failed[0]
+            raise BatchSigningFailed(
+                f"{len(failed)} of {len(pipelines)} files couldn't be signed, "
+                f"{pipeline.signing_log.submitted_file_name}: {exc}",
+                exc,
+            )
+
+        self.batch.result = SigningLog.Result.SUCCESS
+
+    def file_results(self) -> list[dict]:
+        return [
+            {
+                "file": pipeline.signing_log.submitted_file_name,
+                "result": pipeline.signing_log.result,
+                "detail": pipeline.signing_log.result_detail,
+            }
+            for pipeline in self.pipelines.values()
+        ]
+
+    def response(self) -> StreamingHttpResponse:
+        replacements = {
+            index: Path(pipeline.cmd.out_path)
+            for index, pipeline in self.pipelines.items()
+        }
+        return StreamingHttpResponse(
+            stream_archive(self.in_path, replacements),
+            content_type="application/zip",
+            headers={
+                "Content-Disposition": f'attachment; filename="{self.base_name}.zip"'
+            },
+        )
+
+    def record_error(self, exc: Exception):
+        batch = self.batch
+
+        if isinstance(exc, SigningError):
+            batch.result = exc.result
+            batch.result_detail = str(exc)
+        else:
+            batch.result = SigningLog.Result.INTERNAL_ERROR
+
+        # Files that were still waiting won't be signed anymore
+        for pipeline in self.pipelines.values():
+            if pipeline.signing_log.result == SigningLog.Result.PENDING:
+                pipeline.record_error(
+                    SigningCancelled("Another file in the batch couldn't be signed")
+                )
+
+    def finish(self):
+        for pipeline in self.pipelines.values():
+            pipeline.finish()
+
+        self.batch.finished = timezone.now()
+        self.batch.save()
@@ -0,0 +1,377 @@
+"""Windows catalog files, for signing a large set of files at once.
+
+A catalog (.cat) is a certificate trust list with the hash of every file it
+covers. Windows accepts a file as signed when its hash is in a signed catalog,
+so signing the catalog replaces signing each file. The catalog built here is
+unsigned, like the output of MakeCat, and is signed with osslsigncode.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import struct
+from typing import BinaryIO
+import zipfile
+
+from asn1crypto import algos, cms, core
+
+from .archives import ArchiveLimitExceeded, check_archive_limits
+from .authenticode import (
+    SPC_INDIRECT_DATA,
+    SPC_PE_IMAGE_DATA,
+    SpcAttributeTypeAndOptionalValue,
+    SpcIndirectDataContent,
+    SpcLink,
+    SpcString,
+)
+
+
+CTL = "1.3.6.1.4.1.311.10.1"
+CATALOG_LIST = "1.3.6.1.4.1.311.12.1.1"
+# Members with SHA-256 hashes, Windows 8 and later
+CATALOG_LIST_MEMBER_V2 = "1.3.6.1.4.1.311.12.1.3"
+CAT_NAMEVALUE = "1.3.6.1.4.1.311.12.2.1"
+CAT_MEMBERINFO = "1.3.6.1.4.1.311.12.2.2"
+SPC_CAB_DATA = "1.3.6.1.4.1.311.2.1.25"
+
+# Subject interface packages that hash the members
+PE_IMAGE_SIP = "{C689AAB8-8E78-11D0-8C47-00C04FC295EE}"
+FLAT_SIP = "{DE351A42-8E59-11D0-8C47-00C04FC295EE}"
+
+PE_EXTENSIONS = ["cpl", "dll", "drv", "efi", "exe", "mui", "ocx", "scr", "sys"]
+
+# CRYPTCAT_ATTR_AUTHENTICATED | CRYPTCAT_ATTR_NAMEASCII | CRYPTCAT_ATTR_DATAASCII
+NAME_VALUE_FLAGS = 0x10010001
+
+# Time of every generated list, see build_catalog
+CATALOG_THIS_UPDATE = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+OBSOLETE_LINK = SpcLink(
+    name="file", value=SpcString(name="unicode", value="<<<Obsolete>>>")
+)
+
+
+class InvalidCatalogInput(ValueError):
+    pass
+
+
+class SpcPeImageFlags(core.BitString):
+    _map = {
+        0: "include_resources",
+        1: "include_debug_info",
+        2: "include_import_address_table",
+    }
+
+
+class SpcPeImageData(core.Sequence):
+    _fields = [
+        ("flags", SpcPeImageFlags),
+        ("file", SpcLink, {"explicit": 0}),
+    ]
+
+
+class CatalogNameValue(core.Sequence):
+    _fields = [
+        ("tag", core.BMPString),
+        ("flags", core.Integer),
+        ("value", core.OctetString),
+    ]
+
+
+class CatalogMemberInfo(core.Sequence):
+    _fields = [
+        ("subject_guid", core.BMPString),
+        ("cert_version", core.Integer),
+    ]
+
+
+class SetOfAny(core.SetOf):
+    _child_spec = core.Any
+
+
+class CatalogAttribute(core.Sequence):
+    _fields = [
+        ("type", core.ObjectIdentifier),
+        ("values", SetOfAny),
+    ]
+
+
+class CatalogAttributes(core.SetOf):
+    _child_spec = CatalogAttribute
+
+
+class TrustedSubject(core.Sequence):
+    _fields = [
+        ("identifier", core.OctetString),
+        ("attributes", CatalogAttributes, {"optional": True}),
+    ]
+
+
+class TrustedSubjects(core.SequenceOf):
+    _child_spec = TrustedSubject
+
+
+class SubjectUsage(core.SequenceOf):
+    _child_spec = core.ObjectIdentifier
+
+
+class CertificateTrustList(core.Sequence):
+    _fields = [
+        ("subject_usage", SubjectUsage),
+        ("list_identifier", core.OctetString, {"optional": True}),
+        ("this_update", core.UTCTime),
+        ("subject_algorithm", SpcAttributeTypeAndOptionalValue),
+        ("trusted_subjects", TrustedSubjects, {"optional": True}),
+    ]
+
+
+class CatalogContentInfo(core.Sequence):
+    # Unlike asn1crypto's EncapsulatedContentInfo, the list isn't wrapped in
+    # an octet string
+    _fields = [
+        ("content_type", core.ObjectIdentifier),
+        ("content", CertificateTrustList, {"explicit": 0}),
+    ]
+
+
+class CatalogSignedData(core.Sequence):
+    _fields = [
+        ("version", cms.CMSVersion),
+        ("digest_algorithms", cms.DigestAlgorithms),
+        ("content_info", CatalogContentInfo),
+        ("signer_infos", cms.SignerInfos),
+    ]
+
+
+class Catalog(core.Sequence):
+    _fields = [
+        ("content_type", cms.ContentType),
+        ("content", CatalogSignedData, {"explicit": 0}),
+    ]
+
+
+@dataclass
+class CatalogMember:
+    name: str
+    # SHA-256, of the whole file or the Authenticode digest of PE images
+    digest: bytes
+    is_pe_image: bool = False
+
+
+def is_pe_name(name: str) -> bool:
+    _, _, extension = name.rpartition(".")
+    return extension.lower() in PE_EXTENSIONS
+
+
+def _hash_range(digest, f: BinaryIO, start: int, end: int):
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = f.read(min(remaining, 64 * 1024))
+        if not chunk:
+            raise InvalidCatalogInput("Unexpected end of PE file")
+        digest.update(chunk)
+        remaining -= len(chunk)
+
+
+def pe_authenticode_digest(f: BinaryIO, size: int) -> bytes:
+    """SHA-256 Authenticode digest of a PE image, the way osslsigncode does it.
+
+    Everything except the checksum, the certificate table directory entry,
+    and the certificate table itself is hashed. Unsigned files are padded to
+    8 bytes, like they are when a signature is added.
+    """
+    f.seek(0)
+    header = f.read(4096)
+    if header[:2] != b"MZ" or len(header) < 64:
+        raise InvalidCatalogInput("Not a PE file")
+
+    (pe_offset,) = struct.unpack_from("<I", header, 0x3C)
+    optional_header = pe_offset + 24
+    if header[pe_offset : pe_offset + 4] != b"PE\0\0" or optional_header + 2 > len(
+        header
+    ):
+        raise InvalidCatalogInput("Not a PE file")
+
+    (magic,) = struct.unpack_from("<H", header, optional_header)
+    if magic == 0x10B:
+        data_directories = optional_header + 96
+    elif magic == 0x20B:
+        data_directories = optional_header + 112
+    else:
+        raise InvalidCatalogInput("Unknown PE optional header")
+
+    checksum = optional_header + 64
+    certificate_entry = data_directories + 4 * 8
+    if certificate_entry + 8 > len(header):
+        raise InvalidCatalogInput("PE header is too large")
+
+    certificate_offset, certificate_size = struct.unpack_from(
+        "<II", header, certificate_entry
+    )
+    end = certificate_offset if certificate_offset and certificate_size else size
+    if end > size:
+        raise InvalidCatalogInput("PE certificate table is out of bounds")
+
+    digest = hashlib.sha256()
+    _hash_range(digest, f, 0, checksum)
+    _hash_range(digest, f, checksum + 4, certificate_entry)
+    _hash_range(digest, f, certificate_entry + 8, end)
+    if end == size and size % 8:
+        digest.update(bytes(8 - size % 8))
+
+    return digest.digest()
+
+
+def members_from_archive(path: str | os.PathLike) -> list[CatalogMember]:
+    """Hash the files in a zip archive."""
+    members = []
+    try:
+        with zipfile.ZipFile(path) as archive:
+            check_archive_limits(archive)
+
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+
+                # Seeking in a compressed member decompresses it again from
+                # the start, so only the PE header is read out of order
+                with archive.open(info) as f:
+                    if is_pe_name(info.filename):
+                        digest = pe_authenticode_digest(f, info.file_size)
+                    else:
+                        digest = hashlib.file_digest(f, "sha256").digest()
+
+                members.append(
+                    CatalogMember(
+                        os.path.basename(info.filename),
+                        digest,
+                        is_pe_image=is_pe_name(info.filename),
+                    )
+                )
+    except zipfile.BadZipFile as exc:
+        raise InvalidCatalogInput("Not a valid zip archive") from exc
+    except ArchiveLimitExceeded as exc:
+        raise InvalidCatalogInput(str(exc)) from exc
+
+    return members
+
+
+def members_from_manifest(data: bytes) -> list[CatalogMember]:
+    """Read a manifest like `{"files": [{"name": ..., "sha256": ...}, ...]}`.
+
+    The hash of PE images is their Authenticode digest. `pe` can be set on a
+    file to override whether it's treated as one, which otherwise depends on
+    the extension.
+    """
+    try:
+        files = json.loads(data)["files"]
+        members = [
+            CatalogMember(
+                file["name"],
+                bytes.fromhex(file["sha256"]),
+                is_pe_image=file.get("pe", is_pe_name(file["name"])),
+            )
+            for file in files
+        ]
+    except (ValueError, KeyError, TypeError) as exc:
+        raise InvalidCatalogInput(f"Invalid manifest: {exc!r}") from exc
+
+    for member in members:
+        if len(member.digest) != hashlib.sha256().digest_size:
+            raise InvalidCatalogInput(f"Invalid SHA-256 hash for {member.name}")
+
+    return members
+
+
+def _attribute(type: str, value: core.Asn1Value) -> CatalogAttribute:
+    return CatalogAttribute({"type": type, "values": [core.Any.load(value.dump())]})
+
+
+def _trusted_subject(member: CatalogMember) -> TrustedSubject:
+    if member.is_pe_image:
+        data = {
+            "type": SPC_PE_IMAGE_DATA,
+            "value": SpcPeImageData({"flags": set(), "file": OBSOLETE_LINK}),
+        }
+        sip = PE_IMAGE_SIP
+    else:
+        data = {"type": SPC_CAB_DATA, "value": OBSOLETE_LINK}
+        sip = FLAT_SIP
+
+    indirect_data = SpcIndirectDataContent(
+        {
+            "data": data,
+            "message_digest": algos.DigestInfo(
+                {
+                    "digest_algorithm": {"algorithm": "sha256"},
+                    "digest": member.digest,
+                }
+            ),
+        }
+    )
+
+    file_name = CatalogNameValue(
+        {
+            "tag": "File",
+            "flags": NAME_VALUE_FLAGS,
+            "value": (member.name + "\0").encode("utf-16-le"),
+        }
+    )
+    member_info = CatalogMemberInfo({"subject_guid": sip, "cert_version": 512})
+
+    # The tag Windows looks members up by is the hex hash
+    return TrustedSubject(
+        {
+            "identifier": member.digest.hex().upper().encode("utf-16-le"),
+            "attributes": [
+                _attribute(CAT_NAMEVALUE, file_name),
+                _attribute(CAT_MEMBERINFO, member_info),
+                _attribute(SPC_INDIRECT_DATA, indirect_data),
+            ],
+        }
+    )
+
+
+def build_catalog(
+    members: list[CatalogMember], this_update: datetime = CATALOG_THIS_UPDATE
+) -> bytes:
+    """Build an unsigned DER encoded catalog listing the members.
+
+    The same files always give the same catalog, whatever their order, so
+    identical requests can share the signed output. The members are sorted by
+    their hash, which the list identifier is derived from, and the time of the
+    list is fixed. When it was signed is recorded by the signature instead.
+    """
+    if not members:
+        raise InvalidCatalogInput("No files for the catalog")
+
+    members = sorted(members, key=lambda m: (m.digest, m.name))
+    list_identifier = hashlib.sha256(b"".join(m.digest for m in members)).digest()
+
+    trust_list = CertificateTrustList(
+        {
+            "subject_usage": [CATALOG_LIST],
+            "list_identifier": list_identifier[:16],
+            "this_update": this_update,
+            "subject_algorithm": {
+                "type": CATALOG_LIST_MEMBER_V2,
+                "value": core.Null(),
+            },
+            "trusted_subjects": [_trusted_subject(m) for m in members],
+        }
+    )
+
+    return Catalog(
+        {
+            "content_type": "signed_data",
+            "content": {
+                "version": "v1",
+                "digest_algorithms": [],
+                "content_info": {"content_type": CTL, "content": trust_list},
+                "signer_infos": [],
+            },
+        }
+    ).dump()
@@ -0,0 +1,300 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+import logging
+import os
+from pathlib import Path
+import socket
+import struct
+import subprocess
+import threading
+
+from .conf import config
+
+logger = logging.getLogger(__name__)
+
+
+class ClamdError(RuntimeError):
+    pass
+
+
+@dataclass
+class ClamAVResult:
+    clean: bool
+    detail: str
+
+
+def _parse_scan_reply(reply: str) -> ClamAVResult:
+    """Turn a clamd scan reply such as 'stream: OK' into a result.
+
+    Raises ClamdError for replies that don't contain a verdict.
+    """
+    if reply.endswith(" OK"):
+        return ClamAVResult(clean=True, detail=reply)
+    elif reply.endswith(" FOUND"):
+        return ClamAVResult(clean=False, detail=reply)
+    else:
+        raise ClamdError(f"clamd error: {reply}")
+
+
+class ClamdConnection:
+    """Single connection to clamd kept open with IDSESSION.
+
+    clamd closes connections after each command unless a session is started.
+    Inside a session replies are prefixed with the request number, which is
+    checked to make sure we never read a reply meant for a different command.
+    """
+
+    def __init__(self, address: str | Path, timeout: float):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(str(address))
+            self.sock.sendall(b"zIDSESSION\0")
+        except Exception:
+            self.sock.close()
+            raise
+
+        self.request_id = 0
+        self.buffer = b""
+
+    def close(self):
+        try:
+            self.sock.sendall(b"zEND\0")
+        except Exception:
+            pass
+        self.sock.close()
+
+    def _read_reply(self) -> str:
+        while b"\0" not in self.buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionResetError("clamd closed the connection")
+            self.buffer += data
+
+        reply, _, self.buffer = self.buffer.partition(b"\0")
+        reply_id, sep, text = reply.decode(errors="replace").partition(": ")
+        if not sep or reply_id != str(self.request_id):
+            raise ClamdError(f"Unexpected clamd reply: {reply!r}")
+
+        return text
+
+    def command(self, command: str) -> str:
+        self.request_id += 1
+        self.sock.sendall(b"z" + command.encode() + b"\0")
+        return self._read_reply()
+
+    def start_instream(self):
+        self.request_id += 1
+        self.sock.sendall(b"zINSTREAM\0")
+
+    def send_chunk(self, chunk: bytes):
+        if chunk:
+            self.sock.sendall(struct.pack("!L", len(chunk)) + chunk)
+
+    def finish_instream(self) -> ClamAVResult:
+        self.sock.sendall(struct.pack("!L", 0))
+        return _parse_scan_reply(self._read_reply())
+
+
+class ClamdPool:
+    """Keeps idle clamd connections around so they can be reused by requests.
+
+    A connection that raised an error is never returned to the pool. clamd drops
+    idle sessions after its IdleTimeout, so a stale connection is retried once
+    with a fresh one.
+    """
+
+    def __init__(self, address: str | Path, timeout: float = 30, max_idle: int = 4):
+        self.address = address
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle: list[ClamdConnection] = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def acquire(self) -> tuple[ClamdConnection, bool]:
+        """Get a connection and whether it came from the idle list."""
+        with self.lock:
+            if self.pid != os.getpid():
+                # Forked: the sockets belong to the parent process
+                self.idle = []
+                self.pid = os.getpid()
+
+            if self.idle:
+                return self.idle.pop(), True
+
+        return ClamdConnection(self.address, self.timeout), False
+
+    def release(self, conn: ClamdConnection):
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(conn)
+                return
+
+        conn.close()
+
+    def discard(self, conn: ClamdConnection):
+        try:
+            conn.sock.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+
+        for conn in idle:
+            conn.close()
+
+    def _run(self, func):
+        # Reused connections may have been closed by clamd in the meantime
+        for attempt in range(2):
+            conn, reused = self.acquire()
+            try:
+                result = func(conn)
+            except OSError as exc:
+                self.discard(conn)
+                if reused and attempt == 0 and not isinstance(exc, TimeoutError):
+                    continue
+                raise
+            except Exception:
+                self.discard(conn)
+                raise
+            self.release(conn)
+            return result
+
+    def ping(self) -> bool:
+        return self._run(lambda conn: conn.command("PING")) == "PONG"
+
+    def version(self) -> str:
+        return self._run(lambda conn: conn.command("VERSION"))
+
+    def scan_path(self, path: str | Path) -> ClamAVResult:
+        """Let clamd open and scan the file itself."""
+        return self._run(
+            lambda conn: _parse_scan_reply(
+                conn.command(f"SCAN {Path(path).absolute()}")
+            )
+        )
+
+    def instream(self) -> "InstreamSession":
+        conn, reused = self.acquire()
+        if reused:
+            # Data streamed into a dead connection can't be replayed, so check
+            # the connection up front.
+            try:
+                reply = conn.command("PING")
+                if reply != "PONG":
+                    raise ClamdError(f"Unexpected PING reply: {reply!r}")
+            except (OSError, ClamdError):
+                self.discard(conn)
+                conn = ClamdConnection(self.address, self.timeout)
+
+        try:
+            return InstreamSession(self, conn)
+        except Exception:
+            self.discard(conn)
+            raise
+
+    def scan_file(self, path: str | Path, chunk_size: int = 1024 * 1024):
+        """Stream the file contents to clamd with INSTREAM."""
+
+        def do_scan(conn: ClamdConnection):
+            conn.start_instream()
+            with open(path, "rb") as f:
+                while chunk := f.read(chunk_size):
+                    conn.send_chunk(chunk)
+            return conn.finish_instream()
+
+        return self._run(do_scan)
+
+
+class InstreamSession:
+    """Incrementally send data to clamd using INSTREAM.
+
+    Used as a context manager: the connection goes back to the pool only if the
+    stream was finished without errors.
+    """
+
+    def __init__(self, pool: ClamdPool, conn: ClamdConnection):
+        self.pool = pool
+        self.conn = conn
+        self.conn.start_instream()
+
+    def send(self, chunk: bytes):
+        self.conn.send_chunk(chunk)
+
+    def finish(self) -> ClamAVResult:
+        result = self.conn.finish_instream()
+        self.pool.release(self.conn)
+        self.conn = None
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ex_type, ex_value, ex_traceback):
+        if self.conn is not None:
+            self.pool.discard(self.conn)
+            self.conn = None
+
+
+_pools: dict[str, ClamdPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_clamd_pool() -> ClamdPool | None:
+    """Return the process-wide pool for the configured clamd socket, if any."""
+    if not config.CLAMD_SOCKET:
+        return None
+
+    address = str(config.CLAMD_SOCKET)
+    with _pools_lock:
+        if address not in _pools:
+            _pools[address] = ClamdPool(address, timeout=config.CLAMD_TIMEOUT)
+        return _pools[address]
+
+
+def clamscan_file(path: str | Path) -> ClamAVResult:
+    """Scan a file by running the CLAMSCAN_PATH program."""
+    clamscan = subprocess.run(
+        [
+            config.CLAMSCAN_PATH,
+            "--no-summary",
+            str(path),
+        ],
+        timeout=config.CLAMD_TIMEOUT,
+        text=True,
+        capture_output=True,
+    )
+
+    return ClamAVResult(clean=clamscan.returncode == 0, detail=clamscan.stdout.strip())
+
+
+def clamav_scan_file(path: str | Path) -> ClamAVResult:
+    """Scan a file with clamd if configured, falling back to CLAMSCAN_PATH."""
+    pool = get_clamd_pool()
+    if pool:
+        try:
+            return pool.scan_file(path)
+        except (OSError, ClamdError):
+            logger.exception("clamd scan failed, falling back to CLAMSCAN_PATH")
+
+    return clamscan_file(path)
+
+
+_scan_executor: ThreadPoolExecutor | None = None
+_scan_executor_pid: int | None = None
+_scan_executor_lock = threading.Lock()
+
+
+def start_clamav_scan(path: str | Path) -> Future:
+    """Run clamav_scan_file in the background, in this process's scan pool."""
+    global _scan_executor, _scan_executor_pid
+
+    with _scan_executor_lock:
+        if _scan_executor is None or _scan_executor_pid != os.getpid():
+            _scan_executor = ThreadPoolExecutor(thread_name_prefix="clamav-scan")
+            _scan_executor_pid = os.getpid()
+
+        return _scan_executor.submit(clamav_scan_file, path)
@@ -1,3 +1,4 @@
+from datetime import timedelta
 from functools import cached_property
 from pathlib import Path
 
@@ -21,10 +22,112 @@ class Configuration:
     def OSSLSIGNCODE_PATH(self) -> str:
         return getattr(settings, "OSSLSIGNCODE_PATH", None) or "osslsigncode"
 
+    @cached_property
+    def OPENSSL_PATH(self) -> str:
+        return getattr(settings, "OPENSSL_PATH", None) or "openssl"
+
     @cached_property
     def CLAMSCAN_PATH(self) -> str:
         return getattr(settings, "CLAMSCAN_PATH", None) or "/usr/bin/clamdscan"
 
+    @cached_property
+    def CLAMD_SOCKET(self) -> Path | None:
+        if path := getattr(settings, "CLAMD_SOCKET", None):
+            return Path(path)
+        return None
+
+    @cached_property
+    def CLAMD_TIMEOUT(self) -> float:
+        return float(getattr(settings, "CLAMD_TIMEOUT", None) or 30)
+
+    @cached_property
+    def SIGNING_JOB_WORKERS(self) -> int:
+        workers = getattr(settings, "SIGNING_JOB_WORKERS", None)
+        return 2 if workers is None else int(workers)
+
+    @cached_property
+    def SIGNING_JOB_TIMEOUT(self) -> timedelta:
+        return timedelta(seconds=getattr(settings, "SIGNING_JOB_TIMEOUT", None) or 7200)
+
+    @cached_property
+    def BATCH_SIGNING_WORKERS(self) -> int:
+        workers = getattr(settings, "BATCH_SIGNING_WORKERS", None)
+        return 4 if workers is None else int(workers)
+
+    @cached_property
+    def ARCHIVE_MAX_MEMBERS(self) -> int:
+        members = getattr(settings, "ARCHIVE_MAX_MEMBERS", None)
+        return 10000 if members is None else int(members)
+
+    @cached_property
+    def ARCHIVE_MAX_SIZE(self) -> int:
+        size = getattr(settings, "ARCHIVE_MAX_SIZE", None)
+        return 2 * 1024**3 if size is None else int(size)
+
+    @cached_property
+    def ARCHIVE_MAX_COMPRESSION_RATIO(self) -> float:
+        ratio = getattr(settings, "ARCHIVE_MAX_COMPRESSION_RATIO", None)
+        return 100.0 if ratio is None else float(ratio)
+
+    @cached_property
+    def SIGNING_LOG_WRITER(self) -> bool:
+        return bool(getattr(settings, "SIGNING_LOG_WRITER", None))
+
+    @cached_property
+    def FILE_KEY_SIGNING_CONCURRENCY(self) -> int:
+        return int(getattr(settings, "FILE_KEY_SIGNING_CONCURRENCY", None) or 4)
+
+    @cached_property
+    def SIGNING_QUEUE_MAX_DEPTH(self) -> int:
+        depth = getattr(settings, "SIGNING_QUEUE_MAX_DEPTH", None)
+        return 20 if depth is None else int(depth)
+
+    @cached_property
+    def SIGNING_QUEUE_TIMEOUT(self) -> float:
+        return float(getattr(settings, "SIGNING_QUEUE_TIMEOUT", 300))
+
+    @cached_property
+    def SIGNING_QUEUE_RETRY_AFTER(self) -> int:
+        return int(getattr(settings, "SIGNING_QUEUE_RETRY_AFTER", None) or 30)
+
+    @cached_property
+    def TSA_FAILURE_THRESHOLD(self) -> int:
+        return int(getattr(settings, "TSA_FAILURE_THRESHOLD", None) or 3)
+
+    @cached_property
+    def TSA_CIRCUIT_BREAK(self) -> timedelta:
+        return timedelta(seconds=getattr(settings, "TSA_CIRCUIT_BREAK", 300))
+
+    @cached_property
+    def TSA_HEDGING(self) -> int:
+        hedging = getattr(settings, "TSA_HEDGING", None)
+        return max(int(2 if hedging is None else hedging), 1)
+
+    @cached_property
+    def TSA_PROBE_TIMEOUT(self) -> float:
+        return float(getattr(settings, "TSA_PROBE_TIMEOUT", None) or 10)
+
+    @cached_property
+    def OUTPUT_CACHE_TTL(self) -> timedelta:
+        return timedelta(seconds=getattr(settings, "OUTPUT_CACHE_TTL", None) or 0)
+
+    @cached_property
+    def OUTPUT_CACHE_MAX_SIZE(self) -> int:
+        return getattr(settings, "OUTPUT_CACHE_MAX_SIZE", None) or 0
+
+    @cached_property
+    def FILE_RETENTION_DAYS(self) -> timedelta:
+        return timedelta(days=getattr(settings, "FILE_RETENTION_DAYS", None) or 0)
+
+    @cached_property
+    def MAINTENANCE_IN_PROCESS(self) -> bool:
+        enabled = getattr(settings, "MAINTENANCE_IN_PROCESS", None)
+        return True if enabled is None else bool(enabled)
+
+    @cached_property
+    def TOKEN_SESSION_WINDOW(self) -> float:
+        return float(getattr(settings, "TOKEN_SESSION_WINDOW", None) or 900)
+
     @cached_property
     def PIN_COMMS_LOCATION(self) -> Path:
         return Path(
@@ -41,6 +144,16 @@ class Configuration:
     def VIRUS_TOTAL_API_KEY(self) -> str | None:
         return getattr(settings, "VIRUS_TOTAL_API_KEY", None)
 
+    @cached_property
+    def VIRUS_TOTAL_REQUESTS_PER_MINUTE(self) -> int:
+        limit = getattr(settings, "VIRUS_TOTAL_REQUESTS_PER_MINUTE", None)
+        return 4 if limit is None else int(limit)
+
+    @cached_property
+    def VIRUS_TOTAL_REQUESTS_PER_DAY(self) -> int:
+        limit = getattr(settings, "VIRUS_TOTAL_REQUESTS_PER_DAY", None)
+        return 500 if limit is None else int(limit)
+
     @cached_property
     def TEST_CERTIFICATE_DIRECTORY(self) -> Path:
         return Path(
@@ -21,16 +21,30 @@ class ExternalValue:
         self.response_file = str(config.PIN_COMMS_LOCATION / f"responses/{name}")
         self.socket = None
 
-    def __enter__(self):
+    def write_request(self):
         to_write = json.dumps(self.req_data)
         with open(self.tmp_request_file, "w") as f:
             f.write(to_write)
 
         os.rename(self.tmp_request_file, self.request_file)
 
+    def update(self, req_data: dict):
+        """Replace the request, e.g. to show progress while waiting."""
+        self.req_data = req_data
+        self.write_request()
+
+    def __enter__(self):
+        # The agent is notified as soon as the request file appears, so it
+        # must be able to answer by then
         self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
         self.socket.bind(self.response_file)
 
+        try:
+            self.write_request()
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+
         return self
 
     def __exit__(self, ex_type, ex_value, ex_traceback):
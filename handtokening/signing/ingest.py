@@ -0,0 +1,98 @@
+from dataclasses import dataclass
+import hashlib
+import logging
+from pathlib import Path
+from time import monotonic
+from typing import Iterable
+
+from .clamav import (
+    ClamAVResult,
+    ClamdError,
+    InstreamSession,
+    clamav_scan_file,
+    get_clamd_pool,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IngestResult:
+    size: int
+    sha256: str
+    clamav: ClamAVResult | None
+    # Seconds spent waiting for ClamAV's verdict after the upload
+    clamav_time: float | None = None
+    # Seconds of the upload spent hashing
+    hash_time: float = 0.0
+
+
+def _open_instream() -> InstreamSession | None:
+    pool = get_clamd_pool()
+    if not pool:
+        return None
+
+    try:
+        return pool.instream()
+    except (OSError, ClamdError):
+        logger.exception("Couldn't start clamd INSTREAM, will scan after upload")
+        return None
+
+
+def ingest_file(
+    chunks: Iterable[bytes], path: str | Path, scan_after: bool = True
+) -> IngestResult:
+    """Write the chunks to path while hashing and ClamAV scanning them.
+
+    Each chunk is passed to the file, the SHA-256 digest, and a clamd INSTREAM
+    session in one go so the file doesn't have to be read back afterwards. If
+    clamd isn't configured or the stream fails (e.g. clamd's StreamMaxLength is
+    exceeded), the written file is scanned by clamav_scan_file instead, unless
+    `scan_after` is false. Then the result has no ClamAV verdict and the
+    caller scans the file.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    hash_time = 0.0
+    session = _open_instream()
+    clamav: ClamAVResult | None = None
+
+    try:
+        with open(path, "wb") as on_disk:
+            for chunk in chunks:
+                on_disk.write(chunk)
+                hash_start = monotonic()
+                digest.update(chunk)
+                hash_time += monotonic() - hash_start
+                size += len(chunk)
+
+                if session:
+                    try:
+                        session.send(chunk)
+                    except OSError:
+                        logger.exception("clamd INSTREAM failed during upload")
+                        session.__exit__(None, None, None)
+                        session = None
+
+        if session:
+            start = monotonic()
+            try:
+                clamav = session.finish()
+            except (OSError, ClamdError):
+                logger.exception("clamd INSTREAM failed at end of upload")
+    finally:
+        if session:
+            session.__exit__(None, None, None)
+
+    if clamav is None and scan_after:
+        start = monotonic()
+        clamav = clamav_scan_file(path)
+
+    return IngestResult(
+        size=size,
+        sha256=digest.hexdigest(),
+        clamav=clamav,
+        clamav_time=monotonic() - start if clamav else None,
+        hash_time=hash_time,
+    )
@@ -0,0 +1,124 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+import os
+import threading
+from time import monotonic
+
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from .conf import config
+from .models import SigningBatch, SigningLog
+from .pipeline import SigningError, SigningPipeline
+
+
+logger = logging.getLogger(__name__)
+
+
+_executor: ThreadPoolExecutor | None = None
+_executor_pid: int | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return this process's signing job pool.
+
+    Gunicorn forks its workers after loading the application, so the pool is
+    created lazily inside the worker that first needs it.
+    """
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=config.SIGNING_JOB_WORKERS,
+                thread_name_prefix="signing-job",
+            )
+            _executor_pid = os.getpid()
+
+        return _executor
+
+
+def run_job(pipeline: SigningPipeline):
+    try:
+        pipeline.sign()
+    except Exception as exc:
+        pipeline.record_error(exc)
+        if not isinstance(exc, SigningError):
+            logger.exception("Signing job %s failed", pipeline.signing_log.id)
+    finally:
+        pipeline.finish()
+
+
+def _run_job_in_thread(pipeline: SigningPipeline):
+    close_old_connections()
+    try:
+        run_job(pipeline)
+    finally:
+        connection.close()
+
+
+def submit_job(pipeline: SigningPipeline) -> Future | None:
+    """Run the remaining stages of the pipeline in the background.
+
+    With SIGNING_JOB_WORKERS set to 0 the job is run before returning instead.
+    Otherwise a job waiting for VirusTotal doesn't take up a worker, it's only
+    submitted once the analysis is done, or the pipeline gives up waiting for
+    it.
+    """
+    if config.SIGNING_JOB_WORKERS <= 0:
+        run_job(pipeline)
+        return None
+
+    vt_future = pipeline.start_virus_total_scan()
+    if vt_future is None or vt_future.done():
+        return get_executor().submit(_run_job_in_thread, pipeline)
+
+    job_future = Future()
+
+    def pass_on(future: Future):
+        if future.exception() is not None:
+            job_future.set_exception(future.exception())
+        else:
+            job_future.set_result(future.result())
+
+    submitted = threading.Lock()
+
+    def submit(_=None):
+        if not submitted.acquire(blocking=False):
+            return
+        timer.cancel()
+        future = get_executor().submit(_run_job_in_thread, pipeline)
+        future.add_done_callback(pass_on)
+
+    timer = threading.Timer(max(pipeline.vt_deadline - monotonic(), 0), submit)
+    timer.daemon = True
+    timer.start()
+    vt_future.add_done_callback(submit)
+    return job_future
+
+
+def fail_abandoned_requests() -> str:
+    """Fail the requests still pending SIGNING_JOB_TIMEOUT after they started.
+
+    Jobs, and requests signed inside the request, only live in their worker
+    process. When it's restarted or killed before finishing them, nothing else
+    would update their logs.
+    """
+    now = timezone.now()
+    abandoned = {
+        "result": SigningLog.Result.INTERNAL_ERROR,
+        "result_detail": "Abandoned, the worker process exited before finishing",
+        "finished": now,
+        "updated": now,
+    }
+    cutoff = now - config.SIGNING_JOB_TIMEOUT
+
+    count = SigningLog.objects.filter(
+        result=SigningLog.Result.PENDING, created__lt=cutoff
+    ).update(**abandoned)
+    SigningBatch.objects.filter(
+        result=SigningLog.Result.PENDING, created__lt=cutoff
+    ).update(**abandoned)
+
+    return f"Failed {count} abandoned signing requests"
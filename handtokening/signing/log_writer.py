@@ -0,0 +1,154 @@
+"""Writing finished SigningLogs in the background, see SIGNING_LOG_WRITER.
+
+With SQLite every write waits for the database lock, which other workers can
+hold for a while. The final update of a signing log isn't needed to answer
+the request, so it's handed to a writer thread instead. The writer saves
+whatever queued up in one transaction, so the workers take the lock less
+often, and saves a log only once if it was queued several times.
+"""
+
+import atexit
+import copy
+from dataclasses import dataclass, field
+import logging
+import os
+import queue
+import threading
+from time import monotonic, sleep
+
+from django.db import DatabaseError, OperationalError, close_old_connections
+from django.db import connection, transaction
+
+from .conf import config
+from .models import SigningLog
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueuedLog:
+    signing_log: SigningLog | None
+    saved: threading.Event = field(default_factory=threading.Event)
+
+
+class SigningLogWriter:
+    # Logs saved in one transaction at most
+    max_batch = 100
+    # How long to wait for more logs to save in the same transaction
+    batch_delay = 0.05
+    # Wait before trying again when the database is locked for too long
+    retry_delay = 1.0
+
+    def __init__(self):
+        self.queue: queue.Queue[QueuedLog] = queue.Queue()
+
+    def start(self):
+        thread = threading.Thread(
+            target=self.run, name="signing-log-writer", daemon=True
+        )
+        thread.start()
+
+    def save(self, signing_log: SigningLog, wait: bool = False):
+        """Queue the log to be saved, as it is now.
+
+        With `wait`, return once it's saved, for when other requests need to
+        see it right away.
+        """
+        queued = QueuedLog(copy.copy(signing_log))
+        self.queue.put(queued)
+        if wait:
+            queued.saved.wait()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until everything queued so far is saved."""
+        queued = QueuedLog(None)
+        self.queue.put(queued)
+        return queued.saved.wait(timeout)
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+
+            deadline = monotonic() + self.batch_delay
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get(timeout=deadline - monotonic()))
+                except (queue.Empty, ValueError):
+                    break
+
+            close_old_connections()
+            try:
+                self.write(batch)
+            except Exception:
+                logger.exception("Couldn't save signing logs")
+            finally:
+                for queued in batch:
+                    queued.saved.set()
+
+    def write(self, batch: list[QueuedLog]):
+        # Only the last queued state of each log needs to be saved
+        latest: dict[int, SigningLog] = {}
+        for queued in batch:
+            if queued.signing_log is not None:
+                latest[queued.signing_log.id] = queued.signing_log
+        if not latest:
+            return
+
+        while True:
+            try:
+                with transaction.atomic():
+                    for signing_log in latest.values():
+                        signing_log.save()
+                return
+            except OperationalError as exc:
+                if "locked" not in str(exc):
+                    break
+
+                # Locked for longer than the database timeout, don't lose the
+                # logs over it
+                logger.warning("Retrying saving signing logs: %s", exc)
+                connection.close()
+                sleep(self.retry_delay)
+            except DatabaseError:
+                break
+
+        # Something is wrong with one of them, save the others
+        for signing_log in latest.values():
+            try:
+                signing_log.save()
+            except DatabaseError:
+                logger.exception("Couldn't save signing log %s", signing_log.id)
+
+
+_writer: SigningLogWriter | None = None
+_writer_pid: int | None = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> SigningLogWriter:
+    """Return this process's writer, starting it on first use."""
+    global _writer, _writer_pid
+
+    with _writer_lock:
+        if _writer is None or _writer_pid != os.getpid():
+            _writer = SigningLogWriter()
+            _writer.start()
+            _writer_pid = os.getpid()
+
+        return _writer
+
+
+def save_signing_log(signing_log: SigningLog, wait: bool = False):
+    """Save the log directly, or through the writer with SIGNING_LOG_WRITER."""
+    if config.SIGNING_LOG_WRITER:
+        get_writer().save(signing_log, wait=wait)
+    else:
+        signing_log.save()
+
+
+@atexit.register
+def _flush_on_exit():
+    # Gunicorn workers exit normally on shutdown and restarts
+    if _writer is not None and _writer_pid == os.getpid():
+        _writer.flush(timeout=10)
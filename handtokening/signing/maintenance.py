@@ -0,0 +1,287 @@
+"""Periodic housekeeping, run by one process for all workers.
+
+Every worker process starts a scheduler thread on its first request, unless
+MAINTENANCE_IN_PROCESS is off, and `django-admin run_maintenance` runs one
+outside the web workers. On each server, only the scheduler holding the lock
+file competes for the MaintenanceLease in the database, and only the one
+holding the lease runs tasks. The others take over when its process exits and
+the lease expires. Tasks that deal with the server's own STATE_DIRECTORY run
+on every server, by the scheduler holding its lock file. When each task ran,
+how long it took, and how it went is recorded in its MaintenanceTask.
+"""
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+import fcntl
+import logging
+import os
+import socket
+import threading
+from time import monotonic, sleep
+from typing import IO, Callable
+import uuid
+
+from django.db import close_old_connections, connection
+from django.db.models import Q
+from django.utils import timezone
+
+from handtokening.clients.models import delete_expired_secrets
+
+from .conf import config
+from .jobs import fail_abandoned_requests
+from .models import (
+    MaintenanceLease,
+    MaintenanceTask,
+    SigningBatch,
+    SigningLog,
+    VirusTotalSubmission,
+)
+from .timings import roll_up_stage_timings
+from .virustotal import files_due_for_refresh, queue_vt_analysis
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Task:
+    name: str
+    interval: timedelta
+    # Returns a short summary of what was done
+    run: Callable[[], str]
+    # Runs on every server rather than once for the whole deployment
+    per_server: bool = False
+
+    @property
+    def record_name(self) -> str:
+        if self.per_server:
+            return f"{self.name}@{socket.gethostname()}"
+        return self.name
+
+
+def delete_expired_client_secrets() -> str:
+    """Like `django-admin delete_expired_client_secrets`."""
+    return f"Deleted {delete_expired_secrets()} expired secrets"
+
+
+def remove_old_files() -> str:
+    """Remove uploads and signed files that weren't used for FILE_RETENTION_DAYS.
+
+    Signed files reused from the output cache count as used, and files still
+    waiting for a VirusTotal analysis are kept. The signing logs and batches
+    of removed files get their paths cleared, so nothing tries to read them
+    later.
+    """
+    if not config.FILE_RETENTION_DAYS:
+        return "Keeping all files"
+
+    cutoff = (timezone.now() - config.FILE_RETENTION_DAYS).timestamp()
+    in_use = set(
+        VirusTotalSubmission.objects.filter(
+            status__in=[
+                VirusTotalSubmission.Status.QUEUED,
+                VirusTotalSubmission.Status.POLLING,
+            ]
+        ).values_list("path", flat=True)
+    )
+    removed = []
+    size = 0
+
+    for directory in ["in", "out"]:
+        for entry in os.scandir(config.STATE_DIRECTORY / directory):
+            try:
+                if not entry.is_file() or entry.path in in_use:
+                    continue
+                stat = entry.stat()
+                if stat.st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed.append(entry.path)
+                    size += stat.st_size
+            except OSError:
+                logger.exception("Couldn't remove %s", entry.path)
+
+    for start in range(0, len(removed), 500):
+        paths = removed[start : start + 500]
+        SigningLog.objects.filter(in_path__in=paths).update(in_path=None)
+        SigningLog.objects.filter(out_path__in=paths).update(out_path=None)
+        SigningBatch.objects.filter(in_path__in=paths).update(in_path=None)
+
+    return f"Removed {len(removed)} files ({size} bytes)"
+
+
+def refresh_virus_total_analyses() -> str:
+    """Like `django-admin refresh_virus_total_analyses`, without waiting."""
+    if not config.VIRUS_TOTAL_API_KEY:
+        return "VirusTotal isn't configured"
+
+    due = files_due_for_refresh(timedelta(days=1), timedelta(days=30))
+    for sha256, path in due.items():
+        queue_vt_analysis(path, sha256, max_age=timedelta(0))
+
+    return f"Queued {len(due)} analyses"
+
+
+TASKS = [
+    Task(
+        "delete_expired_client_secrets",
+        timedelta(hours=1),
+        delete_expired_client_secrets,
+    ),
+    Task("remove_old_files", timedelta(hours=1), remove_old_files, per_server=True),
+    Task("fail_abandoned_requests", timedelta(minutes=10), fail_abandoned_requests),
+    Task(
+        "refresh_virus_total_analyses", timedelta(days=1), refresh_virus_total_analyses
+    ),
+    Task("roll_up_stage_timings", timedelta(minutes=10), roll_up_stage_timings),
+]
+
+
+class MaintenanceScheduler:
+    # How often the tasks are checked, and leadership is tried for
+    tick = 60.0
+    # How long the lease lasts without being renewed. It's renewed every tick,
+    # before every task, and every tick while a task runs
+    lease = timedelta(minutes=5)
+
+    def __init__(self, tasks: list[Task] = TASKS):
+        self.tasks = tasks
+        self.leader_lock_file: IO | None = None
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="maintenance", daemon=True)
+        thread.start()
+
+    def run(self):
+        while True:
+            close_old_connections()
+            try:
+                self.run_due()
+            except Exception:
+                logger.exception("Maintenance scheduler error")
+
+            sleep(self.tick)
+
+    def is_leader(self) -> bool:
+        if self.leader_lock_file:
+            return True
+
+        lock_file = open(config.STATE_DIRECTORY / "locks" / "maintenance.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        self.leader_lock_file = lock_file
+        return True
+
+    def renew_lease(self) -> bool:
+        """Take or extend the deployment's lease, if no one else holds it."""
+        now = timezone.now()
+        MaintenanceLease.objects.get_or_create(
+            pk=1, defaults={"holder": self.holder, "expires": now}
+        )
+        return bool(
+            MaintenanceLease.objects.filter(
+                Q(holder=self.holder) | Q(expires__lte=now), pk=1
+            ).update(holder=self.holder, expires=now + self.lease)
+        )
+
+    @contextmanager
+    def keeping_lease(self):
+        """Keep renewing the lease while a task runs for longer than a tick."""
+        done = threading.Event()
+
+        def renew():
+            try:
+                while not done.wait(self.tick):
+                    try:
+                        if not self.renew_lease():
+                            logger.warning("Lost the maintenance lease during a task")
+                    except Exception:
+                        logger.exception("Couldn't renew the maintenance lease")
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=renew, name="maintenance-lease", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def run_due(self) -> list[MaintenanceTask]:
+        """Run the tasks whose interval passed, if this is the leader.
+
+        Per-server tasks only need this server's lock file, the others the
+        lease too.
+        """
+        if not self.is_leader():
+            return []
+
+        # Even when nothing is due, so the lease doesn't lapse between tasks
+        has_lease = self.renew_lease()
+
+        ran = []
+        for task in self.tasks:
+            record, _ = MaintenanceTask.objects.get_or_create(name=task.record_name)
+            if record.next_run > timezone.now():
+                continue
+
+            if task.per_server:
+                self.run_task(task, record)
+            else:
+                # The tasks before this one may have taken a while
+                if not (has_lease and self.renew_lease()):
+                    continue
+                with self.keeping_lease():
+                    self.run_task(task, record)
+            ran.append(record)
+
+        return ran
+
+    def run_task(self, task: Task, record: MaintenanceTask | None = None):
+        if record is None:
+            record, _ = MaintenanceTask.objects.get_or_create(name=task.record_name)
+
+        record.last_started = timezone.now()
+        start = monotonic()
+        try:
+            record.last_output = task.run()
+            record.last_error = None
+        except Exception as exc:
+            logger.exception("Maintenance task %s failed", task.name)
+            record.last_output = None
+            record.last_error = f"{type(exc).__name__}: {exc}"
+            record.failure_count += 1
+
+        record.last_duration = monotonic() - start
+        record.last_finished = timezone.now()
+        record.next_run = record.last_started + task.interval
+        record.run_count += 1
+        record.save()
+
+        return record
+
+
+_scheduler: MaintenanceScheduler | None = None
+_scheduler_pid: int | None = None
+_scheduler_lock = threading.Lock()
+
+
+def start_maintenance(**kwargs):
+    """Start this process's scheduler, if it isn't running yet.
+
+    Connected to request_started, so it's started in the worker processes and
+    not in a gunicorn master that preloads the application before forking.
+    """
+    global _scheduler, _scheduler_pid
+
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler_pid != os.getpid():
+            _scheduler = MaintenanceScheduler()
+            _scheduler.start()
+            _scheduler_pid = os.getpid()
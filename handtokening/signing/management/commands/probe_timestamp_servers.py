@@ -0,0 +1,31 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from handtokening.signing.timestamping import probe_timestamp_servers
+
+
+class Command(BaseCommand):
+    help = (
+        "Request a timestamp from every enabled timestamp server and record how it went"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Keep probing, waiting this many seconds between rounds",
+        )
+
+    def handle(self, *args, **kwargs):
+        interval = kwargs["interval"]
+
+        while True:
+            for server, result in probe_timestamp_servers():
+                outcome = "ok" if result.success else result.error
+                self.stdout.write(f"{server.name}: {outcome} ({result.latency:.2f}s)")
+
+            if not interval:
+                break
+
+            sleep(interval)
@@ -0,0 +1,53 @@
+from concurrent.futures import wait
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from handtokening.signing.virustotal import files_due_for_refresh, refresh_vt_analysis
+
+
+class Command(BaseCommand):
+    help = (
+        "Have VirusTotal analyse recently signed files again before their "
+        "analysis goes stale"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--margin",
+            type=float,
+            default=1,
+            help="Refresh analyses that go stale within this many days",
+        )
+        parser.add_argument(
+            "--recent",
+            type=float,
+            default=30,
+            help="Only refresh files signed in the last this many days",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=3600,
+            help="Seconds to wait for the analyses, they continue in the background",
+        )
+
+    def handle(self, *args, **kwargs):
+        due = files_due_for_refresh(
+            timedelta(days=kwargs["margin"]), timedelta(days=kwargs["recent"])
+        )
+        self.stdout.write(f"Refreshing {len(due)} analyses")
+
+        futures = {
+            refresh_vt_analysis(path, sha256): sha256 for sha256, path in due.items()
+        }
+        wait(futures, timeout=kwargs["timeout"])
+
+        for future, sha256 in futures.items():
+            if not future.done():
+                outcome = "pending"
+            elif future.exception():
+                outcome = str(future.exception())
+            else:
+                outcome = f"ok ({future.result().api_calls} API calls)"
+            self.stdout.write(f"{sha256}: {outcome}")
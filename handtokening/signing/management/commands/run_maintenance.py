@@ -0,0 +1,47 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand, CommandError
+
+from handtokening.signing.maintenance import TASKS, MaintenanceScheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the housekeeping tasks on their schedule, for when the web workers "
+        "don't run them (MAINTENANCE_IN_PROCESS)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Run the tasks that are due and exit",
+        )
+        parser.add_argument(
+            "--task",
+            choices=[task.name for task in TASKS],
+            help="Run this task right away and exit",
+        )
+
+    def handle(self, *args, **kwargs):
+        scheduler = MaintenanceScheduler()
+
+        if task_name := kwargs["task"]:
+            task = next(task for task in TASKS if task.name == task_name)
+            self.write_result(scheduler.run_task(task))
+            return
+
+        while True:
+            for record in scheduler.run_due():
+                self.write_result(record)
+
+            if kwargs["once"]:
+                if not scheduler.is_leader():
+                    raise CommandError("Another process is running the tasks")
+                break
+
+            sleep(scheduler.tick)
+
+    def write_result(self, record):
+        outcome = record.last_error or record.last_output
+        self.stdout.write(f"{record.name}: {outcome} ({record.last_duration:.2f}s)")
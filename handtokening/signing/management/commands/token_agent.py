@@ -0,0 +1,46 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from handtokening.signing.conf import config
+from handtokening.signing.models import Certificate
+from handtokening.signing.token_agent import serve
+
+
+class Command(BaseCommand):
+    help = "Keep a PKCS #11 token logged in and sign for the web workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("certificate", help="Name of the certificate")
+        parser.add_argument(
+            "--max-session-window",
+            type=float,
+            help="Longest time in seconds the token stays logged in after a PIN is entered",
+        )
+
+    def handle(self, *args, **kwargs):
+        try:
+            certificate = Certificate.objects.get(name=kwargs["certificate"])
+        except Certificate.DoesNotExist:
+            raise CommandError(f"No certificate named {kwargs['certificate']!r}")
+
+        if not certificate.is_pkcs11:
+            raise CommandError("The token agent only works with PKCS #11 keys")
+
+        try:
+            import pkcs11  # noqa: F401
+        except ImportError:
+            raise CommandError("The token agent requires python-pkcs11")
+
+        max_window = kwargs["max_session_window"] or config.TOKEN_SESSION_WINDOW
+
+        def stop(signum, frame):
+            raise KeyboardInterrupt
+
+        # Log out and remove the socket when systemd stops the service
+        signal.signal(signal.SIGTERM, stop)
+
+        try:
+            serve(certificate, max_window)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0007_remove_certificate_ossl_provider"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="signinglog",
+            name="is_job",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="signinglog",
+            name="response_type",
+            field=models.CharField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="signinglog",
+            name="result_detail",
+            field=models.CharField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="signinglog",
+            name="result",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("success", "Success"),
+                    ("sign-error", "Signing Error"),
+                    ("no-certs", "No Certificates"),
+                    ("av-positive", "AV Positive"),
+                    ("unsupported-file-extension", "Unsupported File Extension"),
+                    ("internal-error", "Internal Error"),
+                    ("cancelled", "Cancelled"),
+                    ("pin-timeout", "PIN Timeout"),
+                ],
+                default="pending",
+            ),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clients", "0003_reworksecret"),
+        ("signing", "0008_signing_jobs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="signinglog",
+            name="cache_key",
+            field=models.CharField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="signinglog",
+            name="cache_source",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="signing.signinglog",
+            ),
+        ),
+        migrations.AddField(
+            model_name="signinglog",
+            name="cache_status",
+            field=models.CharField(
+                blank=True, choices=[("miss", "Miss"), ("hit", "Hit")], null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="signinglog",
+            index=models.Index(
+                fields=["cache_key", "-finished"], name="signing_sig_cache_k_ea18ce_idx"
+            ),
+        ),
+    ]
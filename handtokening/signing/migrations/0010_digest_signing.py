@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0009_output_cache"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="signinglog",
+            name="signed_digest",
+            field=models.CharField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="signingprofile",
+            name="allow_digest_signing",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0010_digest_signing"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="certificate",
+            name="use_token_agent",
+            field=models.BooleanField(default=False),
+        ),
+    ]
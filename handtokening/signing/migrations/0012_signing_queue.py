@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0011_token_agent"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="signinglog",
+            name="result",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("success", "Success"),
+                    ("sign-error", "Signing Error"),
+                    ("no-certs", "No Certificates"),
+                    ("av-positive", "AV Positive"),
+                    ("unsupported-file-extension", "Unsupported File Extension"),
+                    ("internal-error", "Internal Error"),
+                    ("cancelled", "Cancelled"),
+                    ("pin-timeout", "PIN Timeout"),
+                    ("queue-full", "Queue Full"),
+                ],
+                default="pending",
+            ),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0012_signing_queue"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="timestampserver",
+            name="average_latency",
+            field=models.FloatField(
+                blank=True,
+                help_text="Seconds, weighted towards recent requests",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="timestampserver",
+            name="circuit_open_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="timestampserver",
+            name="consecutive_failures",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="timestampserver",
+            name="failure_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="timestampserver",
+            name="last_error",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="timestampserver",
+            name="last_failure",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="timestampserver",
+            name="last_success",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="timestampserver",
+            name="success_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
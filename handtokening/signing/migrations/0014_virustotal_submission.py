@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:14
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0013_timestamp_server_health"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="virustotalanalysis",
+            name="api_calls",
+            field=models.IntegerField(
+                blank=True,
+                help_text="VirusTotal API calls made for the analysis",
+                null=True,
+            ),
+        ),
+        migrations.CreateModel(
+            name="VirusTotalSubmission",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sha256", models.CharField(unique=True)),
+                ("path", models.CharField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("polling", "Polling"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="queued",
+                    ),
+                ),
+                ("vt_id", models.CharField(blank=True, null=True)),
+                ("error", models.TextField(blank=True, null=True)),
+                ("api_calls", models.IntegerField(default=0)),
+                ("poll_interval", models.FloatField(default=0)),
+                ("next_poll", models.DateTimeField(default=django.utils.timezone.now)),
+                ("queued", models.DateTimeField(default=django.utils.timezone.now)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                (
+                    "analysis",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="signing.virustotalanalysis",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["status", "next_poll"],
+                        name="signing_vir_status_4bd47b_idx",
+                    )
+                ],
+            },
+        ),
+    ]
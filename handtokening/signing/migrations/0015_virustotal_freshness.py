@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:20
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0014_virustotal_submission"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="signingprofile",
+            name="vt_fresh_days",
+            field=models.IntegerField(
+                default=10,
+                help_text="Reuse VirusTotal analyses up to this many days old",
+            ),
+        ),
+        migrations.AddField(
+            model_name="signingprofile",
+            name="vt_stale_days",
+            field=models.IntegerField(
+                default=0,
+                help_text="Also use analyses up to this many days older than that right away, while a new analysis runs in the background",
+            ),
+        ),
+        migrations.AddField(
+            model_name="virustotalsubmission",
+            name="max_age",
+            field=models.DurationField(default=datetime.timedelta(days=10)),
+        ),
+    ]
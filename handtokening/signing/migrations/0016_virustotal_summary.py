@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:21
+
+from django.db import migrations, models
+
+
+BAD_CATEGORIES = ["suspicious", "malicious"]
+
+
+def summarize_results(apps, schema_editor):
+    VirusTotalAnalysis = apps.get_model("signing", "VirusTotalAnalysis")
+
+    for analysis in VirusTotalAnalysis.objects.prefetch_related("results").iterator(
+        chunk_size=500
+    ):
+        results = list(analysis.results.all())
+        bad_results = [r for r in results if r.category in BAD_CATEGORIES]
+        analysis.bad_count = len(bad_results)
+        analysis.total_count = len(results)
+        analysis.bad_engines = {r.name: r.category for r in bad_results}
+        analysis.save(update_fields=["bad_count", "total_count", "bad_engines"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0015_virustotal_freshness"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="virustotalanalysis",
+            name="bad_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="virustotalanalysis",
+            name="bad_engines",
+            field=models.JSONField(
+                blank=True, default=dict, help_text="Category by engine name"
+            ),
+        ),
+        migrations.AddField(
+            model_name="virustotalanalysis",
+            name="total_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="virustotalanalysis",
+            index=models.Index(
+                fields=["sha256", "-date"], name="signing_vir_sha256_75c849_idx"
+            ),
+        ),
+        migrations.RunPython(summarize_results, migrations.RunPython.noop),
+    ]
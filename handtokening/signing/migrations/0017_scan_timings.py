@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0016_virustotal_summary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="signinglog",
+            name="scan_timings",
+            field=models.JSONField(
+                blank=True, help_text="Seconds each AV scan took", null=True
+            ),
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clients", "0003_reworksecret"),
+        ("signing", "0017_scan_timings"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SigningBatch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                ("finished", models.DateTimeField(blank=True, null=True)),
+                ("ip", models.GenericIPAddressField()),
+                ("user_agent", models.CharField(blank=True, null=True)),
+                ("client_name", models.CharField()),
+                ("signing_profile_name", models.CharField(blank=True, null=True)),
+                ("description", models.CharField(blank=True, null=True)),
+                ("submitted_file_name", models.CharField(blank=True, null=True)),
+                ("in_path", models.CharField(blank=True, null=True)),
+                ("in_file_size", models.BigIntegerField(blank=True, null=True)),
+                (
+                    "file_count",
+                    models.IntegerField(
+                        default=0, help_text="Files in the archive that are signed"
+                    ),
+                ),
+                (
+                    "result",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("success", "Success"),
+                            ("sign-error", "Signing Error"),
+                            ("no-certs", "No Certificates"),
+                            ("av-positive", "AV Positive"),
+                            (
+                                "unsupported-file-extension",
+                                "Unsupported File Extension",
+                            ),
+                            ("internal-error", "Internal Error"),
+                            ("cancelled", "Cancelled"),
+                            ("pin-timeout", "PIN Timeout"),
+                            ("queue-full", "Queue Full"),
+                        ],
+                        default="pending",
+                    ),
+                ),
+                ("result_detail", models.CharField(blank=True, null=True)),
+                (
+                    "client",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to="clients.client",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "signing batches",
+                "ordering": ["-created"],
+            },
+        ),
+        migrations.AddField(
+            model_name="signinglog",
+            name="batch",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="logs",
+                to="signing.signingbatch",
+            ),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0018_signing_batch"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MaintenanceTask",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(unique=True)),
+                ("next_run", models.DateTimeField(default=django.utils.timezone.now)),
+                ("last_started", models.DateTimeField(blank=True, null=True)),
+                ("last_finished", models.DateTimeField(blank=True, null=True)),
+                (
+                    "last_duration",
+                    models.FloatField(blank=True, help_text="Seconds", null=True),
+                ),
+                ("last_output", models.TextField(blank=True, null=True)),
+                ("last_error", models.TextField(blank=True, null=True)),
+                ("run_count", models.PositiveIntegerField(default=0)),
+                ("failure_count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "ordering": ["name"],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0019_maintenance_task"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="signinglog",
+            name="stage_timings",
+            field=models.JSONField(
+                blank=True,
+                help_text="Seconds each stage of the request took",
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="signinglog",
+            name="finished",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
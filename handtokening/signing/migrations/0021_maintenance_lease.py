@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0020_stage_timings"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MaintenanceLease",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("holder", models.CharField()),
+                ("expires", models.DateTimeField()),
+            ],
+        ),
+    ]
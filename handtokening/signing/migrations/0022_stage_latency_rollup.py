@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0021_maintenance_lease"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StageLatencyRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hour", models.DateTimeField(db_index=True)),
+                ("stage", models.CharField()),
+                ("signing_profile_name", models.CharField(blank=True, null=True)),
+                ("certificate_name", models.CharField(blank=True, null=True)),
+                ("count", models.PositiveIntegerField()),
+                ("histogram", models.JSONField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("signing", "0023_profile_generation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="virustotalsubmission",
+            name="host",
+            field=models.CharField(blank=True, default=""),
+        ),
+    ]
@@ -21,6 +21,9 @@ class Certificate(models.Model):
     is_pkcs11 = models.BooleanField(default=False)
     expires = models.DateTimeField()
     pkcs11_module = models.CharField(null=True, blank=True)
+    # Sign through the long running token agent instead of letting every
+    # osslsigncode process log in to the token.
+    use_token_agent = models.BooleanField(default=False)
     is_enabled = models.BooleanField(default=True)
 
     created = models.DateTimeField(auto_now_add=True)
@@ -38,6 +41,32 @@ class TimestampServer(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
+    # Health, updated after every timestamp request. See timestamping.py
+    success_count = models.PositiveIntegerField(default=0)
+    failure_count = models.PositiveIntegerField(default=0)
+    consecutive_failures = models.PositiveIntegerField(default=0)
+    average_latency = models.FloatField(
+        null=True, blank=True, help_text="Seconds, weighted towards recent requests"
+    )
+    last_success = models.DateTimeField(null=True, blank=True)
+    last_failure = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    circuit_open_until = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def success_rate(self) -> float | None:
+        total = self.success_count + self.failure_count
+        if not total:
+            return None
+        return self.success_count / total
+
+    @property
+    def is_circuit_open(self) -> bool:
+        return (
+            self.circuit_open_until is not None
+            and self.circuit_open_until > timezone.now()
+        )
+
     def __str__(self):
         return f"TimestampServer: {self.id} {self.name}"
 
@@ -69,8 +98,21 @@ class SigningProfile(models.Model):
         choices=VirusTotalScanSetting, default=VirusTotalScanSetting.NO
     )
     vt_max_bad_percent = models.IntegerField(default=100)
+    vt_fresh_days = models.IntegerField(
+        default=10, help_text="Reuse VirusTotal analyses up to this many days old"
+    )
+    vt_stale_days = models.IntegerField(
+        default=0,
+        help_text=(
+            "Also use analyses up to this many days older than that right "
+            "away, while a new analysis runs in the background"
+        ),
+    )
     vt_fatal_engines = models.CharField(blank=True)
 
+    # Digest signing skips the AV scans since the server never sees the file.
+    allow_digest_signing = models.BooleanField(default=False)
+
     def get_vt_fatal_engines_list(self) -> list[str]:
         engines = [e.strip() for e in self.vt_fatal_engines.split(",")]
         return [e.lower() for e in engines if e]
@@ -88,7 +130,8 @@ class SigningProfileAccess(models.Model):
 class SigningLog(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
-    finished = models.DateTimeField(null=True, blank=True)
+    # Indexed for the latency page, which reads the recently finished logs
+    finished = models.DateTimeField(null=True, blank=True, db_index=True)
 
     handtokening_version = models.CharField(default=_get_handtokening_version)
 
@@ -114,6 +157,9 @@ class SigningLog(models.Model):
     in_file_size = models.BigIntegerField(null=True, blank=True)
     in_file_sha256 = models.CharField(null=True, blank=True)
 
+    # Authenticode digest (hex) submitted for digest signing
+    signed_digest = models.CharField(null=True, blank=True)
+
     out_path = models.CharField(null=True, blank=True)
     out_file_size = models.BigIntegerField(null=True, blank=True)
     out_file_sha256 = models.CharField(null=True, blank=True)
@@ -127,6 +173,12 @@ class SigningLog(models.Model):
     vt_analysis = models.ForeignKey(
         "VirusTotalAnalysis", null=True, blank=True, on_delete=models.SET_NULL
     )
+    scan_timings = models.JSONField(
+        null=True, blank=True, help_text="Seconds each AV scan took"
+    )
+    stage_timings = models.JSONField(
+        null=True, blank=True, help_text="Seconds each stage of the request took"
+    )
 
     class Result(models.TextChoices):
         PENDING = "pending", "Pending"
@@ -141,23 +193,95 @@ class SigningLog(models.Model):
         INTERNAL_ERROR = "internal-error", "Internal Error"
         CANCELLED = "cancelled", "Cancelled"
         PIN_TIMEOUT = "pin-timeout", "PIN Timeout"
+        QUEUE_FULL = "queue-full", "Queue Full"
 
-    result = models.CharField(choices=Result)
+    result = models.CharField(choices=Result, default=Result.PENDING)
+    result_detail = models.CharField(null=True, blank=True)
     exception = models.CharField(null=True, blank=True)
 
+    batch = models.ForeignKey(
+        "SigningBatch",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="logs",
+    )
+
+    # Signing jobs run in the background, the client polls for the result.
+    is_job = models.BooleanField(default=False)
+    response_type = models.CharField(null=True, blank=True)
+
+    # Output cache: signed files are reused for identical signing requests.
+    class CacheStatus(models.TextChoices):
+        MISS = "miss", "Miss"
+        HIT = "hit", "Hit"
+
+    cache_key = models.CharField(null=True, blank=True)
+    cache_status = models.CharField(choices=CacheStatus, null=True, blank=True)
+    cache_source = models.ForeignKey(
+        "self", null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+
     class Meta:
         indexes = [
             models.Index(fields=["-created"]),
             models.Index(fields=["client_name", "-created"]),
             models.Index(fields=["signing_profile_name", "-created"]),
+            models.Index(fields=["cache_key", "-finished"]),
         ]
         ordering = ["-created"]
 
 
+class SigningBatch(models.Model):
+    """A zip archive of files signed together, each file has its SigningLog."""
+
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    ip = models.GenericIPAddressField()
+    user_agent = models.CharField(null=True, blank=True)
+
+    client = models.ForeignKey(Client, null=True, blank=True, on_delete=models.SET_NULL)
+    client_name = models.CharField()
+
+    signing_profile_name = models.CharField(null=True, blank=True)
+    description = models.CharField(null=True, blank=True)
+
+    submitted_file_name = models.CharField(null=True, blank=True)
+    in_path = models.CharField(null=True, blank=True)
+    in_file_size = models.BigIntegerField(null=True, blank=True)
+    file_count = models.IntegerField(
+        default=0, help_text="Files in the archive that are signed"
+    )
+
+    result = models.CharField(
+        choices=SigningLog.Result, default=SigningLog.Result.PENDING
+    )
+    result_detail = models.CharField(null=True, blank=True)
+
+    def __str__(self):
+        return f"SigningBatch: {self.id} {self.submitted_file_name}"
+
+    class Meta:
+        ordering = ["-created"]
+        verbose_name_plural = "signing batches"
+
+
 class VirusTotalAnalysis(models.Model):
     sha256 = models.CharField()
     date = models.DateTimeField()
     analysis_time = models.FloatField(null=True, blank=True)
+    api_calls = models.IntegerField(
+        null=True, blank=True, help_text="VirusTotal API calls made for the analysis"
+    )
+
+    # Summary of the engine results, so the verdict can be checked without them
+    bad_count = models.IntegerField(default=0)
+    total_count = models.IntegerField(default=0)
+    bad_engines = models.JSONField(
+        default=dict, blank=True, help_text="Category by engine name"
+    )
 
     def __str__(self):
         return f"VirusTotalAnalysis: {self.sha256[:16]} {self.date}"
@@ -166,10 +290,60 @@ class VirusTotalAnalysis(models.Model):
         now = now or timezone.now()
         return now - self.date
 
+    def summarize_results(self, results: list["VirusTotalEngineResult"]):
+        bad_results = [r for r in results if r.bad]
+        self.bad_count = len(bad_results)
+        self.total_count = len(results)
+        self.bad_engines = {r.name: r.category for r in bad_results}
+
     class Meta:
+        indexes = [models.Index(fields=["sha256", "-date"])]
         verbose_name_plural = "VirusTotal analyses"
 
 
+class VirusTotalSubmission(models.Model):
+    """A file waiting for a VirusTotal analysis.
+
+    There's one per SHA-256 so concurrent requests for the same file share the
+    upload and the analysis. The background poller in virustotal.py of the
+    server that has the file moves it along.
+    """
+
+    sha256 = models.CharField(unique=True)
+    # On the server with this host name
+    host = models.CharField(default="", blank=True)
+    path = models.CharField()
+    # VirusTotal's last analysis of the file is reused if it's younger
+    max_age = models.DurationField(default=timedelta(days=10))
+
+    class Status(models.TextChoices):
+        QUEUED = "queued", "Queued"
+        POLLING = "polling", "Polling"
+        COMPLETED = "completed", "Completed"
+        FAILED = "failed", "Failed"
+
+    status = models.CharField(choices=Status, default=Status.QUEUED)
+    # VirusTotal's id for the analysis, the result is saved to `analysis`
+    vt_id = models.CharField(null=True, blank=True)
+    analysis = models.ForeignKey(
+        VirusTotalAnalysis, null=True, blank=True, on_delete=models.SET_NULL
+    )
+    error = models.TextField(null=True, blank=True)
+
+    api_calls = models.IntegerField(default=0)
+    poll_interval = models.FloatField(default=0)
+    next_poll = models.DateTimeField(default=timezone.now)
+
+    queued = models.DateTimeField(default=timezone.now)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"VirusTotalSubmission: {self.sha256[:16]} {self.status}"
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_poll"])]
+
+
 class VirusTotalEngineResult(models.Model):
     analysis = models.ForeignKey(
         VirusTotalAnalysis, on_delete=models.CASCADE, related_name="results"
@@ -210,3 +384,69 @@ class VirusTotalEngineResult(models.Model):
         ordering = ["analysis_id", "name"]
         indexes = [models.Index(fields=["analysis_id", "name"])]
         verbose_name_plural = "VirusTotal engine results"
+
+
+class MaintenanceTask(models.Model):
+    """When a housekeeping task in maintenance.py last ran, and how it went."""
+
+    name = models.CharField(unique=True)
+    next_run = models.DateTimeField(default=timezone.now)
+
+    last_started = models.DateTimeField(null=True, blank=True)
+    last_finished = models.DateTimeField(null=True, blank=True)
+    last_duration = models.FloatField(null=True, blank=True, help_text="Seconds")
+    last_output = models.TextField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+
+    run_count = models.PositiveIntegerField(default=0)
+    failure_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"MaintenanceTask: {self.name}"
+
+    class Meta:
+        ordering = ["name"]
+
+
+class StageLatencyRollup(models.Model):
+    """The stage timings of the signing logs that finished in an hour.
+
+    Kept as a histogram per stage, signing profile and certificate, so the
+    latency page doesn't read every log of the window (see timings.py).
+    """
+
+    hour = models.DateTimeField(db_index=True)
+    stage = models.CharField()
+    signing_profile_name = models.CharField(null=True, blank=True)
+    certificate_name = models.CharField(null=True, blank=True)
+
+    count = models.PositiveIntegerField()
+    # Number of timings in each bucket, by the bucket's index
+    histogram = models.JSONField()
+
+    def __str__(self):
+        return f"StageLatencyRollup: {self.hour} {self.stage}"
+
+
+class ProfileGeneration(models.Model):
+    """Bumped on every change to the signing profiles.
+
+    A single row, shared by every worker process on every node so their
+    profile caches are cleared together (see profiles.py), like
+    CredentialGeneration for the client credentials.
+    """
+
+    generation = models.PositiveBigIntegerField(default=0)
+
+
+class MaintenanceLease(models.Model):
+    """Which scheduler runs the maintenance tasks of the whole deployment.
+
+    A single row, taken over by another scheduler once it expires.
+    """
+
+    holder = models.CharField()
+    expires = models.DateTimeField()
+
+    def __str__(self):
+        return f"MaintenanceLease: {self.holder}"
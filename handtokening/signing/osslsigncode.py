@@ -2,11 +2,11 @@ from dataclasses import dataclass, field
 import itertools
 import os
 from pathlib import Path
-import random
 import re
 import shlex
 import subprocess
 import tempfile
+from typing import IO
 
 
 @dataclass
@@ -54,9 +54,6 @@ class OSSLSignCodeCommand:
     # Pin for accessing PKCS #11 objects.
     pin: str | None = None
 
-    def shuffle_timestamp_servers(self):
-        random.shuffle(self.timestamp_servers)
-
     def _require_fields(self, *field_names: list[str]):
         for field_name in field_names:
             if not getattr(self, field_name, None):
@@ -120,6 +117,49 @@ class OSSLSignCodeCommand:
 
         return command
 
+    def build_extract_data_command(self, data_path: str | Path) -> list[str]:
+        """Extract the data that's signed, see DigestSigningPipeline."""
+        self._require_fields("in_path")
+        return [
+            str(self.program_path),
+            "extract-data",
+            "-in",
+            str(self.in_path),
+            "-out",
+            str(data_path),
+        ]
+
+    def build_attach_signature_command(
+        self, signature_path: str | Path, out_path: str | Path
+    ) -> list[str]:
+        self._require_fields("in_path")
+        return [
+            str(self.program_path),
+            "attach-signature",
+            "-sigin",
+            str(signature_path),
+            "-in",
+            str(self.in_path),
+            "-out",
+            str(out_path),
+        ]
+
+    def build_add_timestamp_command(
+        self, in_path: str | Path, out_path: str | Path, timestamp_servers=None
+    ) -> list[str]:
+        if timestamp_servers is None:
+            timestamp_servers = self.timestamp_servers
+
+        return [
+            str(self.program_path),
+            "add",
+            *itertools.chain.from_iterable(["-ts", ts.url] for ts in timestamp_servers),
+            "-in",
+            str(in_path),
+            "-out",
+            str(out_path),
+        ]
+
     def run(self):
         command = self.build_command()
         env = None
@@ -138,15 +178,78 @@ class OSSLSignCodeCommand:
 
                 command.extend(["-readpass", pin_path])
 
-        result = subprocess.run(command, capture_output=True, text=True, env=env)
+        result = run_command(command, env=env)
 
         if pin_path:
             os.unlink(pin_path)
 
+        return result
+
+
+def run_command(command: list[str], env: dict | None = None) -> OSSLSignCodeResult:
+    result = subprocess.run(command, capture_output=True, text=True, env=env)
+
+    return OSSLSignCodeResult(
+        returncode=result.returncode,
+        stdout=result.stdout,
+        stderr=result.stderr,
+    )
+
+
+@dataclass
+class RunningCommand:
+    """A command started by start_command.
+
+    Its output goes to temporary files rather than pipes, so it can't block
+    on a full pipe while it's being waited for.
+    """
+
+    process: subprocess.Popen
+    stdout: IO[str]
+    stderr: IO[str]
+
+    def poll(self) -> int | None:
+        return self.process.poll()
+
+    def wait(self) -> int:
+        return self.process.wait()
+
+    def kill(self):
+        self.process.kill()
+
+
+def start_command(command: list[str], env: dict | None = None) -> RunningCommand:
+    """Start the command without waiting for it, see finish_command."""
+    stdout = tempfile.TemporaryFile("w+")
+    stderr = tempfile.TemporaryFile("w+")
+    try:
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=stdout,
+            stderr=stderr,
+            text=True,
+            env=env,
+        )
+    except BaseException:
+        stdout.close()
+        stderr.close()
+        raise
+
+    return RunningCommand(process, stdout, stderr)
+
+
+def finish_command(command: RunningCommand) -> OSSLSignCodeResult:
+    """Wait for the command to exit and collect its output."""
+    returncode = command.wait()
+
+    with command.stdout, command.stderr:
+        command.stdout.seek(0)
+        command.stderr.seek(0)
         return OSSLSignCodeResult(
-            returncode=result.returncode,
-            stdout=result.stdout,
-            stderr=result.stderr,
+            returncode=returncode,
+            stdout=command.stdout.read(),
+            stderr=command.stderr.read(),
         )
 
 
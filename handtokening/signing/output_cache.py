@@ -0,0 +1,119 @@
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from django.utils import timezone
+
+from .conf import config
+from .models import SigningLog
+
+
+logger = logging.getLogger(__name__)
+
+
+def output_cache_key(
+    in_sha256: str,
+    signer: int | str,
+    description: str | None,
+    url: str | None,
+    response_type: str,
+) -> str:
+    """Key identifying signing requests that would produce the same output.
+
+    The signer is normally the certificate id.
+    """
+    parameters = [in_sha256, signer, description, url, response_type]
+    return hashlib.sha256(json.dumps(parameters).encode()).hexdigest()
+
+
+def find_cached_output(keys: list[str]) -> SigningLog | None:
+    """Find a recent successful signing log for one of the keys.
+
+    Only logs whose output file still exists are returned.
+    """
+    if not config.OUTPUT_CACHE_TTL:
+        return None
+
+    candidates = SigningLog.objects.filter(
+        cache_key__in=keys,
+        cache_status=SigningLog.CacheStatus.MISS,
+        result=SigningLog.Result.SUCCESS,
+        finished__gte=timezone.now() - config.OUTPUT_CACHE_TTL,
+    ).order_by("-finished")
+
+    for candidate in candidates:
+        try:
+            # Bump modification time so eviction treats it as recently used
+            os.utime(candidate.out_path)
+        except OSError:
+            continue
+
+        return candidate
+
+    return None
+
+
+@contextmanager
+def single_flight(key: str):
+    """Only let one process/thread at a time through for the given key.
+
+    Identical signing requests wait here for the one that's already running,
+    after which they find its output in the cache. Every request has its own
+    key, so the lock file is removed again by whoever holds it last.
+    """
+    lock_path = config.STATE_DIRECTORY / "locks" / f"{key}.lock"
+    while True:
+        lock_file = open(lock_path, "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # While we waited, the previous holder may have removed the file,
+            # then others lock a new one and this lock excludes nobody
+            if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        except BaseException:
+            lock_file.close()
+            raise
+        lock_file.close()
+
+    try:
+        yield
+    finally:
+        # Removed while still locked, so no one can lock it in between
+        lock_path.unlink(missing_ok=True)
+        lock_file.close()
+
+
+def evict_outputs(out_dir: Path | None = None):
+    """Remove the least recently used signed files over OUTPUT_CACHE_MAX_SIZE."""
+    if not config.OUTPUT_CACHE_MAX_SIZE:
+        return
+
+    out_dir = out_dir or config.STATE_DIRECTORY / "out"
+
+    files = []
+    for entry in os.scandir(out_dir):
+        try:
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            pass
+
+    total_size = sum(size for _, size, _ in files)
+    files.sort()
+
+    for _, size, path in files:
+        if total_size <= config.OUTPUT_CACHE_MAX_SIZE:
+            break
+
+        try:
+            os.unlink(path)
+            total_size -= size
+        except OSError:
+            logger.exception("Couldn't evict signed file %s", path)
@@ -0,0 +1,1088 @@
+import base64
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+import hashlib
+import logging
+import math
+import os
+import random
+import shutil
+from pathlib import Path
+import string
+import subprocess
+import tempfile
+from time import monotonic, sleep
+
+from asn1crypto import cms
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils import timezone
+from django.utils.text import slugify
+from ipware import get_client_ip
+from rest_framework.request import Request
+
+from .authenticode import (
+    InvalidDataContent,
+    SpcIndirectDataContent,
+    build_signed_attributes,
+    build_signed_data,
+    get_digest,
+    get_digest_algorithm,
+    load_data_content,
+)
+from .catalog import (
+    InvalidCatalogInput,
+    build_catalog,
+    members_from_archive,
+    members_from_manifest,
+)
+from .clamav import ClamAVResult, start_clamav_scan
+from .conf import config
+from .external_value import ExternalValue
+from .ingest import ingest_file
+from .log_writer import save_signing_log
+from .models import SigningProfile, SigningLog, TimestampServer
+from .output_cache import (
+    evict_outputs,
+    find_cached_output,
+    output_cache_key,
+    single_flight,
+)
+from .osslsigncode import (
+    OSSLSignCodeCommand,
+    OSSLSignCodePkcs11,
+    OSSLSignCodeResult,
+    command_log_string,
+    finish_command,
+    run_command,
+    start_command,
+)
+from .profiles import profile_cache
+from .scheduler import QueueFull, SigningScheduler, signing_resource
+from .signer import KeySigningError, OpenSSLKeySigner, TokenAgentSigner
+from .timestamping import (
+    TimestampAttempt,
+    rank_timestamp_servers,
+    record_timestamp_result,
+)
+from .timings import StageTimer
+from .token_agent import TokenAgentClient, TokenAgentError, token_agent_socket
+from .virustotal import VirusTotalQuotaExhausted, request_vt_analysis
+
+
+logger = logging.getLogger(__name__)
+
+
+SUPPORTED_FILE_EXTENSIONS = [
+    "dll",
+    "exe",
+    "sys",
+    "msi",
+    "ps1",
+    "ps1xml",
+    "psc1",
+    "psd1",
+    "psm1",
+    "cdxml",
+    "mof",
+    "js",
+    "cab",
+    "cat",
+    "appx",
+]
+
+
+class SigningError(RuntimeError):
+    result = SigningLog.Result.SIGN_ERROR
+    status_code = 400
+    headers: dict[str, str] = {}
+
+
+class AVPositive(SigningError):
+    result = SigningLog.Result.AV_POSITIVE
+
+
+class VirusTotalPositive(AVPositive):
+    pass
+
+
+class NoCertificates(SigningError):
+    result = SigningLog.Result.NO_CERTIFICATES
+
+
+class UnsupportedExtension(SigningError):
+    result = SigningLog.Result.UNSUPPORTED_EXTENSION
+
+
+class SigningCancelled(SigningError):
+    result = SigningLog.Result.CANCELLED
+
+
+class PinTimeout(SigningError):
+    result = SigningLog.Result.PIN_TIMEOUT
+
+
+class DigestSigningNotAllowed(SigningError):
+    pass
+
+
+class SigningQueueFull(SigningError):
+    result = SigningLog.Result.QUEUE_FULL
+    status_code = 429
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.headers = {"Retry-After": str(retry_after)}
+
+
+class VirusTotalUnavailable(SigningError):
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.headers = {"Retry-After": str(retry_after)}
+
+
+def sha256_file_path(path: str | Path) -> str:
+    """Return SHA256 hash of the bytes in the file at the provided path."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+_random_chars = string.ascii_letters + string.digits
+
+
+def random_file_name() -> Path:
+    return Path(tempfile.gettempdir()) / "".join(random.choices(_random_chars, k=10))
+
+
+def signed_file_response(
+    out_path: str | Path, file_name: str, response_type: str
+) -> HttpResponse:
+    """Build the HTTP response for a signed file in the requested format."""
+    if response_type == "complete":
+        return FileResponse(
+            open(out_path, "rb"),
+            as_attachment=True,
+            filename=file_name,
+        )
+    elif response_type == "pkcs7":
+        pkcs7_temp_path = random_file_name()
+        subprocess.run(
+            [
+                config.OSSLSIGNCODE_PATH,
+                "extract-signature",
+                "-in",
+                out_path,
+                "-out",
+                pkcs7_temp_path,
+            ],
+            check=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        with open(pkcs7_temp_path, "rb") as f:
+            pkcs7_data = f.read()
+        pkcs7_temp_path.unlink()
+
+        return pkcs7_response(pkcs7_data)
+    else:
+        raise ValueError(f"Unknown response type: {response_type!r}")
+
+
+def pkcs7_response(pkcs7_data: bytes) -> HttpResponse:
+    signer_info = cms.ContentInfo.load(pkcs7_data)["content"]["signer_infos"][0]
+    signature = base64.b64encode(signer_info["signature"].native)
+    return HttpResponse(
+        pkcs7_data,
+        content_type="application/pkcs7-signature",
+        headers={
+            "ht-signed": signature,
+        },
+    )
+
+
+class SigningPipeline:
+    """A single signing operation, from receiving the file to the signed result.
+
+    The stages are split up so the request handling code can decide which run
+    inside the request and which run in the background (see jobs.py). Errors
+    should be passed to record_error and finish must always be called to write
+    the final state to the SigningLog.
+    """
+
+    # Ask for the PIN again if the token agent's session is about to expire
+    token_session_min_remaining = 30
+
+    # How often running timestamp requests are checked
+    timestamp_poll_interval = 0.05
+
+    # Give up waiting for the VirusTotal analysis this many seconds after it's
+    # requested
+    virus_total_timeout = 30 * 60
+
+    def __init__(self, signing_log: SigningLog, user, query: dict):
+        self.signing_log = signing_log
+        self.user = user
+        self.query = query
+
+        self.cmd = OSSLSignCodeCommand()
+        self.cmd.program_path = config.OSSLSIGNCODE_PATH
+        self.cmd.description = query.get("description")
+        self.cmd.url = query.get("url")
+
+        self.result: OSSLSignCodeResult | None = None
+        self.osslsigncode_commands: list[list[str]] = []
+        self.in_path_sha256: str | None = None
+        self.signing_profile: SigningProfile | None = None
+        self.certificates = []
+        self.certificate = None
+        self.timestamp_servers: list[TimestampServer] = []
+        self.vt_future: Future | None = None
+        self.vt_deadline: float | None = None
+        self.clamav_future: Future | None = None
+        self.scan_timings: dict[str, float] = {}
+        self.timer = StageTimer()
+        self.scan_status: dict[str, str] = {}
+        self.pin_request: ExternalValue | None = None
+        self.local_file_name: str | None = None
+        self.finished = False
+
+    @classmethod
+    def from_request(cls, request: Request, query: dict, file_name: str):
+        ip, _ = get_client_ip(request)
+        signing_log = SigningLog(
+            ip=ip,
+            user_agent=request.META.get("HTTP_USER_AGENT"),
+            client=request.user.client,
+            client_name=request.user.username,
+            signing_profile_name=query["signing-profile"],
+            description=query.get("description"),
+            url=query.get("url"),
+            submitted_file_name=file_name,
+            response_type=query["response-type"],
+        )
+        signing_log.save()
+
+        return cls(signing_log, request.user, query)
+
+    def prepare(self, incoming_file):
+        """Select the signing configuration and receive + ClamAV scan the file."""
+        signing_log = self.signing_log
+        cmd = self.cmd
+
+        file_basename, _, file_extension = signing_log.submitted_file_name.rpartition(
+            "."
+        )
+        file_extension = file_extension.lower()
+
+        if file_extension not in SUPPORTED_FILE_EXTENSIONS:
+            raise UnsupportedExtension(
+                f"Unsupported file extension: '{file_extension}'"
+            )
+
+        with self.timer.stage("profile"):
+            self.select_certificate()
+            self.check_signing_queue()
+
+        self.local_file_name = (
+            f"{signing_log.id}-{slugify(file_basename)}.{file_extension}"
+        )
+
+        cmd.in_path = config.STATE_DIRECTORY / "in" / self.local_file_name
+
+        self.scan_status["clamav"] = "running"
+        if self.signing_profile.vt_scan != SigningProfile.VirusTotalScanSetting.NO:
+            self.scan_status["virustotal"] = "waiting"
+
+        self.start_pin_request()
+        try:
+            # Write submitted file to local path, hashing and ClamAV scanning it
+            # on the way
+            with self.timer.stage("ingest"):
+                ingested = ingest_file(
+                    incoming_file.chunks(), cmd.in_path, scan_after=False
+                )
+            self.timer.add("hash", ingested.hash_time)
+            self.in_path_sha256 = ingested.sha256
+
+            if ingested.clamav:
+                self.scan_timings["clamav"] = round(ingested.clamav_time, 3)
+                self.check_clamav(ingested.clamav)
+                self.set_scan_status("clamav", "passed")
+            else:
+                # Couldn't stream it to clamd, scan the file alongside VirusTotal
+                self.clamav_future = self.timed_scan(
+                    "clamav", start_clamav_scan(cmd.in_path), monotonic()
+                )
+        except BaseException:
+            self.close_pin_request()
+            raise
+
+        if self.has_cached_output():
+            self.close_pin_request()
+
+    def select_certificate(self):
+        """Pick the signing profile and one of its certificates to sign with."""
+        signing_log = self.signing_log
+        cmd = self.cmd
+
+        resolved = profile_cache.get(self.query["signing-profile"])
+        if resolved is None or not resolved.has_access(self.user):
+            raise Http404("No SigningProfile matches the given query.")
+
+        signing_profile = resolved.profile
+        self.signing_profile = signing_profile
+        signing_log.signing_profile = signing_profile
+
+        certificates = resolved.valid_certificates()
+        self.certificates = certificates
+
+        if not certificates:
+            raise NoCertificates(
+                f"No valid certificates in signing profile '{signing_profile.name}'"
+            )
+
+        # Keep a certificate that was picked beforehand, e.g. so every file of
+        # a batch is signed with the same one
+        if self.certificate in certificates:
+            certificate = self.certificate
+        else:
+            certificate = random.choice(certificates)
+        self.certificate = certificate
+
+        signing_log.certificate = certificate
+        signing_log.certificate_name = certificate.name
+
+        cmd.cert_path = certificate.cert_path
+        cmd.key_path = certificate.key_path
+
+        # PKCS #11
+        if certificate.is_pkcs11:
+            cmd.pkcs11 = OSSLSignCodePkcs11(
+                module=certificate.pkcs11_module or config.PKCS11_MODULE_PATH,
+                provider=config.OSSL_PROVIDER_PATH,
+                engine=config.OSSL_ENGINE_PATH,
+            )
+
+        self.timestamp_servers = rank_timestamp_servers(resolved.timestamp_servers)
+
+    def scheduler(self) -> SigningScheduler:
+        signing_log = self.signing_log
+        return SigningScheduler(
+            signing_resource(self.certificate),
+            flow=f"{signing_log.client_name}/{signing_log.signing_profile_name}",
+        )
+
+    def check_signing_queue(self):
+        """Refuse the request now rather than after it waited in a full queue."""
+        try:
+            self.scheduler().check_depth()
+        except QueueFull as exc:
+            raise SigningQueueFull(str(exc), exc.retry_after) from exc
+
+    @contextmanager
+    def signing_slot(self):
+        """Wait for our turn on the certificate's token or key."""
+        with ExitStack() as stack:
+            try:
+                with self.timer.stage("queue"):
+                    stack.enter_context(self.scheduler().slot())
+            except QueueFull as exc:
+                raise SigningQueueFull(str(exc), exc.retry_after) from exc
+
+            yield
+
+    def timed_scan(self, name: str, future: Future, start: float) -> Future:
+        """Record the time from start until the scan is done in scan_timings."""
+
+        def record(future: Future):
+            if not future.cancelled():
+                self.scan_timings[name] = round(monotonic() - start, 3)
+
+        future.add_done_callback(record)
+        return future
+
+    def start_virus_total_scan(self) -> Future | None:
+        """Queue the file for VirusTotal, the result is checked by scan."""
+        signing_profile = self.signing_profile
+        if signing_profile.vt_scan == SigningProfile.VirusTotalScanSetting.NO:
+            return None
+
+        if self.vt_future is None:
+            self.set_scan_status("virustotal", "running")
+            start = monotonic()
+            self.vt_deadline = start + self.virus_total_timeout
+            try:
+                future = request_vt_analysis(
+                    self.cmd.in_path,
+                    self.in_path_sha256,
+                    max_wait=self.virus_total_timeout,
+                    allow_stale=(
+                        signing_profile.vt_scan
+                        == SigningProfile.VirusTotalScanSetting.ATTEMPT
+                    ),
+                    fresh_for=timedelta(days=signing_profile.vt_fresh_days),
+                    stale_for=timedelta(days=signing_profile.vt_stale_days),
+                )
+            except Exception as exc:
+                # Handled like any other VirusTotal error when it's checked
+                future = Future()
+                future.set_exception(exc)
+
+            self.vt_future = self.timed_scan("virustotal", future, start)
+        return self.vt_future
+
+    def scan(self, virus_total: bool = True):
+        """Wait for the AV scans, failing as soon as one of them objects.
+
+        ClamAV (unless it already scanned the upload) and VirusTotal run at the
+        same time. The first positive, or error of a required scan, is raised
+        right away and the other scans are abandoned.
+        """
+        scans: dict[Future, str] = {}
+        if self.clamav_future:
+            scans[self.clamav_future] = "clamav"
+
+        vt_future = self.start_virus_total_scan() if virus_total else None
+        if vt_future:
+            scans[vt_future] = "virustotal"
+
+        pending = set(scans)
+        try:
+            while pending:
+                timeout = None
+                if vt_future in pending:
+                    # A job may only start once it's over
+                    timeout = max(self.vt_deadline - monotonic(), 0)
+
+                done, pending = wait(pending, timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    # Only VirusTotal has a timeout, check_virus_total handles it
+                    done = {vt_future}
+                    pending.discard(vt_future)
+
+                for future in done:
+                    name = scans[future]
+                    try:
+                        if name == "clamav":
+                            self.check_clamav(future.result())
+                        else:
+                            self.check_virus_total(future)
+                    except Exception:
+                        self.set_scan_status(name, "failed")
+                        raise
+
+                    self.set_scan_status(name, "passed")
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def check_clamav(self, result: ClamAVResult):
+        if not result.clean:
+            raise AVPositive(f"ClamAV: {result.detail}")
+
+    def check_virus_total(self, future: Future):
+        signing_profile = self.signing_profile
+
+        try:
+            analysis = future.result(timeout=0)
+
+            self.signing_log.vt_analysis = analysis
+
+            fatal_candidates = signing_profile.get_vt_fatal_engines_list()
+            fatal_engines = [
+                f"{name} {category}"
+                for name, category in analysis.bad_engines.items()
+                if name.lower() in fatal_candidates
+            ]
+
+            if fatal_engines:
+                raise VirusTotalPositive(
+                    f"Detected as bad by required engine: {', '.join(fatal_engines)}"
+                )
+
+            percent_bad = analysis.bad_count / analysis.total_count * 100
+            if percent_bad > signing_profile.vt_max_bad_percent:
+                raise VirusTotalPositive("Too many engines marked the code as bad")
+        except VirusTotalQuotaExhausted as exc:
+            if signing_profile.vt_scan == SigningProfile.VirusTotalScanSetting.REQUIRED:
+                raise VirusTotalUnavailable(
+                    str(exc), math.ceil(exc.retry_after)
+                ) from exc
+            logger.warning("Signing without VirusTotal scan: %s", exc)
+        except Exception as exc:
+            if isinstance(exc, SigningError):
+                raise  # Pass on up
+            elif (
+                signing_profile.vt_scan == SigningProfile.VirusTotalScanSetting.REQUIRED
+            ):
+                raise  # VirusTotal analysis is required so abort signing process
+            else:
+                # Not required, so we log the error and continue
+                logger.exception("VirusTotal scan error")
+
+    def request_pin(self):
+        if not self.certificate.is_pkcs11:
+            return
+
+        if self.certificate.use_token_agent:
+            self.unlock_token_agent()
+        elif self.pin_request:
+            try:
+                self.cmd.pin = self.read_pin(self.pin_request)
+            finally:
+                self.close_pin_request()
+        else:
+            self.cmd.pin = self.ask_pin()
+
+    def pin_request_data(self, **extra) -> dict:
+        # The PIN agent batches requests with the same certificate_id, the
+        # signing log id and file name tell them apart
+        return {
+            "id": self.signing_log.id,
+            "user": self.user.username,
+            "certificate": self.certificate.name,
+            "certificate_id": self.certificate.id,
+            "file": self.signing_log.submitted_file_name,
+            "description": self.query.get("description") or "No description",
+            **extra,
+        }
+
+    def start_pin_request(self):
+        """Ask for the PIN now, so the operator can answer during the upload
+        and the scans.
+
+        The answer waits in the response socket until request_pin reads it,
+        after the scans passed. If they don't, or an identical request's output
+        turns out to be cached, the request is withdrawn and the answer
+        discarded with the socket. Token agents are skipped since they log in
+        as soon as they have the PIN.
+        """
+        if not self.certificate.is_pkcs11 or self.certificate.use_token_agent:
+            return
+
+        self.pin_request = ExternalValue(
+            self.pin_request_data(scans=self.scan_status)
+        ).__enter__()
+
+    def set_scan_status(self, name: str, status: str):
+        self.scan_status[name] = status
+        if self.pin_request:
+            self.pin_request.update(self.pin_request_data(scans=self.scan_status))
+
+    def close_pin_request(self):
+        if self.pin_request:
+            self.pin_request.__exit__(None, None, None)
+            self.pin_request = None
+
+    def read_pin(self, external: ExternalValue) -> str:
+        try:
+            resp = external.read_for(60)
+        except TimeoutError:
+            raise PinTimeout("Didn't receive pin on time")
+
+        if resp["result"] == "cancelled":
+            raise SigningCancelled("Received cancelled response")
+        elif resp["result"] != "approve":
+            raise SigningError(f"Unexpected response result: {repr(resp['result'])}")
+
+        return resp["code"]
+
+    def ask_pin(self, **extra) -> str:
+        # Get pin for accessing the hardware token
+        with ExternalValue(self.pin_request_data(**extra)) as external:
+            return self.read_pin(external)
+
+    def unlock_token_agent(self):
+        """Log in the token agent, unless its approved session is still open."""
+        token_agent = TokenAgentClient(token_agent_socket(self.certificate.id))
+
+        try:
+            # Only one request asks the operator, the others wait and reuse it
+            with single_flight(f"token-agent-{self.certificate.id}"):
+                status = token_agent.status()
+                if status["remaining"] > self.token_session_min_remaining:
+                    return
+
+                window = config.TOKEN_SESSION_WINDOW
+                token_agent.login(self.ask_pin(session_window=window), window)
+        except TokenAgentError as exc:
+            raise SigningError(f"Token agent error: {exc}") from exc
+
+    def run_osslsigncode(self):
+        cmd = self.cmd
+        out_path = config.STATE_DIRECTORY / "out" / self.local_file_name
+
+        # Timestamps are added separately so every server's result is known.
+        # osslsigncode recognises scripts by their extension
+        if self.timestamp_servers:
+            signed_path = random_file_name().with_suffix(out_path.suffix)
+        else:
+            signed_path = out_path
+
+        cmd.out_path = signed_path
+        try:
+            self.log_osslsigncode_command(cmd.build_command())
+            with self.timer.stage("sign"):
+                result = cmd.run()
+            self.add_osslsigncode_result(result)
+
+            if not result.success:
+                raise SigningError(f"osslsigncode error code: {result.returncode}")
+
+            if self.timestamp_servers:
+                with self.timer.stage("timestamp"):
+                    self.add_timestamp(signed_path, out_path)
+        finally:
+            cmd.out_path = out_path
+            if signed_path != out_path:
+                signed_path.unlink(missing_ok=True)
+
+        self.signing_log.result = SigningLog.Result.SUCCESS
+
+    def log_osslsigncode_command(self, command: list[str]):
+        self.osslsigncode_commands.append(command)
+        self.signing_log.osslsigncode_command = " && ".join(
+            command_log_string(c) for c in self.osslsigncode_commands
+        )
+
+    def add_osslsigncode_result(self, result: OSSLSignCodeResult):
+        if self.result:
+            result = OSSLSignCodeResult(
+                returncode=result.returncode,
+                stdout=self.result.stdout + result.stdout,
+                stderr=self.result.stderr + result.stderr,
+            )
+        self.result = result
+
+    def run_osslsigncode_step(self, command: list[str]):
+        self.log_osslsigncode_command(command)
+        result = run_command(command)
+        self.add_osslsigncode_result(result)
+
+        if not result.success:
+            raise SigningError(f"osslsigncode error code: {result.returncode}")
+
+    def add_timestamp(self, in_path: Path, out_path: Path):
+        """Timestamp with the first server that works, best ranked first.
+
+        TSA_HEDGING servers are asked at the same time, the first timestamp is
+        used and the requests that are still running are cancelled.
+        """
+        pending = list(self.timestamp_servers)
+        attempts: list[TimestampAttempt] = []
+        running: list[TimestampAttempt] = []
+
+        try:
+            while pending or running:
+                while pending and len(running) < config.TSA_HEDGING:
+                    attempt = self.start_timestamp_attempt(
+                        pending.pop(0), in_path, out_path
+                    )
+                    attempts.append(attempt)
+                    running.append(attempt)
+
+                if len(running) == 1:
+                    running[0].process.wait()
+
+                finished = [a for a in running if a.process.poll() is not None]
+                if not finished:
+                    sleep(self.timestamp_poll_interval)
+                    continue
+
+                for attempt in finished:
+                    running.remove(attempt)
+                    if self.finish_timestamp_attempt(attempt):
+                        shutil.move(attempt.out_path, out_path)
+                        return
+        finally:
+            for attempt in running:
+                attempt.process.kill()
+                finish_command(attempt.process)
+            for attempt in attempts:
+                attempt.out_path.unlink(missing_ok=True)
+
+        raise SigningError("Couldn't get a timestamp from any timestamp server")
+
+    def start_timestamp_attempt(
+        self, server: TimestampServer, in_path: Path, out_path: Path
+    ) -> TimestampAttempt:
+        # osslsigncode recognises scripts by their extension
+        attempt_path = random_file_name().with_suffix(out_path.suffix)
+        command = self.cmd.build_add_timestamp_command(in_path, attempt_path, [server])
+        self.log_osslsigncode_command(command)
+
+        return TimestampAttempt(server, attempt_path, start_command(command))
+
+    def finish_timestamp_attempt(self, attempt: TimestampAttempt) -> bool:
+        latency = attempt.latency
+        result = finish_command(attempt.process)
+        self.add_osslsigncode_result(result)
+
+        if result.success:
+            record_timestamp_result(attempt.server, True, latency)
+            return True
+
+        output = (result.stderr.strip() or result.stdout.strip()).splitlines()
+        error = output[-1] if output else f"Exit code {result.returncode}"
+        record_timestamp_result(attempt.server, False, latency, error)
+        logger.warning("Timestamp server %s failed: %s", attempt.server.name, error)
+        return False
+
+    def run_osslsigncode_with_token_agent(self):
+        """Sign the file without osslsigncode touching the token.
+
+        osslsigncode extracts the data to sign, the token agent signs it, and
+        osslsigncode attaches the signature and adds the timestamp.
+        """
+        cmd = self.cmd
+        cmd.out_path = config.STATE_DIRECTORY / "out" / self.local_file_name
+
+        # osslsigncode recognises scripts by their extension
+        attached_path = random_file_name().with_suffix(cmd.out_path.suffix)
+        data_path = random_file_name()
+        signature_path = random_file_name()
+
+        try:
+            with self.timer.stage("sign"):
+                self.run_osslsigncode_step(cmd.build_extract_data_command(data_path))
+
+                try:
+                    indirect_data = load_data_content(data_path.read_bytes())
+                except InvalidDataContent as exc:
+                    raise SigningError(str(exc))
+
+                signature_path.write_bytes(self.build_signature(indirect_data))
+
+                if not self.timestamp_servers:
+                    attached_path = cmd.out_path
+
+                self.run_osslsigncode_step(
+                    cmd.build_attach_signature_command(signature_path, attached_path)
+                )
+
+            if self.timestamp_servers:
+                with self.timer.stage("timestamp"):
+                    self.add_timestamp(attached_path, cmd.out_path)
+        finally:
+            for path in [data_path, signature_path, attached_path]:
+                if path != cmd.out_path:
+                    path.unlink(missing_ok=True)
+
+        self.signing_log.result = SigningLog.Result.SUCCESS
+
+    def key_signer(self) -> OpenSSLKeySigner | TokenAgentSigner:
+        if self.certificate.use_token_agent:
+            return TokenAgentSigner(self.certificate)
+        return OpenSSLKeySigner(self.certificate, self.cmd.pin)
+
+    def build_signature(self, indirect_data: SpcIndirectDataContent) -> bytes:
+        """Sign the extracted data with asn1crypto instead of osslsigncode."""
+        signer = self.key_signer()
+        attributes = build_signed_attributes(
+            indirect_data, self.query.get("description"), self.query.get("url")
+        )
+
+        try:
+            certificates = signer.load_certificates()
+            signature = signer.sign(
+                attributes.dump(), get_digest_algorithm(indirect_data)
+            )
+        except KeySigningError as exc:
+            logger.warning("Signing with certificate key failed: %s", exc)
+            raise SigningError("Key signing error") from exc
+
+        return build_signed_data(indirect_data, attributes, signature, certificates)
+
+    def cache_key(self, signer: int | str) -> str:
+        return output_cache_key(
+            self.in_path_sha256,
+            signer,
+            self.query.get("description"),
+            self.query.get("url"),
+            self.query["response-type"],
+        )
+
+    def has_cached_output(self) -> bool:
+        if not config.OUTPUT_CACHE_TTL:
+            return False
+        return bool(
+            find_cached_output([self.cache_key(c.id) for c in self.certificates])
+        )
+
+    def use_cached_output(self) -> bool:
+        """Reuse the output of an identical signing request if there is one."""
+        cached = find_cached_output([self.cache_key(c.id) for c in self.certificates])
+        if not cached:
+            return False
+
+        signing_log = self.signing_log
+        signing_log.cache_status = SigningLog.CacheStatus.HIT
+        signing_log.cache_key = cached.cache_key
+        signing_log.cache_source = cached
+        signing_log.certificate_id = cached.certificate_id
+        signing_log.certificate_name = cached.certificate_name
+        signing_log.vt_analysis_id = cached.vt_analysis_id
+        signing_log.result = SigningLog.Result.SUCCESS
+
+        self.cmd.out_path = Path(cached.out_path)
+        return True
+
+    def sign_uncached(self):
+        with self.timer.stage("scan"):
+            self.scan()
+
+        # The operator may have answered the PIN request during the scans, but
+        # the PIN is only read once it's our turn on the token
+        with self.signing_slot():
+            with self.timer.stage("pin"):
+                self.request_pin()
+
+            if self.certificate.use_token_agent:
+                self.run_osslsigncode_with_token_agent()
+            else:
+                self.run_osslsigncode()
+
+    def sign(self):
+        """Everything after receiving the file: VirusTotal, pin, and signing."""
+        if not config.OUTPUT_CACHE_TTL:
+            self.sign_uncached()
+            return
+
+        # Identical requests for any of the profile's certificates are
+        # coalesced, the ones waiting on the lock then hit the cache.
+        with ExitStack() as stack:
+            with self.timer.stage("cache_wait"):
+                stack.enter_context(
+                    single_flight(self.cache_key(f"profile-{self.signing_profile.id}"))
+                )
+
+            if self.use_cached_output():
+                self.close_pin_request()
+
+                # VirusTotal passed the cached output's input, but ClamAV has
+                # to finish with this upload
+                with self.timer.stage("scan"):
+                    self.scan(virus_total=False)
+                return
+
+            self.signing_log.cache_status = SigningLog.CacheStatus.MISS
+            self.signing_log.cache_key = self.cache_key(self.certificate.id)
+            self.sign_uncached()
+
+            # Make the output visible to the requests waiting for this one
+            self.finish(wait=True)
+
+        evict_outputs()
+
+    def response(self) -> HttpResponse:
+        return signed_file_response(
+            self.cmd.out_path, self.local_file_name, self.query["response-type"]
+        )
+
+    def record_error(self, exc: Exception):
+        self.signing_log.exception = repr(exc)
+
+        if isinstance(exc, SigningError):
+            self.signing_log.result = exc.result
+            self.signing_log.result_detail = str(exc)
+        else:
+            self.signing_log.result = SigningLog.Result.INTERNAL_ERROR
+
+    def finish(self, wait: bool = False):
+        """Write the final state to the signing log.
+
+        With SIGNING_LOG_WRITER that happens in the background, unless `wait`
+        is set. Only the first call saves it, sign calls it early so identical
+        requests waiting for this one find the output.
+        """
+        if self.finished:
+            return
+        self.finished = True
+
+        signing_log = self.signing_log
+        cmd = self.cmd
+
+        self.close_pin_request()
+
+        if cmd.in_path:
+            signing_log.in_path = str(cmd.in_path)
+            try:
+                signing_log.in_file_size = os.path.getsize(cmd.in_path)
+                signing_log.in_file_sha256 = self.in_path_sha256
+            except Exception:
+                pass
+
+        if cmd.out_path and signing_log.out_file_sha256 is None:
+            signing_log.out_path = str(cmd.out_path)
+            try:
+                signing_log.out_file_size = os.path.getsize(cmd.out_path)
+                signing_log.out_file_sha256 = sha256_file_path(cmd.out_path)
+            except Exception:
+                pass
+
+        if self.result:
+            signing_log.osslsigncode_returncode = self.result.returncode
+            signing_log.osslsigncode_stdout = self.result.stdout
+            signing_log.osslsigncode_stderr = self.result.stderr
+
+        if self.scan_timings:
+            signing_log.scan_timings = dict(self.scan_timings)
+        if self.timer.timings:
+            signing_log.stage_timings = dict(self.timer.timings)
+
+        signing_log.finished = timezone.now()
+        save_signing_log(signing_log, wait=wait)
+
+
+class DigestSigningPipeline(SigningPipeline):
+    """Sign an Authenticode digest instead of a whole file.
+
+    The client uploads the output of `osslsigncode extract-data`, which is a
+    few hundred bytes regardless of the file size, and receives a PKCS #7
+    signature to attach with `osslsigncode attach-signature`. The server never
+    sees the file itself so there's no ClamAV or VirusTotal scan.
+    """
+
+    # extract-data output is tiny, anything bigger isn't what we're expecting
+    max_data_content_size = 64 * 1024
+
+    def __init__(self, signing_log: SigningLog, user, query: dict):
+        super().__init__(signing_log, user, query)
+        self.indirect_data: SpcIndirectDataContent | None = None
+
+    def prepare(self, incoming_file):
+        signing_log = self.signing_log
+        cmd = self.cmd
+
+        with self.timer.stage("profile"):
+            self.select_certificate()
+
+        if not self.signing_profile.allow_digest_signing:
+            raise DigestSigningNotAllowed(
+                f"Digest signing isn't allowed for signing profile '{self.signing_profile.name}'"
+            )
+
+        if incoming_file.size > self.max_data_content_size:
+            raise SigningError("Data content is too large")
+
+        self.check_signing_queue()
+
+        data = incoming_file.read()
+
+        try:
+            self.indirect_data = load_data_content(data)
+        except InvalidDataContent as exc:
+            raise SigningError(str(exc))
+
+        signing_log.signed_digest = get_digest(self.indirect_data).hex()
+
+        file_name = signing_log.submitted_file_name
+        file_basename = file_name.rpartition(".")[0] or file_name
+        self.local_file_name = f"{signing_log.id}-{slugify(file_basename)}"
+
+        cmd.in_path = config.STATE_DIRECTORY / "in" / f"{self.local_file_name}.der"
+        with open(cmd.in_path, "wb") as f:
+            f.write(data)
+
+        self.in_path_sha256 = hashlib.sha256(data).hexdigest()
+
+    def cache_key(self, signer: int | str) -> str:
+        # Keep these apart from signed files with the same hash
+        return super().cache_key(f"digest-{signer}")
+
+    def sign_digest(self):
+        self.cmd.out_path = (
+            config.STATE_DIRECTORY / "out" / f"{self.local_file_name}.p7"
+        )
+        with open(self.cmd.out_path, "wb") as f:
+            f.write(self.build_signature(self.indirect_data))
+
+        self.signing_log.result = SigningLog.Result.SUCCESS
+
+    def sign_uncached(self):
+        with self.signing_slot():
+            with self.timer.stage("pin"):
+                self.request_pin()
+            with self.timer.stage("sign"):
+                self.sign_digest()
+
+    def response(self) -> HttpResponse:
+        with open(self.cmd.out_path, "rb") as f:
+            return pkcs7_response(f.read())
+
+
+class CatalogSigningPipeline(SigningPipeline):
+    """Sign a catalog covering a set of files instead of each file.
+
+    The upload is either a zip archive of the files or a JSON manifest with
+    their hashes (see catalog.py). The generated catalog is signed like any
+    other .cat file, so thousands of files take one signing operation and one
+    PIN entry. The uploaded archive is scanned by ClamAV, but there's no
+    VirusTotal analysis of a catalog that was just generated.
+    """
+
+    upload_extensions = ["zip", "json"]
+
+    def prepare(self, incoming_file):
+        signing_log = self.signing_log
+        cmd = self.cmd
+
+        file_basename, _, file_extension = signing_log.submitted_file_name.rpartition(
+            "."
+        )
+        file_extension = file_extension.lower()
+
+        if file_extension not in self.upload_extensions:
+            raise UnsupportedExtension(
+                f"Expected a zip archive or JSON manifest, not '{file_extension}'"
+            )
+
+        with self.timer.stage("profile"):
+            self.select_certificate()
+            self.check_signing_queue()
+
+        self.local_file_name = f"{signing_log.id}-{slugify(file_basename)}.cat"
+        upload_path = (
+            config.STATE_DIRECTORY
+            / "in"
+            / f"{signing_log.id}-{slugify(file_basename)}.{file_extension}"
+        )
+
+        self.scan_status["clamav"] = "running"
+        self.start_pin_request()
+        try:
+            with self.timer.stage("ingest"):
+                ingested = ingest_file(incoming_file.chunks(), upload_path)
+            self.timer.add("hash", ingested.hash_time)
+            if ingested.clamav:
+                self.scan_timings["clamav"] = round(ingested.clamav_time, 3)
+                self.check_clamav(ingested.clamav)
+                self.set_scan_status("clamav", "passed")
+
+            try:
+                if file_extension == "zip":
+                    members = members_from_archive(upload_path)
+                else:
+                    members = members_from_manifest(upload_path.read_bytes())
+
+                catalog = build_catalog(members)
+            except InvalidCatalogInput as exc:
+                raise SigningError(str(exc))
+        except BaseException:
+            self.close_pin_request()
+            raise
+
+        cmd.in_path = config.STATE_DIRECTORY / "in" / self.local_file_name
+        with open(cmd.in_path, "wb") as f:
+            f.write(catalog)
+
+        self.in_path_sha256 = hashlib.sha256(catalog).hexdigest()
+
+        if self.has_cached_output():
+            self.close_pin_request()
+
+    def start_virus_total_scan(self) -> Future | None:
+        return None
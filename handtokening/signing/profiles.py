@@ -0,0 +1,142 @@
+"""Signing profile configuration cached per worker process.
+
+Signing profiles, their certificates, and who has access change a few times a
+month, so every request resolving them from the database is wasted work. The
+resolved profiles are kept until any of them changes (see signals.py), which
+other processes, on this node or others, notice through the generation in the
+database.
+
+Timestamp server health is updated by every timestamp request without going
+through save(), so it's refreshed on its own, every few seconds.
+"""
+
+import copy
+from dataclasses import dataclass, replace
+import threading
+from time import monotonic
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import (
+    Certificate,
+    ProfileGeneration,
+    SigningProfile,
+    SigningProfileAccess,
+    TimestampServer,
+)
+
+
+@dataclass
+class ResolvedProfile:
+    profile: SigningProfile
+    user_ids: frozenset[int]
+    # Enabled certificates, including expired ones so the cache doesn't have to
+    # be reloaded when one expires
+    certificates: list[Certificate]
+    timestamp_servers: list[TimestampServer]
+    loaded: float
+    health_loaded: float
+
+    def has_access(self, user) -> bool:
+        return user.id in self.user_ids
+
+    def valid_certificates(self, now=None) -> list[Certificate]:
+        now = now or timezone.now()
+        return [c for c in self.certificates if c.expires > now]
+
+    def copy(self) -> "ResolvedProfile":
+        """Copy the model instances, so requests can't change each other's."""
+        return replace(
+            self,
+            profile=copy.copy(self.profile),
+            certificates=[copy.copy(c) for c in self.certificates],
+            timestamp_servers=[copy.copy(s) for s in self.timestamp_servers],
+        )
+
+
+def load_profile(name: str) -> ResolvedProfile | None:
+    profile = SigningProfile.objects.filter(name=name).first()
+    if profile is None:
+        return None
+
+    user_ids = SigningProfileAccess.objects.filter(signing_profile=profile).values_list(
+        "user_id", flat=True
+    )
+    now = monotonic()
+
+    return ResolvedProfile(
+        profile=profile,
+        user_ids=frozenset(user_ids),
+        certificates=list(profile.certificates.filter(is_enabled=True)),
+        timestamp_servers=list(profile.timestamp_servers.filter(is_enabled=True)),
+        loaded=now,
+        health_loaded=now,
+    )
+
+
+class ProfileCache:
+    # Changes that bypass the signals, like QuerySet.update(), are picked up
+    # after this many seconds
+    max_age = 300.0
+    # Seconds timestamp server health may be behind the database
+    health_max_age = 10.0
+
+    def __init__(self):
+        self.entries: dict[str, ResolvedProfile] = {}
+        self.generation = None
+        self.lock = threading.Lock()
+
+    def current_generation(self) -> int | None:
+        return (
+            ProfileGeneration.objects.filter(pk=1)
+            .values_list("generation", flat=True)
+            .first()
+        )
+
+    def get(self, name: str) -> ResolvedProfile | None:
+        """Return the named profile's configuration, None if it doesn't exist."""
+        generation = self.current_generation()
+
+        with self.lock:
+            if generation != self.generation:
+                self.entries.clear()
+                self.generation = generation
+
+            resolved = self.entries.get(name)
+
+        now = monotonic()
+        if resolved is None or now - resolved.loaded > self.max_age:
+            resolved = load_profile(name)
+            if resolved is None:
+                return None
+        elif now - resolved.health_loaded > self.health_max_age:
+            resolved = replace(
+                resolved,
+                timestamp_servers=list(
+                    TimestampServer.objects.filter(
+                        id__in=[s.id for s in resolved.timestamp_servers],
+                        is_enabled=True,
+                    )
+                ),
+                health_loaded=now,
+            )
+        else:
+            return resolved.copy()
+
+        with self.lock:
+            # Don't cache what was loaded before the last change
+            if generation == self.generation:
+                self.entries[name] = resolved
+
+        return resolved.copy()
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+
+        ProfileGeneration.objects.get_or_create(pk=1)
+        ProfileGeneration.objects.filter(pk=1).update(generation=F("generation") + 1)
+
+
+profile_cache = ProfileCache()
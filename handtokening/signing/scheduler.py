@@ -0,0 +1,185 @@
+"""Per-token signing scheduler shared by all worker processes.
+
+A hardware token can only do one thing at a time, so signing operations that
+use the same token are run one by one. File keys are limited to
+FILE_KEY_SIGNING_CONCURRENCY operations at a time per certificate.
+
+Waiting requests are queued as ticket files in STATE_DIRECTORY/queue/<key>.
+The queue is ordered fairly: every client/profile combination gets its turn
+before any of them gets a second one. The slots themselves are file locks, so
+a crashed worker never holds on to one.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+import fcntl
+import hashlib
+import os
+from time import monotonic, sleep, time_ns
+import uuid
+
+from .conf import config
+from .models import Certificate
+from .token_agent import parse_pkcs11_uri
+
+
+class QueueFull(RuntimeError):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class SigningResource:
+    """Something that limits how many signing operations can run at once."""
+
+    key: str
+    concurrency: int
+
+
+def signing_resource(certificate: Certificate) -> SigningResource:
+    if certificate.is_pkcs11:
+        # Certificates on the same token share it
+        module = certificate.pkcs11_module or config.PKCS11_MODULE_PATH
+        try:
+            uri = parse_pkcs11_uri(certificate.key_path)
+            token = uri.get("serial") or uri.get("token") or ""
+        except ValueError:
+            token = certificate.key_path
+        token_hash = hashlib.sha256(f"{module}\0{token}".encode()).hexdigest()[:16]
+        return SigningResource(key=f"token-{token_hash}", concurrency=1)
+    else:
+        return SigningResource(
+            key=f"certificate-{certificate.id}",
+            concurrency=max(config.FILE_KEY_SIGNING_CONCURRENCY, 1),
+        )
+
+
+@dataclass(frozen=True, order=True)
+class Ticket:
+    enqueued: int
+    pid: int
+    id: str
+    flow: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.enqueued}-{self.pid}-{self.id}-{self.flow}"
+
+    @classmethod
+    def from_name(cls, name: str) -> "Ticket":
+        enqueued, pid, id, flow = name.split("-")
+        return cls(int(enqueued), int(pid), id, flow)
+
+
+def fair_order(tickets: list[Ticket]) -> list[Ticket]:
+    """Order tickets round-robin over flows, oldest first within a round."""
+    seen: dict[str, int] = defaultdict(int)
+    ranked = []
+    for ticket in sorted(tickets):
+        ranked.append((seen[ticket.flow], ticket))
+        seen[ticket.flow] += 1
+
+    return [ticket for _, ticket in sorted(ranked)]
+
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SigningScheduler:
+    poll_interval = 0.1
+
+    def __init__(self, resource: SigningResource, flow: str):
+        self.resource = resource
+        self.flow = hashlib.sha256(flow.encode()).hexdigest()[:12]
+        self.queue_dir = config.STATE_DIRECTORY / "queue" / resource.key
+
+    def tickets(self) -> list[Ticket]:
+        try:
+            names = os.listdir(self.queue_dir)
+        except FileNotFoundError:
+            return []
+
+        tickets = []
+        for name in names:
+            try:
+                ticket = Ticket.from_name(name)
+            except ValueError:
+                continue
+
+            if _process_exists(ticket.pid):
+                tickets.append(ticket)
+            else:
+                # Left behind by a worker that died while waiting
+                try:
+                    os.unlink(self.queue_dir / name)
+                except FileNotFoundError:
+                    pass
+
+        return tickets
+
+    def check_depth(self):
+        """Refuse new requests while the queue is too long, see SIGNING_QUEUE_MAX_DEPTH."""
+        max_depth = config.SIGNING_QUEUE_MAX_DEPTH
+        if max_depth and len(self.tickets()) >= max_depth:
+            raise QueueFull(
+                "Too many signing requests queued for this certificate",
+                retry_after=config.SIGNING_QUEUE_RETRY_AFTER,
+            )
+
+    def _try_acquire_slot(self):
+        for n in range(self.resource.concurrency):
+            lock_path = (
+                config.STATE_DIRECTORY / "locks" / f"{self.resource.key}.{n}.lock"
+            )
+            lock_file = open(lock_path, "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return lock_file
+            except BlockingIOError:
+                lock_file.close()
+
+        return None
+
+    @contextmanager
+    def slot(self):
+        """Wait for this flow's turn and a free slot on the resource."""
+        self.queue_dir.mkdir(exist_ok=True)
+        ticket = Ticket(time_ns(), os.getpid(), uuid.uuid4().hex, self.flow)
+        ticket_path = self.queue_dir / ticket.name
+        ticket_path.touch()
+
+        lock_file = None
+        try:
+            deadline = monotonic() + config.SIGNING_QUEUE_TIMEOUT
+            while True:
+                # Only the first tickets in the fair order may take a slot
+                order = fair_order(self.tickets())
+                if ticket in order[: self.resource.concurrency]:
+                    lock_file = self._try_acquire_slot()
+                    if lock_file:
+                        break
+
+                if monotonic() > deadline:
+                    raise QueueFull(
+                        "Timed out waiting for a signing slot",
+                        retry_after=config.SIGNING_QUEUE_RETRY_AFTER,
+                    )
+
+                sleep(self.poll_interval)
+        finally:
+            ticket_path.unlink(missing_ok=True)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
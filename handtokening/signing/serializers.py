@@ -14,3 +14,19 @@ class SigningRequestSerializer(serializers.Serializer):
         fields["signing-profile"] = fields.pop("signing_profile")
         fields["response-type"] = fields.pop("response_type")
         return fields
+
+
+class DigestSigningRequestSerializer(SigningRequestSerializer):
+    response_type = serializers.ChoiceField(choices=["pkcs7"], default="pkcs7")
+
+
+class BatchSigningRequestSerializer(SigningRequestSerializer):
+    response_type = serializers.ChoiceField(choices=["complete"], default="complete")
+
+
+class CatalogSigningRequestSerializer(SigningRequestSerializer):
+    response_type = serializers.ChoiceField(choices=["complete"], default="complete")
+
+
+class JobStatusSerializer(serializers.Serializer):
+    wait = serializers.IntegerField(min_value=0, max_value=60, default=0)
@@ -0,0 +1,29 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Certificate, SigningProfile, SigningProfileAccess, TimestampServer
+from .profiles import profile_cache
+
+
+@receiver(post_save, sender=SigningProfile)
+@receiver(post_delete, sender=SigningProfile)
+@receiver(post_save, sender=SigningProfileAccess)
+@receiver(post_delete, sender=SigningProfileAccess)
+@receiver(post_save, sender=Certificate)
+@receiver(post_delete, sender=Certificate)
+@receiver(post_save, sender=TimestampServer)
+@receiver(post_delete, sender=TimestampServer)
+def invalidate_profile_cache(sender, **kwargs):
+    profile_cache.invalidate()
+    # Again once it's committed, in case another process loaded the old
+    # configuration in between
+    transaction.on_commit(profile_cache.invalidate)
+
+
+@receiver(m2m_changed, sender=SigningProfile.certificates.through)
+@receiver(m2m_changed, sender=SigningProfile.timestamp_servers.through)
+@receiver(m2m_changed, sender=SigningProfile.users_with_access.through)
+def invalidate_profile_cache_m2m(sender, action: str, **kwargs):
+    if action.startswith("post_"):
+        invalidate_profile_cache(sender)
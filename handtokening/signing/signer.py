@@ -0,0 +1,158 @@
+"""Private key operations for building signatures without osslsigncode.
+
+osslsigncode can't sign a bare set of signed attributes. OpenSSLKeySigner uses
+the openssl CLI instead, configured the same way as osslsigncode: file keys or
+PKCS #11 keys through either the provider or the engine. TokenAgentSigner
+hands the operation to the certificate's token agent.
+"""
+
+import os
+import subprocess
+import tempfile
+
+from asn1crypto import pem, x509
+
+from .conf import config
+from .models import Certificate
+from .token_agent import TokenAgentClient, TokenAgentError, token_agent_socket
+
+
+class KeySigningError(RuntimeError):
+    pass
+
+
+def parse_certificates(data: bytes, source: str) -> list[x509.Certificate]:
+    if pem.detect(data):
+        certificates = [
+            x509.Certificate.load(der)
+            for type_name, _, der in pem.unarmor(data, multiple=True)
+            if type_name == "CERTIFICATE"
+        ]
+    else:
+        certificates = [x509.Certificate.load(data)]
+
+    if not certificates:
+        raise KeySigningError(f"No certificates found in {source}")
+
+    return certificates
+
+
+class OpenSSLKeySigner:
+    def __init__(self, certificate: Certificate, pin: str | None = None):
+        self.certificate = certificate
+        self.pin = pin
+
+        self.provider = None
+        self.engine = None
+        self.module = None
+
+        if certificate.is_pkcs11:
+            self.module = certificate.pkcs11_module or config.PKCS11_MODULE_PATH
+            self.provider = config.OSSL_PROVIDER_PATH
+            self.engine = config.OSSL_ENGINE_PATH if not self.provider else None
+
+            if not self.provider and not self.engine:
+                raise KeySigningError("No OpenSSL pkcs11 provider or engine specified")
+
+    def _module_options(self) -> list[str]:
+        if self.provider:
+            return ["-provider", self.provider, "-provider", "default"]
+        elif self.engine:
+            return ["-engine", self.engine]
+        return []
+
+    def _env(self) -> dict[str, str] | None:
+        if not self.module:
+            return None
+
+        env = os.environ.copy()
+        env["PKCS11_PROVIDER_MODULE"] = self.module  # pkcs11-provider
+        env["PKCS11_MODULE_PATH"] = self.module  # libp11 engine
+        return env
+
+    def _run(self, command: list[str], input: bytes | None = None) -> bytes:
+        pin_path: str | None = None
+
+        if self.pin:
+            pinfd, pin_path = tempfile.mkstemp()
+            os.write(pinfd, self.pin.encode())
+            os.close(pinfd)
+            command = [*command, "-passin", f"file:{pin_path}"]
+
+        try:
+            result = subprocess.run(
+                command, input=input, capture_output=True, env=self._env()
+            )
+        finally:
+            if pin_path:
+                os.unlink(pin_path)
+
+        if result.returncode != 0:
+            raise KeySigningError(
+                f"{command[1]} failed with code {result.returncode}: "
+                + result.stderr.decode(errors="replace").strip()
+            )
+
+        return result.stdout
+
+    def load_certificates(self) -> list[x509.Certificate]:
+        """The signing certificate followed by the rest of its chain."""
+        cert_path = self.certificate.cert_path
+
+        if cert_path.startswith("pkcs11:"):
+            data = self._run(
+                [config.OPENSSL_PATH, "storeutl", "-certs"]
+                + self._module_options()
+                + [cert_path]
+            )
+        else:
+            with open(cert_path, "rb") as f:
+                data = f.read()
+
+        return parse_certificates(data, cert_path)
+
+    def sign(self, data: bytes, digest_algorithm: str) -> bytes:
+        """Hash and sign the data with the certificate's private key."""
+        command = [
+            config.OPENSSL_PATH,
+            "dgst",
+            f"-{digest_algorithm}",
+            "-sign",
+            self.certificate.key_path,
+        ]
+
+        if self.engine:
+            command.extend(["-keyform", "engine"])
+
+        return self._run(command + self._module_options(), input=data)
+
+
+class TokenAgentSigner:
+    def __init__(self, certificate: Certificate):
+        self.certificate = certificate
+        self.client = TokenAgentClient(token_agent_socket(certificate.id))
+
+    def load_certificates(self) -> list[x509.Certificate]:
+        cert_path = self.certificate.cert_path
+
+        try:
+            if cert_path.startswith("pkcs11:"):
+                certificates = [
+                    x509.Certificate.load(der) for der in self.client.certificates()
+                ]
+                if not certificates:
+                    raise KeySigningError(f"No certificates found in {cert_path}")
+
+                # The token doesn't order them, put the end-entity one first
+                return sorted(certificates, key=lambda c: c.ca)
+        except TokenAgentError as exc:
+            raise KeySigningError(str(exc)) from exc
+
+        with open(cert_path, "rb") as f:
+            return parse_certificates(f.read(), cert_path)
+
+    def sign(self, data: bytes, digest_algorithm: str) -> bytes:
+        try:
+            return self.client.sign(data, digest_algorithm)
+        except TokenAgentError as exc:
+            raise KeySigningError(str(exc)) from exc
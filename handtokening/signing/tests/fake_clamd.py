@@ -0,0 +1,137 @@
+"""Minimal stand-in for clamd that speaks enough of its protocol for testing.
+
+Files containing the EICAR test string are reported as infected. It can also
+be run on its own for benchmarking against a fake daemon:
+
+    python -m handtokening.signing.tests.fake_clamd /tmp/clamd.sock
+"""
+
+import socketserver
+import struct
+import sys
+import threading
+from pathlib import Path
+
+
+EICAR_MARKER = b"EICAR-STANDARD-ANTIVIRUS-TEST-FILE"
+SIGNATURE_NAME = "Win.Test.EICAR_HDB-1"
+VERSION = "ClamAV 1.4.3/27000/Fake"
+
+
+def verdict(name: str, data: bytes) -> str:
+    if EICAR_MARKER in data:
+        return f"{name}: {SIGNATURE_NAME} FOUND"
+    return f"{name}: OK"
+
+
+class FakeClamdHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.buffer = b""
+        self.server.connection_count += 1
+
+    def read_exact(self, count: int) -> bytes:
+        while len(self.buffer) < count:
+            data = self.request.recv(65536)
+            if not data:
+                raise EOFError
+            self.buffer += data
+
+        out, self.buffer = self.buffer[:count], self.buffer[count:]
+        return out
+
+    def read_command(self) -> tuple[bytes, bytes]:
+        prefix = self.read_exact(1)
+        terminator = b"\0" if prefix == b"z" else b"\n"
+        while terminator not in self.buffer:
+            data = self.request.recv(65536)
+            if not data:
+                raise EOFError
+            self.buffer += data
+
+        command, _, self.buffer = self.buffer.partition(terminator)
+        return command, terminator
+
+    def read_instream(self) -> bytes:
+        chunks = []
+        while True:
+            (size,) = struct.unpack("!L", self.read_exact(4))
+            if size == 0:
+                return b"".join(chunks)
+            chunks.append(self.read_exact(size))
+
+    def execute(self, command: bytes) -> str:
+        self.server.commands.append(command.split(b" ")[0].decode())
+
+        if command == b"PING":
+            return "PONG"
+        elif command == b"VERSION":
+            return VERSION
+        elif command == b"INSTREAM":
+            return verdict("stream", self.read_instream())
+        elif command.startswith((b"SCAN ", b"CONTSCAN ")):
+            path = command.partition(b" ")[2].decode()
+            try:
+                data = Path(path).read_bytes()
+            except OSError as exc:
+                return f"{path}: {exc.strerror}. ERROR"
+            return verdict(path, data)
+        else:
+            return "UNKNOWN COMMAND"
+
+    def handle(self):
+        in_session = False
+        request_id = 0
+
+        try:
+            while True:
+                command, terminator = self.read_command()
+
+                if command == b"IDSESSION":
+                    in_session = True
+                    continue
+                elif command == b"END":
+                    return
+
+                reply = self.execute(command)
+
+                if in_session:
+                    request_id += 1
+                    reply = f"{request_id}: {reply}"
+
+                self.request.sendall(reply.encode() + terminator)
+
+                if not in_session or self.server.close_after_reply:
+                    return
+        except (EOFError, ConnectionError):
+            return
+
+
+class FakeClamd(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str | Path):
+        self.connection_count = 0
+        self.commands: list[str] = []
+
+        # Simulate clamd's IdleTimeout by dropping sessions after each reply
+        self.close_after_reply = False
+
+        super().__init__(str(path), FakeClamdHandler)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    server = FakeClamd(sys.argv[1])
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        Path(sys.argv[1]).unlink(missing_ok=True)
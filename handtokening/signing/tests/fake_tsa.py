@@ -0,0 +1,194 @@
+"""Stand-in RFC 3161 timestamp server for testing.
+
+Issues real timestamp tokens, signed with a throwaway key that's generated on
+start, so osslsigncode can attach them. Replies can be delayed or refused to
+simulate slow and broken servers. It can also be run on its own for
+benchmarking timestamping without depending on public servers:
+
+    python -m handtokening.signing.tests.fake_tsa 8318 --delay 0.5
+"""
+
+import argparse
+from datetime import datetime, timezone
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from asn1crypto import cms, core, pem, tsp, x509
+
+
+POLICY = "1.3.6.1.4.1.99999.1"
+
+
+class TimeStampResp(core.Sequence):
+    # asn1crypto's TimeStampResp requires the token, even when it's refused
+    _fields = [
+        ("status", tsp.PKIStatusInfo),
+        ("time_stamp_token", cms.ContentInfo, {"optional": True}),
+    ]
+
+
+class FakeTSAHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.request_count += 1
+
+        time.sleep(self.server.delay)
+
+        if self.server.status == "granted":
+            request = tsp.TimeStampReq.load(body)
+            reply = TimeStampResp(
+                {
+                    "status": {"status": "granted"},
+                    "time_stamp_token": self.server.build_token(request),
+                }
+            )
+        else:
+            reply = TimeStampResp({"status": {"status": self.server.status}})
+
+        data = reply.dump()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/timestamp-reply")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTSA(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, delay: float = 0, status: str = "granted"):
+        self.delay = delay
+        self.status = status
+        self.request_count = 0
+
+        self.key_dir = Path(tempfile.mkdtemp())
+        self.cert_path = self.key_dir / "tsa.pem"
+        self.key_path = self.key_dir / "tsa.key"
+
+        # fmt: off
+        subprocess.run(
+            [
+                "openssl", "req", "-x509",
+                "-noenc",
+                "-newkey", "ec",
+                "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                "-subj", "/CN=Handtokening Fake TSA",
+                "-days", "30",
+                "-addext", "extendedKeyUsage=critical,timeStamping",
+                "-out", str(self.cert_path),
+                "-keyout", str(self.key_path),
+            ],
+            check=True,
+            capture_output=True,
+        )
+        # fmt: on
+
+        _, _, der = pem.unarmor(self.cert_path.read_bytes())
+        self.certificate = x509.Certificate.load(der)
+
+        super().__init__(("127.0.0.1", port), FakeTSAHandler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def sign(self, data: bytes) -> bytes:
+        return subprocess.run(
+            ["openssl", "dgst", "-sha256", "-sign", str(self.key_path)],
+            input=data,
+            check=True,
+            capture_output=True,
+        ).stdout
+
+    def build_token(self, request: tsp.TimeStampReq) -> cms.ContentInfo:
+        tst_info = tsp.TSTInfo(
+            {
+                "version": "v1",
+                "policy": POLICY,
+                "message_imprint": request["message_imprint"],
+                "serial_number": int.from_bytes(os.urandom(8)),
+                "gen_time": datetime.now(timezone.utc),
+            }
+        )
+        if request["nonce"].native is not None:
+            tst_info["nonce"] = request["nonce"]
+
+        signed_attrs = cms.CMSAttributes(
+            [
+                {"type": "content_type", "values": ["tst_info"]},
+                {
+                    "type": "message_digest",
+                    "values": [hashlib.sha256(tst_info.dump()).digest()],
+                },
+                {
+                    "type": "signing_certificate_v2",
+                    "values": [
+                        {"certs": [{"cert_hash": self.certificate.sha256}]},
+                    ],
+                },
+            ]
+        )
+
+        signer_info = cms.SignerInfo(
+            {
+                "version": "v1",
+                "sid": cms.SignerIdentifier(
+                    name="issuer_and_serial_number",
+                    value={
+                        "issuer": self.certificate.issuer,
+                        "serial_number": self.certificate.serial_number,
+                    },
+                ),
+                "digest_algorithm": {"algorithm": "sha256"},
+                "signed_attrs": signed_attrs,
+                "signature_algorithm": {"algorithm": "sha256_ecdsa"},
+                "signature": self.sign(signed_attrs.dump()),
+            }
+        )
+
+        signed_data = cms.SignedData(
+            {
+                "version": "v3",
+                "digest_algorithms": [{"algorithm": "sha256"}],
+                "encap_content_info": {"content_type": "tst_info", "content": tst_info},
+                "certificates": [self.certificate],
+                "signer_infos": [signer_info],
+            }
+        )
+
+        return cms.ContentInfo({"content_type": "signed_data", "content": signed_data})
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        shutil.rmtree(self.key_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("port", type=int)
+    parser.add_argument("--delay", type=float, default=0)
+    parser.add_argument("--status", default="granted")
+    args = parser.parse_args()
+
+    server = FakeTSA(args.port, args.delay, args.status)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        shutil.rmtree(server.key_dir)
@@ -0,0 +1,145 @@
+import io
+import zipfile
+from unittest.mock import patch
+from urllib.parse import urlencode
+
+from django.test import TestCase
+
+from handtokening.signing.conf import config
+from handtokening.signing.models import SigningBatch, SigningLog
+from handtokening.signing.pipeline import SigningError, SigningPipeline
+from handtokening.signing.tests.test_signing import TEST_SCRIPT
+from handtokening.signing.tests.util import SigningTestMixin
+
+
+def build_zip(files: dict[str, str], compression=zipfile.ZIP_STORED) -> bytes:
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", compression) as archive:
+        for name, content in files.items():
+            archive.writestr(name, content)
+    return data.getvalue()
+
+
+class BatchSigningTests(SigningTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        # Sign inline so the files use the test's database transaction
+        cls.patch_config("BATCH_SIGNING_WORKERS", 0)
+
+    def sign_batch(self, data: bytes):
+        return self.client.post(
+            "/api/sign-batch?" + urlencode({"signing-profile": "test-signing"}),
+            data,
+            content_type="application/octet-stream",
+            headers={
+                "authorization": self.auth,
+                "content-disposition": 'attachment; filename="bundle.zip"',
+            },
+        )
+
+    def test_batch(self):
+        resp = self.sign_batch(
+            build_zip(
+                {
+                    "bundle/install.ps1": TEST_SCRIPT,
+                    "bundle/README.txt": "Read me",
+                    "bundle/lib/helper.ps1": TEST_SCRIPT,
+                }
+            )
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["Content-Type"], "application/zip")
+
+        data = b"".join(resp.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(
+                archive.namelist(),
+                ["bundle/install.ps1", "bundle/README.txt", "bundle/lib/helper.ps1"],
+            )
+            self.assertEqual(archive.read("bundle/README.txt"), b"Read me")
+
+            for name in ["bundle/install.ps1", "bundle/lib/helper.ps1"]:
+                signed = archive.read(name).decode()
+                self.assertTrue(signed.startswith(TEST_SCRIPT))
+                self.assertIn("# SIG # Begin signature block", signed)
+
+        batch = SigningBatch.objects.get()
+        self.assertEqual(batch.result, SigningLog.Result.SUCCESS)
+        self.assertEqual(batch.file_count, 2)
+        self.assertIsNotNone(batch.finished)
+
+        logs = batch.logs.all()
+        self.assertEqual(
+            {log.submitted_file_name for log in logs},
+            {"bundle/install.ps1", "bundle/lib/helper.ps1"},
+        )
+        self.assertEqual({log.result for log in logs}, {SigningLog.Result.SUCCESS})
+        self.assertEqual(len({log.certificate_id for log in logs}), 1)
+
+    def test_failed_file(self):
+        run_osslsigncode = SigningPipeline.run_osslsigncode
+
+        def fail_bad_file(pipeline):
+            if pipeline.signing_log.submitted_file_name == "bad.ps1":
+                raise SigningError("osslsigncode error code: 1")
+            run_osslsigncode(pipeline)
+
+        with patch.object(SigningPipeline, "run_osslsigncode", fail_bad_file):
+            resp = self.sign_batch(build_zip({"good.ps1": TEST_SCRIPT, "bad.ps1": ""}))
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(
+            resp.json()["detail"],
+            "1 of 2 files couldn't be signed, bad.ps1: osslsigncode error code: 1",
+        )
+        self.assertEqual(
+            [(f["file"], f["result"]) for f in resp.json()["files"]],
+            [
+                ("good.ps1", SigningLog.Result.SUCCESS),
+                ("bad.ps1", SigningLog.Result.SIGN_ERROR),
+            ],
+        )
+        self.assertEqual(
+            SigningBatch.objects.get().result, SigningLog.Result.SIGN_ERROR
+        )
+
+    def test_nothing_to_sign(self):
+        resp = self.sign_batch(build_zip({"README.txt": "Read me"}))
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()["detail"], "No files to sign in the archive")
+
+        resp = self.sign_batch(b"Not a zip")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()["detail"], "Not a valid zip archive")
+
+    def test_archive_limits(self):
+        with patch.object(config, "ARCHIVE_MAX_MEMBERS", 2):
+            resp = self.sign_batch(
+                build_zip({"a.ps1": TEST_SCRIPT, "b.ps1": TEST_SCRIPT, "c.txt": ""})
+            )
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()["detail"], "The archive has more than 2 files")
+
+        with patch.object(config, "ARCHIVE_MAX_SIZE", 1000):
+            resp = self.sign_batch(
+                build_zip({"a.ps1": TEST_SCRIPT, "b.txt": "x" * 1000})
+            )
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(
+            resp.json()["detail"],
+            "The archive's files are larger than 1000 bytes in total",
+        )
+
+        bomb = build_zip(
+            {"a.ps1": TEST_SCRIPT, "zeros.txt": "\0" * 2**21}, zipfile.ZIP_DEFLATED
+        )
+        resp = self.sign_batch(bomb)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(
+            resp.json()["detail"], "zeros.txt is compressed more than 100 times"
+        )
+
+        # Nothing was extracted
+        self.assertFalse(SigningLog.objects.exists())
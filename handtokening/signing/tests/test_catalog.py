@@ -0,0 +1,207 @@
+import hashlib
+import io
+import json
+import struct
+import zipfile
+from unittest.mock import patch
+from urllib.parse import urlencode
+
+from django.test import SimpleTestCase, TestCase
+
+from handtokening.signing.catalog import (
+    CATALOG_LIST_MEMBER_V2,
+    CTL,
+    Catalog,
+    CatalogMember,
+    InvalidCatalogInput,
+    build_catalog,
+    members_from_archive,
+    members_from_manifest,
+    pe_authenticode_digest,
+)
+from handtokening.signing.conf import config
+from handtokening.signing.models import SigningLog
+from handtokening.signing.tests.test_signing import TEST_SCRIPT
+from handtokening.signing.tests.test_timestamping import fake_run_command
+from handtokening.signing.tests.util import SigningTestMixin
+
+
+def build_pe(certificate_table: bytes = b"") -> bytes:
+    """Minimal PE32+ header, only the fields the digest depends on are set."""
+    pe_offset = 0x40
+    optional_header = pe_offset + 24
+
+    data = bytearray(1000)
+    data[:2] = b"MZ"
+    struct.pack_into("<I", data, 0x3C, pe_offset)
+    data[pe_offset : pe_offset + 4] = b"PE\0\0"
+    struct.pack_into("<H", data, optional_header, 0x20B)
+    struct.pack_into("<I", data, optional_header + 64, 0x12345678)
+    data[600:] = bytes(range(256)) + bytes(144)
+
+    if certificate_table:
+        struct.pack_into(
+            "<II", data, optional_header + 144, len(data), len(certificate_table)
+        )
+        data += certificate_table
+
+    return bytes(data)
+
+
+def trusted_subjects(catalog: bytes):
+    trust_list = Catalog.load(catalog)["content"]["content_info"]["content"]
+    return trust_list, list(trust_list["trusted_subjects"])
+
+
+class CatalogTests(SimpleTestCase):
+    def test_build_catalog(self):
+        digest = hashlib.sha256(TEST_SCRIPT.encode()).digest()
+        members = [
+            CatalogMember("driver.sys", b"\xff" * 32, is_pe_image=True),
+            CatalogMember("script.ps1", digest),
+        ]
+        catalog = build_catalog(members)
+
+        # Doesn't depend on the order of the files or when it was built
+        self.assertEqual(build_catalog(members[::-1]), catalog)
+        self.assertNotEqual(build_catalog(members[:1]), catalog)
+
+        content = Catalog.load(catalog)["content"]
+        self.assertEqual(content["content_info"]["content_type"].dotted, CTL)
+        self.assertEqual(len(content["signer_infos"]), 0)
+
+        trust_list, subjects = trusted_subjects(catalog)
+        self.assertEqual(
+            trust_list["subject_algorithm"]["type"].dotted, CATALOG_LIST_MEMBER_V2
+        )
+        self.assertEqual(len(subjects), 2)
+        self.assertEqual(
+            subjects[0]["identifier"].native,
+            digest.hex().upper().encode("utf-16-le"),
+        )
+
+        # The indirect data is the last attribute and ends with the digest
+        indirect_data = subjects[0]["attributes"][2]["values"][0].dump()
+        self.assertTrue(indirect_data.endswith(digest))
+
+    def test_pe_digest(self):
+        unsigned = build_pe()
+        self.assertEqual(
+            pe_authenticode_digest(io.BytesIO(unsigned), len(unsigned)),
+            # Skips the checksum and certificate table entry, 1000 bytes are
+            # already a multiple of 8
+            hashlib.sha256(
+                unsigned[:152] + unsigned[156:232] + unsigned[240:]
+            ).digest(),
+        )
+
+        # The certificate table and checksum don't change the digest
+        signed = bytearray(build_pe(b"signature"))
+        struct.pack_into("<I", signed, 152, 0)
+        self.assertEqual(
+            pe_authenticode_digest(io.BytesIO(signed), len(signed)),
+            pe_authenticode_digest(io.BytesIO(unsigned), len(unsigned)),
+        )
+
+        with self.assertRaises(InvalidCatalogInput):
+            pe_authenticode_digest(io.BytesIO(b"MZ" + bytes(100)), 102)
+
+    def test_manifest(self):
+        members = members_from_manifest(
+            json.dumps(
+                {
+                    "files": [
+                        {"name": "a.dll", "sha256": "00" * 32},
+                        {"name": "b.inf", "sha256": "11" * 32},
+                    ]
+                }
+            ).encode()
+        )
+        self.assertEqual([m.is_pe_image for m in members], [True, False])
+
+        with self.assertRaises(InvalidCatalogInput):
+            members_from_manifest(b'{"files": [{"name": "a.dll", "sha256": "00"}]}')
+
+    def test_archive_limits(self):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, "w") as archive:
+            archive.writestr("a.inf", "a")
+            archive.writestr("b.inf", "b")
+
+        with (
+            patch.object(config, "ARCHIVE_MAX_MEMBERS", 1),
+            self.assertRaisesMessage(
+                InvalidCatalogInput, "The archive has more than 1 files"
+            ),
+        ):
+            members_from_archive(data)
+
+
+class CatalogSigningTests(SigningTestMixin, TestCase):
+    def setUp(self):
+        patcher = patch(
+            "handtokening.signing.osslsigncode.run_command", fake_run_command
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sign_catalog(self, data: bytes, file_name: str):
+        return self.client.post(
+            "/api/sign-catalog?" + urlencode({"signing-profile": "test-signing"}),
+            data,
+            content_type="application/octet-stream",
+            headers={
+                "authorization": self.auth,
+                "content-disposition": f'attachment; filename="{file_name}"',
+            },
+        )
+
+    def test_archive(self):
+        pe = build_pe()
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("driver/driver.sys", pe)
+            archive.writestr("driver/install.ps1", TEST_SCRIPT)
+
+        resp = self.sign_catalog(data.getvalue(), "driver.zip")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp["Content-Disposition"].endswith('-driver.cat"'))
+
+        _, subjects = trusted_subjects(b"".join(resp.streaming_content))
+        self.assertEqual(
+            [
+                bytes.fromhex(s["identifier"].native.decode("utf-16-le"))
+                for s in subjects
+            ],
+            sorted(
+                [
+                    pe_authenticode_digest(io.BytesIO(pe), len(pe)),
+                    hashlib.sha256(TEST_SCRIPT.encode()).digest(),
+                ]
+            ),
+        )
+
+        log = SigningLog.objects.get()
+        self.assertEqual(log.result, SigningLog.Result.SUCCESS)
+        self.assertTrue(log.in_path.endswith(".cat"))
+
+    def test_manifest(self):
+        manifest = {"files": [{"name": "a.dll", "sha256": "ab" * 32}]}
+
+        resp = self.sign_catalog(json.dumps(manifest).encode(), "release.json")
+        self.assertEqual(resp.status_code, 200)
+
+        _, subjects = trusted_subjects(b"".join(resp.streaming_content))
+        self.assertEqual(len(subjects), 1)
+
+    def test_invalid_upload(self):
+        resp = self.sign_catalog(b"{}", "release.json")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()["detail"], "Invalid manifest: KeyError('files')")
+
+        resp = self.sign_catalog(TEST_SCRIPT.encode(), "test.ps1")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(
+            SigningLog.objects.first().result,
+            SigningLog.Result.UNSUPPORTED_EXTENSION,
+        )
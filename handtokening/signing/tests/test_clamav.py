@@ -0,0 +1,343 @@
+from concurrent.futures import Future
+from datetime import datetime, timezone
+import hashlib
+import json
+import shutil
+import socket
+import tempfile
+import threading
+from pathlib import Path
+from time import monotonic, sleep
+from unittest.mock import patch
+from urllib.parse import urlencode
+
+from django.test import SimpleTestCase, TestCase
+
+from handtokening.signing.clamav import ClamAVResult, ClamdPool, clamav_scan_file
+from handtokening.signing.conf import config
+from handtokening.signing.external_value import ExternalValue
+from handtokening.signing.ingest import ingest_file
+from handtokening.signing.models import (
+    Certificate,
+    SigningLog,
+    SigningProfile,
+    VirusTotalAnalysis,
+)
+from handtokening.signing.profiles import profile_cache
+from handtokening.signing.tests.fake_clamd import FakeClamd
+from handtokening.signing.tests.test_signing import EICAR, TEST_SCRIPT
+from handtokening.signing.tests.test_timestamping import fake_run_command
+from handtokening.signing.tests.util import SigningTestMixin
+
+
+class ClamdPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.run_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.run_dir)
+
+        self.socket_path = self.run_dir / "clamd.sock"
+        self.clamd = FakeClamd(self.socket_path).start()
+        self.addCleanup(self.clamd.stop)
+
+        self.pool = ClamdPool(self.socket_path, timeout=5)
+        self.addCleanup(self.pool.close)
+
+    def write_file(self, name: str, data: bytes | str) -> Path:
+        path = self.run_dir / name
+        path.write_bytes(data.encode() if isinstance(data, str) else data)
+        return path
+
+    def test_ping_version(self):
+        self.assertTrue(self.pool.ping())
+        self.assertTrue(self.pool.version().startswith("ClamAV "))
+
+    def test_scan_clean(self):
+        result = self.pool.scan_file(self.write_file("clean.ps1", TEST_SCRIPT))
+        self.assertTrue(result.clean)
+        self.assertEqual(result.detail, "stream: OK")
+
+    def test_scan_eicar(self):
+        result = self.pool.scan_file(self.write_file("eicar.exe", EICAR))
+        self.assertFalse(result.clean)
+        self.assertEqual(result.detail, "stream: Win.Test.EICAR_HDB-1 FOUND")
+
+    def test_scan_path(self):
+        path = self.write_file("eicar.exe", EICAR)
+        result = self.pool.scan_path(path)
+        self.assertFalse(result.clean)
+        self.assertTrue(result.detail.startswith(str(path)))
+
+    def test_instream_session(self):
+        with self.pool.instream() as session:
+            for chunk in [EICAR[:10], EICAR[10:]]:
+                session.send(chunk)
+            result = session.finish()
+
+        self.assertFalse(result.clean)
+
+    def test_connection_reused(self):
+        path = self.write_file("clean.ps1", TEST_SCRIPT)
+        for _ in range(5):
+            self.assertTrue(self.pool.scan_file(path).clean)
+        self.assertTrue(self.pool.ping())
+
+        self.assertEqual(self.clamd.connection_count, 1)
+        self.assertEqual(self.clamd.commands, 5 * ["INSTREAM"] + ["PING"])
+
+    def test_instream_replaces_confused_connection(self):
+        self.assertTrue(self.pool.ping())
+        conn = self.pool.idle[0]
+        # Replies to this connection no longer match the requests
+        conn.request_id += 1
+
+        with self.pool.instream() as session:
+            self.assertIsNot(session.conn, conn)
+            session.send(EICAR)
+            self.assertFalse(session.finish().clean)
+
+        self.assertEqual(conn.sock.fileno(), -1)
+        self.assertEqual(self.clamd.connection_count, 2)
+
+    def test_reconnect_after_idle_timeout(self):
+        self.clamd.close_after_reply = True
+        path = self.write_file("clean.ps1", TEST_SCRIPT)
+
+        for _ in range(3):
+            self.assertTrue(self.pool.scan_file(path).clean)
+
+        self.assertEqual(self.clamd.connection_count, 3)
+
+    def test_fallback_to_clamscan(self):
+        path = self.write_file("clean.ps1", TEST_SCRIPT)
+        with (
+            patch.object(config, "CLAMD_SOCKET", self.run_dir / "nothing.sock"),
+            patch.object(config, "CLAMSCAN_PATH", "/usr/bin/true"),
+            self.assertLogs("handtokening.signing.clamav", "ERROR"),
+        ):
+            result = clamav_scan_file(path)
+
+        self.assertTrue(result.clean)
+
+    def test_ingest_file(self):
+        chunks = [EICAR[:20], EICAR[20:]]
+        path = self.run_dir / "in.exe"
+        with patch.object(config, "CLAMD_SOCKET", self.socket_path):
+            result = ingest_file(chunks, path)
+
+        self.assertEqual(path.read_bytes(), EICAR)
+        self.assertEqual(result.size, len(EICAR))
+        self.assertEqual(result.sha256, hashlib.sha256(EICAR).hexdigest())
+        self.assertFalse(result.clamav.clean)
+        self.assertEqual(self.clamd.commands, ["INSTREAM"])
+
+    def test_ingest_file_without_clamd(self):
+        path = self.run_dir / "in.ps1"
+        with (
+            patch.object(config, "CLAMD_SOCKET", None),
+            patch.object(config, "CLAMSCAN_PATH", "/usr/bin/true"),
+        ):
+            result = ingest_file([TEST_SCRIPT.encode()], path)
+
+        self.assertEqual(
+            result.sha256, hashlib.sha256(TEST_SCRIPT.encode()).hexdigest()
+        )
+        self.assertTrue(result.clamav.clean)
+        self.assertEqual(self.clamd.commands, [])
+
+
+class ClamdSigningTests(SigningTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.clamd = FakeClamd(cls.run_dir / "clamd.sock").start()
+        cls.addClassCleanup(cls.clamd.stop)
+
+        cls.patch_config("CLAMD_SOCKET", cls.run_dir / "clamd.sock")
+
+    def test_eicar(self):
+        resp = self.client.post(
+            "/api/sign?" + urlencode({"signing-profile": "test-signing"}),
+            EICAR,
+            content_type="application/octet-stream",
+            headers={
+                "authorization": self.auth,
+                "content-disposition": 'attachment; filename="test.exe"',
+            },
+        )
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertTrue("Win.Test.EICAR_HDB-1 FOUND" in resp.json().get("detail"))
+
+        log = SigningLog.objects.first()
+        self.assertEqual(log.result, SigningLog.Result.AV_POSITIVE)
+
+
+class ParallelScanTests(SigningTestMixin, TestCase):
+    """ClamAV scans the file after the upload, at the same time as VirusTotal."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.patch_config("CLAMD_SOCKET", None)
+        SigningProfile.objects.update(
+            vt_scan=SigningProfile.VirusTotalScanSetting.REQUIRED,
+            vt_fatal_engines="Microsoft",
+        )
+
+        cls.slow_clamscan = cls.run_dir / "slow-clamscan"
+        cls.slow_clamscan.write_text("#!/bin/sh\nsleep 5\n")
+        cls.slow_clamscan.chmod(0o755)
+
+    def sign(self, vt_future: Future):
+        with patch(
+            "handtokening.signing.pipeline.request_vt_analysis",
+            lambda *args, **kwargs: vt_future,
+        ):
+            return self.client.post(
+                "/api/sign?" + urlencode({"signing-profile": "test-signing"}),
+                TEST_SCRIPT,
+                content_type="application/octet-stream",
+                headers={
+                    "authorization": self.auth,
+                    "content-disposition": 'attachment; filename="test.ps1"',
+                },
+            )
+
+    def test_clamav_positive(self):
+        # VirusTotal never finishes
+        vt_future = Future()
+
+        with patch.object(config, "CLAMSCAN_PATH", "/usr/bin/false"):
+            resp = self.sign(vt_future)
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertTrue(vt_future.cancelled())
+
+        log = SigningLog.objects.get()
+        self.assertEqual(log.result, SigningLog.Result.AV_POSITIVE)
+        self.assertEqual(list(log.scan_timings), ["clamav"])
+
+    def test_virus_total_positive(self):
+        vt_future = Future()
+        vt_future.set_result(
+            VirusTotalAnalysis.objects.create(
+                sha256=hashlib.sha256(TEST_SCRIPT.encode()).hexdigest(),
+                date=datetime.now(timezone.utc),
+                bad_count=1,
+                total_count=70,
+                bad_engines={"Microsoft": "malicious"},
+            )
+        )
+
+        with patch.object(config, "CLAMSCAN_PATH", str(self.slow_clamscan)):
+            start = monotonic()
+            resp = self.sign(vt_future)
+
+        # Doesn't wait for the ClamAV scan
+        self.assertLess(monotonic() - start, 4)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(
+            resp.json()["detail"],
+            "Detected as bad by required engine: Microsoft malicious",
+        )
+
+        log = SigningLog.objects.get()
+        self.assertEqual(log.result, SigningLog.Result.AV_POSITIVE)
+        self.assertIn("virustotal", log.scan_timings)
+
+    def answer_pin_request(self, seen: list[dict]):
+        """Approve the first PIN request."""
+        requests_dir = self.run_dir / "requests"
+        deadline = monotonic() + 10
+        while not (paths := list(requests_dir.glob("[!.]*"))):
+            if monotonic() > deadline:
+                return
+            sleep(0.01)
+
+        path = paths[0]
+        seen.append(json.loads(path.read_text()))
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.connect(str(self.run_dir / "responses" / path.name))
+        sock.send(json.dumps({"result": "approve", "code": "1234"}).encode())
+        sock.close()
+
+    def sign_with_pin(self, clamscan_path: str) -> tuple:
+        Certificate.objects.update(is_pkcs11=True)
+        SigningProfile.objects.update(vt_scan=SigningProfile.VirusTotalScanSetting.NO)
+        # Updates don't send signals, and the rollback after the test neither
+        profile_cache.invalidate()
+        self.addCleanup(profile_cache.invalidate)
+
+        seen: list[dict] = []
+        operator = threading.Thread(target=self.answer_pin_request, args=(seen,))
+        operator.start()
+
+        update = ExternalValue.update
+
+        def record_update(external, req_data):
+            seen.append(json.loads(json.dumps(req_data)))
+            update(external, req_data)
+
+        with (
+            patch.object(ExternalValue, "update", record_update),
+            patch.object(config, "CLAMSCAN_PATH", clamscan_path),
+            patch.object(config, "OSSL_PROVIDER_PATH", "/usr/lib/pkcs11prov.so"),
+            patch.object(config, "PKCS11_MODULE_PATH", "/usr/lib/pkcs11.so"),
+            patch("handtokening.signing.osslsigncode.run_command", fake_run_command),
+        ):
+            resp = self.sign(Future())
+
+        operator.join()
+        return resp, seen
+
+    def clamscan(self, exit_code: int) -> str:
+        path = self.run_dir / f"clamscan-{exit_code}"
+        path.write_text(f"#!/bin/sh\nsleep 0.5\nexit {exit_code}\n")
+        path.chmod(0o755)
+        return str(path)
+
+    def test_pin_request_during_scan(self):
+        resp, seen = self.sign_with_pin(self.clamscan(0))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(seen[0]["scans"], {"clamav": "running"})
+        self.assertEqual(seen[-1]["scans"], {"clamav": "passed"})
+        self.assertEqual(list((self.run_dir / "requests").iterdir()), [])
+
+    def test_pin_request_before_upload(self):
+        Certificate.objects.update(is_pkcs11=True)
+        profile_cache.invalidate()
+        self.addCleanup(profile_cache.invalidate)
+
+        requests_dir = self.run_dir / "requests"
+        seen: list[dict] = []
+
+        def positive_ingest(chunks, path, scan_after=True):
+            seen.extend(json.loads(p.read_text()) for p in requests_dir.iterdir())
+            ingested = ingest_file(chunks, path, scan_after)
+            ingested.clamav = ClamAVResult(clean=False, detail="Eicar-Signature")
+            ingested.clamav_time = 0.0
+            return ingested
+
+        with patch("handtokening.signing.pipeline.ingest_file", positive_ingest):
+            resp = self.sign(Future())
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()["detail"], "ClamAV: Eicar-Signature")
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(
+            seen[0]["scans"], {"clamav": "running", "virustotal": "waiting"}
+        )
+        self.assertEqual(list(requests_dir.iterdir()), [])
+        self.assertEqual(list((self.run_dir / "responses").iterdir()), [])
+
+    def test_pin_request_withdrawn(self):
+        resp, seen = self.sign_with_pin(self.clamscan(1))
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(seen[0]["user"], "test")
+        self.assertEqual(list((self.run_dir / "requests").iterdir()), [])
+        self.assertEqual(list((self.run_dir / "responses").iterdir()), [])
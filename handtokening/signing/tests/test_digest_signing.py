@@ -0,0 +1,173 @@
+import base64
+import hashlib
+import subprocess
+from pathlib import Path
+from urllib.parse import urlencode
+
+from asn1crypto import cms, core
+from django.test import TestCase
+
+from handtokening.signing.authenticode import (
+    SPC_PE_IMAGE_DATA,
+    SpcIndirectDataContent,
+)
+from handtokening.signing.models import Certificate, SigningLog, SigningProfile
+from handtokening.signing.profiles import profile_cache
+from handtokening.signing.tests.util import SigningTestMixin
+
+
+# SpcPeImageData as written by osslsigncode
+PE_IMAGE_DATA = bytes.fromhex(
+    "3025030100a020a21e801c003c003c003c004f00620073006f006c006500740065003e003e003e"
+)
+
+DIGEST = hashlib.sha256(b"not really a PE file").digest()
+
+
+def extracted_data(digest=DIGEST, digest_algorithm="sha256") -> bytes:
+    """Mimic the output of `osslsigncode extract-data`."""
+    indirect_data = SpcIndirectDataContent(
+        {
+            "data": {"type": SPC_PE_IMAGE_DATA, "value": core.Any.load(PE_IMAGE_DATA)},
+            "message_digest": {
+                "digest_algorithm": {"algorithm": digest_algorithm},
+                "digest": digest,
+            },
+        }
+    )
+    return cms.ContentInfo(
+        {"content_type": "data", "content": indirect_data.dump()}
+    ).dump()
+
+
+class DigestSigningTests(SigningTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        SigningProfile.objects.update(allow_digest_signing=True)
+
+        cls.certificate = Certificate.objects.first()
+
+    def sign_digest(self, data: bytes, **query):
+        return self.client.post(
+            "/api/sign-digest?"
+            + urlencode({"signing-profile": "test-signing", **query}),
+            data,
+            content_type="application/octet-stream",
+            headers={
+                "authorization": self.auth,
+                "content-disposition": 'attachment; filename="installer.exe"',
+            },
+        )
+
+    def verify_signature(self, signer_info: cms.SignerInfo):
+        # Signature is over the DER SET OF the signed attributes
+        signed_attrs = signer_info["signed_attrs"].dump()
+        signed_attrs = b"\x31" + signed_attrs[1:]
+
+        public_key_path = self.run_dir / "public_key.pem"
+        signature_path = self.run_dir / "signature"
+        subprocess.run(
+            [
+                "openssl",
+                "x509",
+                "-pubkey",
+                "-noout",
+                "-in",
+                self.certificate.cert_path,
+                "-out",
+                public_key_path,
+            ],
+            check=True,
+        )
+        signature_path.write_bytes(signer_info["signature"].native)
+
+        subprocess.run(
+            [
+                "openssl",
+                "dgst",
+                "-sha256",
+                "-verify",
+                public_key_path,
+                "-signature",
+                signature_path,
+            ],
+            input=signed_attrs,
+            check=True,
+            capture_output=True,
+        )
+
+    def test_sign_digest(self):
+        resp = self.sign_digest(extracted_data(), description="Big installer")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["content-type"], "application/pkcs7-signature")
+
+        content_info = cms.ContentInfo.load(resp.content)
+        signed_data = content_info["content"]
+        encap_content_info = signed_data["encap_content_info"]
+        self.assertEqual(
+            encap_content_info["content_type"].dotted, "1.3.6.1.4.1.311.2.1.4"
+        )
+
+        indirect_data = encap_content_info["content"]
+        self.assertEqual(indirect_data["message_digest"]["digest"].native, DIGEST)
+
+        certificate = signed_data["certificates"][0].chosen
+        self.assertTrue("Handtokening Test Sign" in certificate.subject.human_friendly)
+
+        signer_info = signed_data["signer_infos"][0]
+        self.assertEqual(
+            base64.b64decode(resp["ht-signed"]), signer_info["signature"].native
+        )
+
+        attributes = {
+            attr["type"].native: attr["values"][0].native
+            for attr in signer_info["signed_attrs"]
+        }
+        self.assertEqual(attributes["content_type"], "spc_indirect_data")
+        self.assertEqual(
+            attributes["message_digest"],
+            hashlib.sha256(indirect_data.contents).digest(),
+        )
+        self.assertEqual(
+            attributes["spc_sp_opus_info"]["program_name"], "Big installer"
+        )
+
+        self.verify_signature(signer_info)
+
+        log = SigningLog.objects.first()
+        self.assertEqual(log.result, SigningLog.Result.SUCCESS)
+        self.assertEqual(log.signed_digest, DIGEST.hex())
+        self.assertEqual(log.submitted_file_name, "installer.exe")
+        self.assertEqual(Path(log.out_path).read_bytes(), resp.content)
+        self.assertIsNone(log.osslsigncode_command)
+
+    def test_not_allowed(self):
+        SigningProfile.objects.update(allow_digest_signing=False)
+        # Updates don't send signals, and the rollback after the test neither
+        profile_cache.invalidate()
+        self.addCleanup(profile_cache.invalidate)
+
+        resp = self.sign_digest(extracted_data())
+        self.assertEqual(resp.status_code, 400)
+        self.assertTrue("Digest signing isn't allowed" in resp.json()["detail"])
+
+        log = SigningLog.objects.first()
+        self.assertEqual(log.result, SigningLog.Result.SIGN_ERROR)
+        self.assertIsNone(log.signed_digest)
+
+    def test_invalid_data(self):
+        resp = self.sign_digest(b"MZ\x90\x00 this is the whole file")
+        self.assertEqual(resp.status_code, 400)
+        self.assertTrue("Couldn't parse data content" in resp.json()["detail"])
+
+        resp = self.sign_digest(extracted_data(digest=DIGEST[:20]))
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(
+            resp.json()["detail"], "Digest length doesn't match its algorithm"
+        )
+
+        resp = self.sign_digest(extracted_data(digest_algorithm="md5"))
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()["detail"], "Unsupported digest algorithm: md5")
@@ -0,0 +1,175 @@
+from concurrent.futures import Future
+from datetime import timedelta
+from time import monotonic
+from unittest.mock import patch
+from urllib.parse import urlencode
+
+from django.test import TestCase
+from django.utils import timezone
+
+from handtokening.signing.conf import config
+from handtokening.signing.jobs import fail_abandoned_requests, submit_job
+from handtokening.signing.models import SigningLog
+from handtokening.signing.tests.test_signing import TEST_SCRIPT
+from handtokening.signing.tests.util import SigningTestMixin
+
+
+class SigningJobTests(SigningTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        # Run jobs inline so they use the test's database transaction
+        cls.patch_config("SIGNING_JOB_WORKERS", 0)
+
+        cls.headers = {
+            "authorization": cls.auth,
+            "content-disposition": 'attachment; filename="test.ps1"',
+        }
+
+    def submit(self, **headers):
+        return self.client.post(
+            "/api/jobs?" + urlencode({"signing-profile": "test-signing"}),
+            TEST_SCRIPT,
+            content_type="application/octet-stream",
+            headers={**self.headers, **headers},
+        )
+
+    def test_job(self):
+        resp = self.submit()
+        self.assertEqual(resp.status_code, 202)
+
+        job = resp.json()
+        log = SigningLog.objects.get(id=job["id"])
+        self.assertTrue(log.is_job)
+        self.assertEqual(log.response_type, "complete")
+        self.assertTrue(job["status-url"].endswith(f"/api/jobs/{log.id}"))
+
+        resp = self.client.get(
+            f"/api/jobs/{log.id}?wait=5",
+            headers={"authorization": self.headers["authorization"]},
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["result"], SigningLog.Result.SUCCESS)
+
+        resp = self.client.get(
+            f"/api/jobs/{log.id}/result",
+            headers={"authorization": self.headers["authorization"]},
+        )
+        self.assertEqual(resp.status_code, 200)
+        response_file = b"".join(resp.streaming_content).decode()
+        self.assertTrue(response_file.startswith(TEST_SCRIPT))
+        self.assertTrue("# SIG # Begin signature block" in response_file)
+
+    def test_job_early_error(self):
+        resp = self.submit(**{"content-disposition": 'attachment; filename="TEST.FZO"'})
+        self.assertEqual(resp.status_code, 400)
+        self.assertTrue(
+            "Unsupported file extension: 'fzo'" in resp.json().get("detail")
+        )
+
+        log = SigningLog.objects.first()
+        self.assertTrue(log.is_job)
+        self.assertEqual(log.result, SigningLog.Result.UNSUPPORTED_EXTENSION)
+
+    def test_pending_job(self):
+        log = SigningLog.objects.create(
+            ip="127.0.0.1",
+            client=self.sign_client,
+            client_name="test",
+            is_job=True,
+        )
+        self.assertEqual(log.result, SigningLog.Result.PENDING)
+
+        auth = {"authorization": self.headers["authorization"]}
+
+        resp = self.client.get(f"/api/jobs/{log.id}", headers=auth)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["result"], SigningLog.Result.PENDING)
+
+        resp = self.client.get(f"/api/jobs/{log.id}/result", headers=auth)
+        self.assertEqual(resp.status_code, 409)
+
+        log.result = SigningLog.Result.CANCELLED
+        log.result_detail = "Received cancelled response"
+        log.save()
+
+        resp = self.client.get(f"/api/jobs/{log.id}/result", headers=auth)
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()["detail"], "Received cancelled response")
+
+    def test_other_clients_job(self):
+        log = SigningLog.objects.create(
+            ip="127.0.0.1", client=None, client_name="other", is_job=True
+        )
+
+        resp = self.client.get(
+            f"/api/jobs/{log.id}",
+            headers={"authorization": self.headers["authorization"]},
+        )
+        self.assertEqual(resp.status_code, 404)
+
+    def test_abandoned_job(self):
+        abandoned = SigningLog.objects.create(
+            ip="127.0.0.1", client_name="test", is_job=True
+        )
+        running = SigningLog.objects.create(
+            ip="127.0.0.1", client_name="test", is_job=True
+        )
+        SigningLog.objects.filter(id=abandoned.id).update(
+            created=timezone.now() - timedelta(hours=3)
+        )
+
+        self.assertEqual(
+            fail_abandoned_requests(), "Failed 1 abandoned signing requests"
+        )
+
+        abandoned.refresh_from_db()
+        self.assertEqual(abandoned.result, SigningLog.Result.INTERNAL_ERROR)
+        self.assertIsNotNone(abandoned.finished)
+        running.refresh_from_db()
+        self.assertEqual(running.result, SigningLog.Result.PENDING)
+
+    def test_failed_job_future(self):
+        class Pipeline:
+            vt_future = Future()
+            vt_deadline = monotonic() + 60
+
+            def start_virus_total_scan(self):
+                return self.vt_future
+
+        def fail(pipeline):
+            raise RuntimeError("Broken")
+
+        with (
+            patch.object(config, "SIGNING_JOB_WORKERS", 1),
+            patch("handtokening.signing.jobs._run_job_in_thread", fail),
+        ):
+            job_future = submit_job(Pipeline())
+            Pipeline.vt_future.set_result(None)
+
+            with self.assertRaisesMessage(RuntimeError, "Broken"):
+                job_future.result(timeout=10)
+
+    def test_virus_total_deadline(self):
+        class Pipeline:
+            vt_future = Future()
+            vt_deadline = monotonic() + 0.1
+
+            def start_virus_total_scan(self):
+                return self.vt_future
+
+        ran = []
+        with (
+            patch.object(config, "SIGNING_JOB_WORKERS", 1),
+            patch("handtokening.signing.jobs._run_job_in_thread", ran.append),
+        ):
+            pipeline = Pipeline()
+            job_future = submit_job(pipeline)
+
+            # Runs once the pipeline gives up waiting for the analysis
+            job_future.result(timeout=10)
+            self.assertEqual(ran, [pipeline])
+
+            Pipeline.vt_future.set_result(None)
+            self.assertEqual(ran, [pipeline])
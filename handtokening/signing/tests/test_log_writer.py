@@ -0,0 +1,49 @@
+from unittest.mock import patch
+
+from django.test import TestCase, TransactionTestCase
+
+from handtokening.signing.log_writer import QueuedLog, SigningLogWriter
+from handtokening.signing.models import SigningLog
+
+
+def create_log() -> SigningLog:
+    return SigningLog.objects.create(ip="127.0.0.1", client_name="test")
+
+
+class SigningLogWriterTests(TestCase):
+    def test_latest_state_saved_once(self):
+        signing_log = create_log()
+        writer = SigningLogWriter()
+
+        signing_log.result = SigningLog.Result.SIGN_ERROR
+        first = QueuedLog(signing_log)
+        signing_log = SigningLog.objects.get(id=signing_log.id)
+        signing_log.result = SigningLog.Result.SUCCESS
+        second = QueuedLog(signing_log)
+
+        with patch.object(SigningLog, "save", autospec=True) as save:
+            writer.write([first, second, QueuedLog(None)])
+        save.assert_called_once_with(second.signing_log)
+
+
+class SigningLogWriterThreadTests(TransactionTestCase):
+    def test_background_save(self):
+        signing_log = create_log()
+        writer = SigningLogWriter()
+        writer.start()
+
+        signing_log.result = SigningLog.Result.SUCCESS
+        writer.save(signing_log)
+        # What's queued is the state at the time of the call
+        signing_log.result = SigningLog.Result.INTERNAL_ERROR
+
+        self.assertTrue(writer.flush(timeout=10))
+        signing_log.refresh_from_db()
+        self.assertEqual(signing_log.result, SigningLog.Result.SUCCESS)
+
+        signing_log.result = SigningLog.Result.SIGN_ERROR
+        writer.save(signing_log, wait=True)
+        self.assertEqual(
+            SigningLog.objects.get(id=signing_log.id).result,
+            SigningLog.Result.SIGN_ERROR,
+        )
@@ -0,0 +1,178 @@
+from datetime import timedelta
+import io
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from handtokening.signing.apps import set_up_directories
+from handtokening.signing.conf import config
+from handtokening.signing.maintenance import (
+    MaintenanceScheduler,
+    Task,
+    remove_old_files,
+)
+from handtokening.signing.models import (
+    MaintenanceLease,
+    MaintenanceTask,
+    SigningLog,
+    VirusTotalSubmission,
+)
+
+
+class MaintenanceTests(TestCase):
+    def setUp(self):
+        self.run_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.run_dir)
+
+        patcher = patch.object(config, "STATE_DIRECTORY", self.run_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        set_up_directories()
+
+    def scheduler(self, tasks: list[Task]) -> MaintenanceScheduler:
+        scheduler = MaintenanceScheduler(tasks)
+        self.addCleanup(
+            lambda: scheduler.leader_lock_file and scheduler.leader_lock_file.close()
+        )
+        return scheduler
+
+    def test_run_due(self):
+        runs = []
+        scheduler = self.scheduler(
+            [Task("count", timedelta(hours=1), lambda: runs.append(1) or "Counted")]
+        )
+
+        self.assertEqual(len(scheduler.run_due()), 1)
+        self.assertEqual(scheduler.run_due(), [])
+        self.assertEqual(len(runs), 1)
+
+        record = MaintenanceTask.objects.get(name="count")
+        self.assertEqual(record.last_output, "Counted")
+        self.assertEqual(record.run_count, 1)
+        self.assertIsNotNone(record.last_duration)
+        self.assertEqual(record.next_run, record.last_started + timedelta(hours=1))
+
+        # Due again once the interval passed
+        MaintenanceTask.objects.update(next_run=timezone.now())
+        scheduler.run_due()
+        self.assertEqual(len(runs), 2)
+
+    def test_failed_task(self):
+        def fail():
+            raise RuntimeError("Broken")
+
+        scheduler = self.scheduler([Task("fail", timedelta(hours=1), fail)])
+        with self.assertLogs("handtokening.signing.maintenance", "ERROR"):
+            scheduler.run_due()
+
+        record = MaintenanceTask.objects.get(name="fail")
+        self.assertEqual(record.last_error, "RuntimeError: Broken")
+        self.assertEqual(record.failure_count, 1)
+
+    def test_single_leader(self):
+        task = Task("count", timedelta(hours=1), lambda: "Counted")
+        leader = self.scheduler([task])
+        follower = self.scheduler([task])
+
+        self.assertTrue(leader.is_leader())
+        self.assertFalse(follower.is_leader())
+        self.assertEqual(follower.run_due(), [])
+
+        leader.leader_lock_file.close()
+        leader.leader_lock_file = None
+        self.assertEqual(len(follower.run_due()), 1)
+
+    def test_single_leader_per_deployment(self):
+        # Schedulers on different servers don't share the lock file
+        runs = []
+        tasks = [
+            Task("count", timedelta(hours=1), lambda: runs.append(1) or "Counted"),
+            Task("local", timedelta(hours=1), lambda: "Local", per_server=True),
+        ]
+        leader = self.scheduler(tasks)
+        other = self.scheduler(tasks)
+        other.is_leader = lambda: True
+
+        self.assertEqual(len(leader.run_due()), 2)
+        MaintenanceTask.objects.update(next_run=timezone.now())
+
+        # Only the per-server task runs without the lease
+        self.assertEqual([r.name for r in other.run_due()], [tasks[1].record_name])
+        self.assertEqual(len(runs), 1)
+
+        # Taken over once the leader stopped renewing it
+        MaintenanceLease.objects.update(expires=timezone.now())
+        self.assertEqual([r.name for r in other.run_due()], ["count"])
+        self.assertFalse(leader.renew_lease())
+
+    def test_lease_renewed_every_tick(self):
+        task = Task("count", timedelta(hours=1), lambda: "Counted")
+        leader = self.scheduler([task])
+        leader.run_due()
+
+        # Nothing is due, the lease is still kept
+        MaintenanceLease.objects.update(expires=timezone.now() + timedelta(seconds=1))
+        self.assertEqual(leader.run_due(), [])
+        lease = MaintenanceLease.objects.get()
+        self.assertEqual(lease.holder, leader.holder)
+        self.assertGreater(lease.expires, timezone.now() + timedelta(minutes=4))
+
+    def test_lease_renewed_during_task(self):
+        scheduler = self.scheduler(
+            [Task("slow", timedelta(hours=1), lambda: time.sleep(0.3) or "Slow")]
+        )
+        scheduler.tick = 0.05
+        renewals = []
+        scheduler.renew_lease = lambda: renewals.append(1) or True
+
+        scheduler.run_due()
+        # Once for the tick, once before the task, and while it ran
+        self.assertGreater(len(renewals), 3)
+
+    def test_remove_old_files(self):
+        self.assertEqual(remove_old_files(), "Keeping all files")
+
+        old = time.time() - timedelta(days=31).total_seconds()
+        names = ["in/old.exe", "out/old.exe", "in/new.exe", "in/scanning.exe"]
+        for name in names:
+            (self.run_dir / name).write_bytes(b"x" * 10)
+        for name in ["in/old.exe", "out/old.exe", "in/scanning.exe"]:
+            os.utime(self.run_dir / name, (old, old))
+
+        log = SigningLog.objects.create(
+            ip="127.0.0.1",
+            in_path=str(self.run_dir / "in/old.exe"),
+            out_path=str(self.run_dir / "out/old.exe"),
+        )
+        VirusTotalSubmission.objects.create(
+            sha256="00" * 32, path=str(self.run_dir / "in/scanning.exe")
+        )
+
+        with patch.object(config, "FILE_RETENTION_DAYS", timedelta(days=30)):
+            self.assertEqual(remove_old_files(), "Removed 2 files (20 bytes)")
+        self.assertEqual(
+            sorted(os.listdir(self.run_dir / "in")), ["new.exe", "scanning.exe"]
+        )
+        self.assertEqual(os.listdir(self.run_dir / "out"), [])
+
+        log.refresh_from_db()
+        self.assertEqual((log.in_path, log.out_path), (None, None))
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command(
+            "run_maintenance", "--task", "delete_expired_client_secrets", stdout=out
+        )
+        self.assertTrue(
+            out.getvalue().startswith(
+                "delete_expired_client_secrets: Deleted 0 expired secrets"
+            )
+        )
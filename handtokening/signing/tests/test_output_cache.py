@@ -0,0 +1,177 @@
+from datetime import timedelta
+import hashlib
+import os
+import threading
+import time
+from unittest.mock import patch
+from urllib.parse import urlencode
+
+from django.test import TestCase
+from django.utils import timezone
+
+from handtokening.signing.conf import config
+from handtokening.signing.log_writer import save_signing_log
+from handtokening.signing.models import Certificate, SigningLog
+from handtokening.signing.output_cache import (
+    evict_outputs,
+    find_cached_output,
+    output_cache_key,
+    single_flight,
+)
+from handtokening.signing.tests.test_signing import TEST_SCRIPT
+from handtokening.signing.tests.util import SigningTestMixin
+
+
+SIGNED_SCRIPT = TEST_SCRIPT + "# SIG # Begin signature block\n"
+
+
+class OutputCacheTests(SigningTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.patch_config("OUTPUT_CACHE_TTL", timedelta(hours=1))
+
+        cls.certificate = Certificate.objects.first()
+
+    def setUp(self):
+        for f in (self.run_dir / "out").glob("*"):
+            f.unlink()
+
+    def create_cached_log(self, finished=None) -> SigningLog:
+        out_path = self.run_dir / "out" / "cached.ps1"
+        out_path.write_text(SIGNED_SCRIPT)
+
+        return SigningLog.objects.create(
+            ip="127.0.0.1",
+            client=self.sign_client,
+            client_name="test",
+            certificate=self.certificate,
+            certificate_name=self.certificate.name,
+            out_path=str(out_path),
+            result=SigningLog.Result.SUCCESS,
+            finished=finished or timezone.now(),
+            cache_status=SigningLog.CacheStatus.MISS,
+            cache_key=output_cache_key(
+                hashlib.sha256(TEST_SCRIPT.encode()).hexdigest(),
+                self.certificate.id,
+                None,
+                None,
+                "complete",
+            ),
+        )
+
+    def test_cache_hit(self):
+        cached = self.create_cached_log()
+
+        resp = self.client.post(
+            "/api/sign?" + urlencode({"signing-profile": "test-signing"}),
+            TEST_SCRIPT,
+            content_type="application/octet-stream",
+            headers={
+                "authorization": self.auth,
+                "content-disposition": 'attachment; filename="test.ps1"',
+            },
+        )
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(b"".join(resp.streaming_content).decode(), SIGNED_SCRIPT)
+
+        log = SigningLog.objects.first()
+        self.assertEqual(log.result, SigningLog.Result.SUCCESS)
+        self.assertEqual(log.cache_status, SigningLog.CacheStatus.HIT)
+        self.assertEqual(log.cache_source, cached)
+        self.assertEqual(log.certificate, self.certificate)
+        self.assertEqual(log.out_path, cached.out_path)
+        self.assertIsNone(log.osslsigncode_command)
+
+    def test_log_saved_once(self):
+        with patch(
+            "handtokening.signing.pipeline.save_signing_log",
+            wraps=save_signing_log,
+        ) as save:
+            resp = self.client.post(
+                "/api/sign?" + urlencode({"signing-profile": "test-signing"}),
+                TEST_SCRIPT,
+                content_type="application/octet-stream",
+                headers={
+                    "authorization": self.auth,
+                    "content-disposition": 'attachment; filename="test.ps1"',
+                },
+            )
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual(
+            SigningLog.objects.get().cache_status, SigningLog.CacheStatus.MISS
+        )
+
+    def test_cache_expired(self):
+        cached = self.create_cached_log(finished=timezone.now() - timedelta(hours=2))
+        self.assertIsNone(find_cached_output([cached.cache_key]))
+
+    def test_cache_file_removed(self):
+        cached = self.create_cached_log()
+        self.assertEqual(find_cached_output([cached.cache_key]), cached)
+
+        os.unlink(cached.out_path)
+        self.assertIsNone(find_cached_output([cached.cache_key]))
+
+    def test_eviction(self):
+        out_dir = self.run_dir / "out"
+        now = time.time()
+        for i in range(4):
+            path = out_dir / f"{i}.exe"
+            path.write_bytes(b"x" * 100)
+            os.utime(path, (now - 100 + i, now - 100 + i))
+
+        with patch.object(config, "OUTPUT_CACHE_MAX_SIZE", 250):
+            evict_outputs()
+
+        self.assertEqual(sorted(p.name for p in out_dir.iterdir()), ["2.exe", "3.exe"])
+
+    def test_single_flight(self):
+        events = []
+        first_inside = threading.Event()
+
+        def first():
+            with single_flight("key"):
+                first_inside.set()
+                time.sleep(0.2)
+                events.append("first")
+
+        def second():
+            first_inside.wait()
+            with single_flight("key"):
+                events.append("second")
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(events, ["first", "second"])
+        self.assertEqual(list((self.run_dir / "locks").glob("key.lock")), [])
+
+    def test_single_flight_many(self):
+        inside = []
+        overlaps = []
+
+        def run():
+            for _ in range(20):
+                with single_flight("key"):
+                    inside.append(1)
+                    if len(inside) > 1:
+                        overlaps.append(1)
+                    time.sleep(0.001)
+                    inside.pop()
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(overlaps, [])
+        self.assertEqual(list((self.run_dir / "locks").glob("key.lock")), [])
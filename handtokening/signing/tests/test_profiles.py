@@ -0,0 +1,91 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from handtokening.signing.models import Certificate, SigningProfile, TimestampServer
+from handtokening.signing.profiles import ProfileCache, profile_cache
+from handtokening.signing.tests.util import SigningTestMixin
+
+
+class ProfileCacheTests(SigningTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.profile = SigningProfile.objects.get()
+        cls.user = User.objects.get(username="test")
+        cls.server = TimestampServer.objects.create(name="tsa", url="http://tsa")
+        cls.profile.timestamp_servers.add(cls.server)
+
+    def setUp(self):
+        profile_cache.invalidate()
+        self.addCleanup(profile_cache.invalidate)
+
+    def test_cached(self):
+        # The generation, then the profile
+        with self.assertNumQueries(5):
+            resolved = profile_cache.get("test-signing")
+
+        self.assertTrue(resolved.has_access(self.user))
+        self.assertEqual(len(resolved.valid_certificates()), 1)
+        self.assertEqual(resolved.timestamp_servers, [self.server])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(profile_cache.get("test-signing").profile, self.profile)
+
+        # Every request gets its own instances
+        self.assertIsNot(profile_cache.get("test-signing").profile, resolved.profile)
+
+        self.assertIsNone(profile_cache.get("missing"))
+
+    def test_access(self):
+        # Used to be matched with LIKE, so user 1 had access wherever user 11 had
+        other = User.objects.create(id=self.user.id * 10 + 1, username="other")
+        self.profile.users_with_access.set([other])
+
+        resolved = profile_cache.get("test-signing")
+        self.assertTrue(resolved.has_access(other))
+        self.assertFalse(resolved.has_access(self.user))
+
+    def test_invalidation(self):
+        profile_cache.get("test-signing")
+
+        self.profile.certificates.clear()
+        self.assertEqual(profile_cache.get("test-signing").valid_certificates(), [])
+
+        # Other processes' caches see the change through the generation
+        other_process = ProfileCache()
+        other_process.get("test-signing")
+        self.profile.certificates.set(Certificate.objects.all())
+        with self.assertNumQueries(5):
+            other_process.get("test-signing")
+
+        self.profile.vt_fresh_days = 3
+        self.profile.save()
+        self.assertEqual(profile_cache.get("test-signing").profile.vt_fresh_days, 3)
+
+    def test_certificate_expiry(self):
+        resolved = profile_cache.get("test-signing")
+        certificate = resolved.certificates[0]
+
+        # Expired certificates drop out without reloading the profile
+        self.assertEqual(
+            resolved.valid_certificates(certificate.expires - timedelta(seconds=1)),
+            [certificate],
+        )
+        self.assertEqual(resolved.valid_certificates(certificate.expires), [])
+
+    def test_timestamp_server_health(self):
+        profile_cache.get("test-signing")
+        TimestampServer.objects.update(consecutive_failures=5)
+
+        with self.assertNumQueries(1):
+            resolved = profile_cache.get("test-signing")
+        self.assertEqual(resolved.timestamp_servers[0].consecutive_failures, 0)
+
+        with patch.object(ProfileCache, "health_max_age", 0):
+            with self.assertNumQueries(2):
+                resolved = profile_cache.get("test-signing")
+        self.assertEqual(resolved.timestamp_servers[0].consecutive_failures, 5)
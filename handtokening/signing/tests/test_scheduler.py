@@ -0,0 +1,164 @@
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+from urllib.parse import urlencode
+
+from django.test import SimpleTestCase, TestCase
+
+from handtokening.signing.apps import set_up_directories
+from handtokening.signing.conf import Configuration, config
+from handtokening.signing.models import Certificate, SigningLog, SigningProfile
+from handtokening.signing.scheduler import (
+    QueueFull,
+    SigningResource,
+    SigningScheduler,
+    Ticket,
+    fair_order,
+    signing_resource,
+)
+from handtokening.signing.tests.test_digest_signing import extracted_data
+from handtokening.signing.tests.util import SigningTestMixin
+
+
+class SchedulerTests(SimpleTestCase):
+    def setUp(self):
+        run_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, run_dir)
+
+        patcher = patch.object(config, "STATE_DIRECTORY", run_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        set_up_directories()
+
+    def test_fair_order(self):
+        tickets = [
+            Ticket(1, 1, "a", "ci"),
+            Ticket(2, 1, "b", "ci"),
+            Ticket(3, 1, "c", "ci"),
+            Ticket(4, 1, "d", "dev"),
+            Ticket(5, 1, "e", "release"),
+        ]
+        self.assertEqual([t.id for t in fair_order(tickets)], ["a", "d", "e", "b", "c"])
+
+    def test_signing_resource(self):
+        def certificate(id, key_path, is_pkcs11=True):
+            return Certificate(id=id, key_path=key_path, is_pkcs11=is_pkcs11)
+
+        token_a = signing_resource(certificate(1, "pkcs11:token=A;object=one"))
+        self.assertEqual(token_a.concurrency, 1)
+        self.assertEqual(
+            token_a, signing_resource(certificate(2, "pkcs11:token=A;object=two"))
+        )
+        self.assertNotEqual(
+            token_a, signing_resource(certificate(3, "pkcs11:token=B;object=one"))
+        )
+
+        file_key = signing_resource(certificate(4, "/keys/key.pem", is_pkcs11=False))
+        self.assertEqual(file_key.key, "certificate-4")
+        self.assertEqual(file_key.concurrency, config.FILE_KEY_SIGNING_CONCURRENCY)
+
+    def test_concurrency_limit(self):
+        resource = SigningResource("test", concurrency=2)
+        running = []
+        max_running = 0
+        lock = threading.Lock()
+
+        def work():
+            nonlocal max_running
+            with SigningScheduler(resource, "ci").slot():
+                with lock:
+                    running.append(1)
+                    max_running = max(max_running, len(running))
+                time.sleep(0.2)
+                with lock:
+                    running.pop()
+
+        threads = [threading.Thread(target=work) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(max_running, 2)
+        self.assertEqual(SigningScheduler(resource, "ci").tickets(), [])
+
+    def test_queue_depth(self):
+        scheduler = SigningScheduler(SigningResource("test", 1), "ci")
+        scheduler.queue_dir.mkdir()
+
+        with patch.object(config, "SIGNING_QUEUE_MAX_DEPTH", 1):
+            scheduler.check_depth()
+
+            # A ticket of a worker that's gone doesn't count
+            process = subprocess.Popen(["true"])
+            process.wait()
+            dead = Ticket(1, process.pid, "dead", "ci")
+            (scheduler.queue_dir / dead.name).touch()
+            scheduler.check_depth()
+            self.assertFalse((scheduler.queue_dir / dead.name).exists())
+
+            waiting = Ticket(1, 1, "waiting", "ci")
+            (scheduler.queue_dir / waiting.name).touch()
+            with self.assertRaises(QueueFull):
+                scheduler.check_depth()
+
+    def test_queue_timeout(self):
+        resource = SigningResource("test", 1)
+        with SigningScheduler(resource, "ci").slot():
+            with patch.object(config, "SIGNING_QUEUE_TIMEOUT", 0.2):
+                with self.assertRaises(QueueFull):
+                    with SigningScheduler(resource, "dev").slot():
+                        pass
+
+        # Not waiting at all
+        with self.settings(SIGNING_QUEUE_TIMEOUT=0):
+            self.assertEqual(Configuration().SIGNING_QUEUE_TIMEOUT, 0)
+
+
+class SigningQueueTests(SigningTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        SigningProfile.objects.update(allow_digest_signing=True)
+
+        cls.certificate = Certificate.objects.first()
+
+    def sign_digest(self):
+        return self.client.post(
+            "/api/sign-digest?" + urlencode({"signing-profile": "test-signing"}),
+            extracted_data(),
+            content_type="application/octet-stream",
+            headers={
+                "authorization": self.auth,
+                "content-disposition": 'attachment; filename="installer.exe"',
+            },
+        )
+
+    def test_queue_full(self):
+        scheduler = SigningScheduler(signing_resource(self.certificate), "other")
+        scheduler.queue_dir.mkdir(exist_ok=True)
+        waiting = Ticket(1, 1, "waiting", scheduler.flow)
+        waiting_path = scheduler.queue_dir / waiting.name
+        waiting_path.touch()
+
+        with patch.object(config, "SIGNING_QUEUE_MAX_DEPTH", 1):
+            resp = self.sign_digest()
+
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp["retry-after"], str(config.SIGNING_QUEUE_RETRY_AFTER))
+
+        log = SigningLog.objects.first()
+        self.assertEqual(log.result, SigningLog.Result.QUEUE_FULL)
+
+        # Once the queue is empty again the request gets signed
+        waiting_path.unlink()
+        with patch.object(config, "SIGNING_QUEUE_MAX_DEPTH", 1):
+            resp = self.sign_digest()
+
+        self.assertEqual(resp.status_code, 200)
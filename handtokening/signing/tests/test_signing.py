@@ -1,24 +1,12 @@
-import base64
-from unittest.mock import patch
-import tempfile
-import shutil
-from pathlib import Path
 from urllib.parse import urlencode
-import os
 import importlib.metadata
 import hashlib
 
 from django.test import TestCase
-from django.core.management import call_command
 
 from handtokening.signing.conf import config
-from handtokening.clients.models import Client
 from handtokening.signing.models import SigningLog
-from handtokening.signing.apps import set_up_directories
-
-
-def basic_auth(user, pwd):
-    return "Basic " + base64.b64encode(f"{user}:{pwd}".encode()).decode()
+from handtokening.signing.tests.util import SigningTestMixin
 
 
 TEST_SCRIPT = """
@@ -27,27 +15,11 @@ Write-Host "Hello, world!"
 EICAR = rb"X5O!P%@AP[4\PZX54(P^)7CC)7}$EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*"
 
 
-class SigningTests(TestCase):
+class SigningTests(SigningTestMixin, TestCase):
     @classmethod
     def setUpTestData(cls):
-        cls.run_dir = Path(tempfile.mkdtemp())
-        cls.addClassCleanup(lambda: shutil.rmtree(cls.run_dir))
-        os.chmod(cls.run_dir, 0o755)  # ClamAV needs to be able to access this
-
-        dirs = ["PIN_COMMS_LOCATION", "STATE_DIRECTORY", "TEST_CERTIFICATE_DIRECTORY"]
-        for dir in dirs:
-            patcher = patch.object(config, dir, cls.run_dir)
-            patcher.start()
-            cls.addClassCleanup(patcher.stop)
+        super().setUpTestData()
 
-        set_up_directories()
-
-        call_command("set_up_test_signing")
-
-        cls.sign_client = Client.objects.first()
-        cls.sign_client.set_new_secret()
-        cls.sign_client.save()
-        cls.auth = basic_auth("test", cls.sign_client.new_secret)
         cls.headers = {
             "authorization": cls.auth,
             "content-disposition": 'attachment; filename="test.ps1"',
@@ -190,6 +162,10 @@ class SigningTests(TestCase):
 
         self.assertIsNone(log.vt_analysis)
 
+        stages = ["upload", "profile", "ingest", "hash", "scan", "queue", "sign"]
+        for stage in stages + ["response"]:
+            self.assertGreaterEqual(log.stage_timings[stage], 0)
+
         self.assertEqual(log.result, SigningLog.Result.SUCCESS)
         self.assertIsNone(log.exception)
 
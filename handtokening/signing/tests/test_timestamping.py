@@ -0,0 +1,301 @@
+from datetime import timedelta
+import shutil
+import subprocess
+import sys
+import tempfile
+import urllib.request
+from pathlib import Path
+from time import monotonic
+from unittest.mock import patch
+from urllib.parse import urlencode
+
+from django.test import TestCase
+from django.utils import timezone
+
+from handtokening.signing.conf import Configuration, config
+from handtokening.signing.models import SigningLog, SigningProfile, TimestampServer
+from handtokening.signing.osslsigncode import (
+    OSSLSignCodeResult,
+    RunningCommand,
+    finish_command,
+    start_command,
+)
+from handtokening.signing.tests.fake_tsa import FakeTSA
+from handtokening.signing.tests.test_signing import TEST_SCRIPT
+from handtokening.signing.tests.util import SigningTestMixin
+from handtokening.signing.timestamping import (
+    probe_timestamp_server,
+    rank_timestamp_servers,
+    record_timestamp_result,
+)
+
+
+class TimestampServerHealthTests(TestCase):
+    def server(self, name="TSA", **kwargs) -> TimestampServer:
+        return TimestampServer.objects.create(
+            name=name, url=f"http://{name.lower()}.example.com", **kwargs
+        )
+
+    def test_rank(self):
+        slow = self.server("Slow", success_count=10, average_latency=4)
+        fast = self.server("Fast", success_count=10, average_latency=0.5)
+        flaky = self.server(
+            "Flaky", success_count=5, failure_count=5, average_latency=0.5
+        )
+        tripped = self.server(
+            "Tripped",
+            success_count=10,
+            average_latency=0.1,
+            circuit_open_until=timezone.now() + timedelta(minutes=1),
+        )
+
+        self.assertEqual(
+            rank_timestamp_servers([tripped, slow, flaky, fast]),
+            [fast, flaky, slow, tripped],
+        )
+
+    def test_circuit_breaker(self):
+        server = self.server()
+
+        for _ in range(config.TSA_FAILURE_THRESHOLD - 1):
+            record_timestamp_result(server, False, 1.0, "Connection refused")
+
+        server.refresh_from_db()
+        self.assertFalse(server.is_circuit_open)
+
+        record_timestamp_result(server, False, 1.0, "Connection refused")
+        server.refresh_from_db()
+        self.assertTrue(server.is_circuit_open)
+        self.assertEqual(server.failure_count, config.TSA_FAILURE_THRESHOLD)
+        self.assertEqual(server.last_error, "Connection refused")
+
+        record_timestamp_result(server, True, 2.0)
+        record_timestamp_result(server, True, 1.0)
+        server.refresh_from_db()
+        self.assertFalse(server.is_circuit_open)
+        self.assertEqual(server.consecutive_failures, 0)
+        self.assertEqual(server.success_count, 2)
+        # Failures count towards the latency too
+        self.assertAlmostEqual(server.average_latency, 1.16)
+
+    def test_circuit_breaker_off(self):
+        server = self.server()
+
+        with patch.object(config, "TSA_CIRCUIT_BREAK", timedelta(0)):
+            for _ in range(config.TSA_FAILURE_THRESHOLD + 1):
+                record_timestamp_result(server, False, 1.0, "Connection refused")
+
+        server.refresh_from_db()
+        self.assertFalse(server.is_circuit_open)
+        self.assertIsNone(server.circuit_open_until)
+
+        with self.settings(TSA_CIRCUIT_BREAK=0):
+            self.assertEqual(Configuration().TSA_CIRCUIT_BREAK, timedelta(0))
+
+    def test_rank_failing_server_last(self):
+        # Never answered, so it has no latency
+        dead = self.server("Dead", failure_count=2, consecutive_failures=2)
+        good = self.server("Good", success_count=100, average_latency=0.4)
+        new = self.server("New")
+        self.assertEqual(rank_timestamp_servers([dead, new, good]), [good, new, dead])
+
+        # A fast server that just started failing goes behind a slower one
+        good.consecutive_failures = 1
+        slow = self.server("Slow", success_count=100, average_latency=3)
+        self.assertEqual(rank_timestamp_servers([good, slow]), [slow, good])
+
+    def test_probe(self):
+        tsa = FakeTSA().start()
+        self.addCleanup(tsa.stop)
+
+        server = TimestampServer(url=tsa.url)
+        self.assertTrue(probe_timestamp_server(server).success)
+
+        tsa.status = "rejection"
+        result = probe_timestamp_server(server)
+        self.assertFalse(result.success)
+        self.assertEqual(result.error, "Status: rejection")
+
+        server.url = "http://127.0.0.1:1"
+        self.assertFalse(probe_timestamp_server(server).success)
+
+    def test_command_output_does_not_block(self):
+        # More than fits in a pipe buffer, on both streams
+        script = (
+            "import sys; sys.stdout.write('o' * 200000); sys.stderr.write('e' * 200000)"
+        )
+        command = start_command([sys.executable, "-c", script])
+
+        # Would time out if the command blocked writing to a full pipe
+        command.process.wait(timeout=30)
+
+        result = finish_command(command)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(len(result.stdout), 200000)
+        self.assertEqual(len(result.stderr), 200000)
+
+    def test_fake_tsa_token(self):
+        tsa = FakeTSA().start()
+        self.addCleanup(tsa.stop)
+
+        run_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, run_dir)
+
+        data_path = run_dir / "data"
+        data_path.write_bytes(b"timestamp me")
+
+        query = subprocess.run(
+            ["openssl", "ts", "-query", "-data", data_path, "-sha256", "-cert"],
+            check=True,
+            capture_output=True,
+        ).stdout
+
+        reply_path = run_dir / "reply.tsr"
+        reply_path.write_bytes(timestamp_request(tsa.url, query))
+
+        # fmt: off
+        subprocess.run(
+            [
+                "openssl", "ts", "-verify",
+                "-data", data_path,
+                "-in", reply_path,
+                "-CAfile", tsa.cert_path,
+            ],
+            check=True,
+            capture_output=True,
+        )
+        # fmt: on
+
+
+def timestamp_request(url: str, query: bytes) -> bytes:
+    request = urllib.request.Request(
+        url, data=query, headers={"Content-Type": "application/timestamp-query"}
+    )
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+# `osslsigncode add -ts <url> -in <in> -out <out>`, but the timestamp isn't
+# attached to the copy
+FAKE_ADD_TIMESTAMP = """
+import shutil, sys, urllib.request
+from asn1crypto import tsp
+from handtokening.signing.tests.fake_tsa import TimeStampResp
+
+args = dict(zip(sys.argv[2::2], sys.argv[3::2]))
+query = tsp.TimeStampReq({
+    "version": "v1",
+    "message_imprint": {"hash_algorithm": {"algorithm": "sha256"}, "hashed_message": bytes(32)},
+    "cert_req": True,
+})
+request = urllib.request.Request(
+    args["-ts"], data=query.dump(), headers={"Content-Type": "application/timestamp-query"}
+)
+with urllib.request.urlopen(request) as response:
+    reply = TimeStampResp.load(response.read())
+
+if reply["status"]["status"].native != "granted":
+    sys.exit("Failed")
+
+shutil.copy(args["-in"], args["-out"])
+print("Succeeded")
+"""
+
+
+def fake_start_command(command: list[str], env=None) -> RunningCommand:
+    return start_command([sys.executable, "-c", FAKE_ADD_TIMESTAMP, *command[1:]])
+
+
+def fake_run_command(command: list[str], env=None) -> OSSLSignCodeResult:
+    """Sign by copying the file."""
+    args = dict(zip(command[2::2], command[3::2]))
+    Path(args["-out"]).write_bytes(Path(args["-in"]).read_bytes())
+    return OSSLSignCodeResult(0, "Succeeded\n", "")
+
+
+class TimestampingTests(SigningTestMixin, TestCase):
+    def setUp(self):
+        patches = [
+            patch("handtokening.signing.osslsigncode.run_command", fake_run_command),
+            patch("handtokening.signing.pipeline.start_command", fake_start_command),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add_server(self, tsa: FakeTSA, name: str, **kwargs) -> TimestampServer:
+        tsa.start()
+        self.addCleanup(tsa.stop)
+
+        server = TimestampServer.objects.create(name=name, url=tsa.url, **kwargs)
+        SigningProfile.objects.get().timestamp_servers.add(server)
+        return server
+
+    def sign(self):
+        return self.client.post(
+            "/api/sign?" + urlencode({"signing-profile": "test-signing"}),
+            TEST_SCRIPT,
+            content_type="application/octet-stream",
+            headers={
+                "authorization": self.auth,
+                "content-disposition": 'attachment; filename="test.ps1"',
+            },
+        )
+
+    def test_fall_back_to_next_server(self):
+        # The broken server ranks first, as a new server is expected to be
+        # quicker than a slow one
+        broken = self.add_server(FakeTSA(status="rejection"), "Broken")
+        working = self.add_server(
+            FakeTSA(), "Working", success_count=10, average_latency=10.0
+        )
+
+        with patch.object(config, "TSA_HEDGING", 1):
+            resp = self.sign()
+        self.assertEqual(resp.status_code, 200)
+
+        log = SigningLog.objects.get()
+        self.assertEqual(log.result, SigningLog.Result.SUCCESS)
+        self.assertEqual(log.osslsigncode_command.count(" add "), 2)
+
+        broken.refresh_from_db()
+        self.assertEqual(broken.failure_count, 1)
+        self.assertEqual(broken.last_error, "Failed")
+
+        working.refresh_from_db()
+        self.assertEqual(working.success_count, 11)
+        self.assertIsNotNone(working.last_success)
+
+    def test_hedging(self):
+        slow_tsa = FakeTSA(delay=5)
+        slow = self.add_server(slow_tsa, "Slow")
+        fast = self.add_server(FakeTSA(), "Fast", success_count=10, average_latency=1)
+
+        with patch.object(config, "TSA_HEDGING", 2):
+            start = monotonic()
+            resp = self.sign()
+            elapsed = monotonic() - start
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertLess(elapsed, 4)
+        self.assertEqual(slow_tsa.request_count, 1)
+
+        fast.refresh_from_db()
+        self.assertEqual(fast.success_count, 11)
+
+        # The slow request was cancelled, that doesn't count as a failure
+        slow.refresh_from_db()
+        self.assertEqual((slow.success_count, slow.failure_count), (0, 0))
+
+    def test_no_timestamp(self):
+        self.add_server(FakeTSA(status="rejection"), "Broken")
+        self.add_server(FakeTSA(status="waiting"), "Waiting")
+
+        with patch.object(config, "TSA_HEDGING", 2):
+            resp = self.sign()
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(
+            resp.json()["detail"], "Couldn't get a timestamp from any timestamp server"
+        )
+        self.assertEqual(TimestampServer.objects.filter(failure_count=1).count(), 2)
@@ -0,0 +1,138 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from handtokening.signing.models import SigningLog, StageLatencyRollup
+from handtokening.signing.timings import (
+    StageTimer,
+    bucket,
+    bucket_value,
+    percentile,
+    roll_up_stage_timings,
+    stage_latencies,
+)
+
+
+def approx(seconds: float) -> float:
+    return bucket_value(bucket(seconds))
+
+
+def create_log(finished, profile: str, certificate: str, **timings) -> SigningLog:
+    return SigningLog.objects.create(
+        ip="127.0.0.1",
+        client_name="test",
+        signing_profile_name=profile,
+        certificate_name=certificate,
+        finished=finished,
+        stage_timings=timings,
+        scan_timings={"clamav": 0.5},
+    )
+
+
+class StageTimingTests(TestCase):
+    def test_timer(self):
+        timer = StageTimer()
+        with timer.stage("sign"):
+            pass
+        timer.add("sign", 1.0)
+        timer.add("upload", 0.25)
+
+        self.assertEqual(list(timer.timings), ["sign", "upload"])
+        self.assertGreaterEqual(timer.timings["sign"], 1.0)
+
+    def test_percentile(self):
+        # Within a bucket of the value, and never below it
+        for seconds in [0.0005, 0.001, 0.0123, 1, 2.5, 99.9, 3600]:
+            self.assertGreaterEqual(approx(seconds), round(seconds, 3))
+            self.assertLess(approx(seconds), max(seconds * 1.13, 0.002))
+
+        histogram = Counter(bucket(float(n)) for n in range(1, 101))
+        self.assertEqual(percentile(histogram, 50), approx(50))
+        self.assertEqual(percentile(histogram, 99), approx(99))
+        self.assertEqual(percentile(Counter([bucket(3.0)]), 95), approx(3))
+
+    def test_stage_latencies(self):
+        now = timezone.now()
+        for n in range(1, 21):
+            create_log(now, "test-signing", "a", upload=n / 10, sign=n)
+        create_log(now, "other-signing", "b", sign=100)
+        # Outside the window
+        create_log(now - timedelta(days=2), "test-signing", "a", sign=1000)
+
+        latencies = stage_latencies(now - timedelta(days=1))
+        self.assertEqual(
+            [(s.stage, s.count) for s in latencies],
+            [("upload", 20), ("clamav", 21), ("sign", 21)],
+        )
+        sign = latencies[-1]
+        self.assertEqual(
+            (sign.p50, sign.p95, sign.p99), (approx(11), approx(20), approx(100))
+        )
+
+        by_profile = stage_latencies(now - timedelta(days=1), "profile")
+        self.assertEqual(
+            [(s.stage, s.group, s.p99) for s in by_profile if s.stage == "sign"],
+            [
+                ("sign", "other-signing", approx(100)),
+                ("sign", "test-signing", approx(20)),
+            ],
+        )
+
+        by_certificate = stage_latencies(now - timedelta(days=3), "certificate")
+        self.assertEqual(
+            [(s.group, s.p99) for s in by_certificate if s.stage == "sign"],
+            [("a", approx(1000)), ("b", approx(100))],
+        )
+
+    def test_rollup(self):
+        now = timezone.now()
+        for hours in [0, 3, 5, 24 * 40]:
+            finished = now - timedelta(hours=hours)
+            create_log(finished, "test-signing", "a", sign=hours + 1)
+            create_log(finished, "other-signing", "b", sign=1)
+
+        since = now - timedelta(hours=4, minutes=30)
+        before = stage_latencies(since, "profile")
+
+        # Depending on whether the current hour is old enough yet
+        self.assertIn(
+            roll_up_stage_timings(), ["Rolled up 719 hours", "Rolled up 720 hours"]
+        )
+        # Older than the longest window
+        self.assertFalse(
+            StageLatencyRollup.objects.filter(
+                hour__lt=now - timedelta(days=31)
+            ).exists()
+        )
+
+        # The rolled up logs aren't read anymore
+        SigningLog.objects.filter(finished__lt=now - timedelta(hours=2)).update(
+            stage_timings={}, scan_timings={}
+        )
+        self.assertEqual(stage_latencies(since, "profile"), before)
+
+        sign = [s for s in before if s.stage == "sign"]
+        self.assertEqual(
+            [(s.group, s.count, s.p99) for s in sign],
+            [("other-signing", 2, approx(1)), ("test-signing", 2, approx(4))],
+        )
+
+        # Already rolled up
+        roll_up_stage_timings()
+        self.assertEqual(stage_latencies(since, "profile"), before)
+
+    def test_admin_view(self):
+        create_log(timezone.now(), "test-signing", "a", sign=2.5)
+        admin = User.objects.create_superuser("admin")
+        self.client.force_login(admin)
+
+        resp = self.client.get("/admin/signing/signinglog/latency/?group=profile")
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, "test-signing")
+        self.assertContains(resp, f"{approx(2.5):.3f}")
+
+        resp = self.client.get("/admin/signing/signinglog/")
+        self.assertContains(resp, "/admin/signing/signinglog/latency/")
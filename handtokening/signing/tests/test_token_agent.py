@@ -0,0 +1,294 @@
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from urllib.parse import urlencode
+
+from django.test import SimpleTestCase, TestCase
+
+from handtokening.signing.conf import config
+from handtokening.signing.models import Certificate, SigningLog, SigningProfile
+from handtokening.signing.signer import OpenSSLKeySigner
+from handtokening.signing.tests.test_digest_signing import extracted_data
+from handtokening.signing.token_agent import (
+    TokenAgent,
+    TokenAgentClient,
+    TokenAgentError,
+    TokenAgentServer,
+    TokenSession,
+    parse_pkcs11_uri,
+    token_agent_socket,
+)
+from handtokening.signing.tests.util import SigningTestMixin
+
+
+class FakeTokenSession:
+    """Signs with a file key, the PIN has to be 1234."""
+
+    def __init__(self, key_path: str | None = None):
+        self.key_path = key_path
+        self.open_count = 0
+        self.is_open = False
+
+    def open(self, pin: str):
+        if pin != "1234":
+            raise ValueError("Incorrect PIN")
+        self.open_count += 1
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def sign(self, data: bytes, digest_algorithm: str) -> bytes:
+        assert self.is_open
+        if self.key_path:
+            key = Certificate(key_path=self.key_path)
+            return OpenSSLKeySigner(key).sign(data, digest_algorithm)
+        return b"signature of " + data
+
+    def certificates(self) -> list[bytes]:
+        return []
+
+
+class FakeExternalValue:
+    """Approves PIN requests with the right PIN."""
+
+    requests = []
+
+    def __init__(self, request: dict):
+        self.requests.append(request)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def read_for(self, timeout):
+        return {"result": "approve", "code": "1234"}
+
+
+def start_agent_server(path: Path, agent: TokenAgent) -> TokenAgentServer:
+    server = TokenAgentServer(path, agent)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+class TokenAgentTests(SimpleTestCase):
+    def setUp(self):
+        self.session = FakeTokenSession()
+        self.agent = TokenAgent(self.session, max_window=60)
+
+    def tearDown(self):
+        self.agent.logout()
+
+    def test_parse_pkcs11_uri(self):
+        self.assertEqual(
+            parse_pkcs11_uri("pkcs11:token=My%20Token;object=key;id=%01?pin-value=1"),
+            {"token": "My%20Token", "object": "key", "id": "%01"},
+        )
+
+    def test_login_window(self):
+        self.assertFalse(self.agent.status()["logged_in"])
+        self.assertEqual(
+            self.agent.handle({"op": "sign", "data": "", "digest_algorithm": "sha256"}),
+            {"error": "Not logged in"},
+        )
+
+        self.agent.login("1234", 0.2)
+        self.assertTrue(self.agent.status()["logged_in"])
+        self.agent.sign("AAAA", "sha256")
+        self.agent.sign("AAAA", "sha256")
+        self.assertEqual(self.session.open_count, 1)
+
+        time.sleep(0.3)
+        self.assertFalse(self.agent.status()["logged_in"])
+        self.assertFalse(self.session.is_open)
+
+    def test_window_capped(self):
+        self.assertEqual(self.agent.login("1234", 3600)["remaining"], 60)
+
+    def test_wrong_pin(self):
+        response = self.agent.handle({"op": "login", "pin": "0000", "window": 10})
+        self.assertEqual(response, {"error": "ValueError: Incorrect PIN"})
+        self.assertFalse(self.agent.status()["logged_in"])
+
+    def test_client_server(self):
+        run_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, run_dir)
+
+        path = run_dir / "agent.sock"
+        server = start_agent_server(path, self.agent)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+        client = TokenAgentClient(path)
+        with self.assertRaisesMessage(TokenAgentError, "Not logged in"):
+            client.sign(b"data", "sha256")
+
+        client.login("1234", 10)
+        self.assertTrue(client.status()["logged_in"])
+        self.assertEqual(client.sign(b"data", "sha256"), b"signature of data")
+
+        client.logout()
+        self.assertFalse(client.status()["logged_in"])
+
+    def test_agent_not_running(self):
+        client = TokenAgentClient(Path("/nonexistent/agent.sock"))
+        with self.assertRaisesMessage(TokenAgentError, "Token agent unavailable"):
+            client.status()
+
+
+class TokenAgentSigningTests(SigningTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        SigningProfile.objects.update(allow_digest_signing=True)
+        Certificate.objects.update(is_pkcs11=True, use_token_agent=True)
+
+        cls.certificate = Certificate.objects.first()
+
+    def setUp(self):
+        self.session = FakeTokenSession(self.certificate.key_path)
+        self.agent = TokenAgent(self.session, max_window=60)
+
+        path = token_agent_socket(self.certificate.id)
+        path.parent.mkdir(exist_ok=True)
+        server = start_agent_server(path, self.agent)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(self.agent.logout)
+
+        FakeExternalValue.requests = []
+        patcher = patch(
+            "handtokening.signing.pipeline.ExternalValue", FakeExternalValue
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sign_digest(self):
+        return self.client.post(
+            "/api/sign-digest?" + urlencode({"signing-profile": "test-signing"}),
+            extracted_data(),
+            content_type="application/octet-stream",
+            headers={
+                "authorization": self.auth,
+                "content-disposition": 'attachment; filename="installer.exe"',
+            },
+        )
+
+    def test_pin_asked_once(self):
+        for _ in range(3):
+            resp = self.sign_digest()
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp["content-type"], "application/pkcs7-signature")
+
+        self.assertEqual(len(FakeExternalValue.requests), 1)
+        self.assertEqual(
+            FakeExternalValue.requests[0]["session_window"], config.TOKEN_SESSION_WINDOW
+        )
+        self.assertEqual(self.session.open_count, 1)
+
+    def test_session_expired(self):
+        self.sign_digest()
+        self.agent.logout()
+        self.sign_digest()
+
+        self.assertEqual(len(FakeExternalValue.requests), 2)
+        self.assertEqual(self.session.open_count, 2)
+
+    def test_agent_not_running(self):
+        self.agent.logout()
+        token_agent_socket(self.certificate.id).unlink()
+
+        resp = self.sign_digest()
+        self.assertEqual(resp.status_code, 400)
+        self.assertTrue(resp.json()["detail"].startswith("Token agent error"))
+
+        log = SigningLog.objects.first()
+        self.assertEqual(log.result, SigningLog.Result.SIGN_ERROR)
+
+
+def find_softhsm_module() -> str | None:
+    candidates = [
+        os.environ.get("SOFTHSM2_MODULE"),
+        "/usr/lib/softhsm/libsofthsm2.so",
+        "/usr/lib/x86_64-linux-gnu/softhsm/libsofthsm2.so",
+        "/usr/lib64/pkcs11/libsofthsm2.so",
+    ]
+    return next((c for c in candidates if c and os.path.exists(c)), None)
+
+
+def has_python_pkcs11() -> bool:
+    try:
+        import pkcs11  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@unittest.skipUnless(
+    shutil.which("softhsm2-util") and find_softhsm_module() and has_python_pkcs11(),
+    "SoftHSM and python-pkcs11 are required",
+)
+class SoftHSMTests(SimpleTestCase):
+    def setUp(self):
+        import pkcs11
+
+        run_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, run_dir)
+
+        tokens = run_dir / "tokens"
+        tokens.mkdir()
+        conf = run_dir / "softhsm2.conf"
+        conf.write_text(f"directories.tokendir = {tokens}\n")
+
+        patcher = patch.dict(os.environ, {"SOFTHSM2_CONF": str(conf)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # fmt: off
+        subprocess.run(
+            [
+                "softhsm2-util", "--init-token", "--free",
+                "--label", "handtokening", "--so-pin", "5678", "--pin", "1234",
+            ],
+            check=True,
+            capture_output=True,
+        )
+        # fmt: on
+
+        self.module = find_softhsm_module()
+        token = pkcs11.lib(self.module).get_token(token_label="handtokening")
+        with token.open(rw=True, user_pin="1234") as session:
+            session.generate_keypair(
+                pkcs11.KeyType.RSA, 2048, label="signing-key", store=True
+            )
+
+    def test_sign(self):
+        from pkcs11 import Mechanism, ObjectClass
+
+        session = TokenSession(
+            self.module, "pkcs11:token=handtokening;object=signing-key;type=private"
+        )
+        agent = TokenAgent(session, max_window=60)
+        self.addCleanup(agent.logout)
+
+        agent.login("1234", 10)
+        signature = session.sign(b"data", "sha256")
+
+        public_key = session.session.get_key(
+            object_class=ObjectClass.PUBLIC_KEY, label="signing-key"
+        )
+        self.assertTrue(
+            public_key.verify(b"data", signature, mechanism=Mechanism.SHA256_RSA_PKCS)
+        )
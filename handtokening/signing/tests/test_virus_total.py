@@ -1,10 +1,30 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import shutil
+import socket
+import tempfile
+from unittest.mock import patch
 
 import vt
 from django.test import TestCase
 
-from handtokening.signing.models import VirusTotalAnalysis, VirusTotalEngineResult
-from handtokening.signing.virustotal import create_analysis_from_object
+from handtokening.signing.conf import config
+from handtokening.signing.models import (
+    SigningLog,
+    SigningProfile,
+    VirusTotalAnalysis,
+    VirusTotalEngineResult,
+    VirusTotalSubmission,
+)
+from handtokening.signing.virustotal import (
+    VirusTotalError,
+    VirusTotalPoller,
+    VirusTotalQuotaExhausted,
+    create_analysis_from_object,
+    files_due_for_refresh,
+    quota,
+    request_vt_analysis,
+)
 
 
 class VirusTotalTestCase(TestCase):
@@ -109,3 +129,291 @@ class VirusTotalTestCase(TestCase):
         self.assertFalse(smi.good)
 
         self.assertEqual(str(smi), "SymantecMobileInsight type-unsupported")
+
+    def test_summary(self):
+        self.file.get("last_analysis_results")["Microsoft"]["category"] = "malicious"
+        analysis = create_analysis_from_object(SHA256, self.file, "last_analysis_")
+
+        analysis.refresh_from_db()
+        self.assertEqual((analysis.bad_count, analysis.total_count), (1, 6))
+        self.assertEqual(analysis.bad_engines, {"Microsoft": "malicious"})
+
+
+SHA256 = "30820519414911ccbed8591f390e7c272df07237aad475a3147d0e673b7eb2ca"
+
+
+class FakeVirusTotalClient:
+    """Unknown file that takes `polls` polls to analyse."""
+
+    def __init__(self, polls=2, fail_upload=False):
+        self.polls = polls
+        self.fail_upload = fail_upload
+        self.calls: list[str] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def get_object(self, path, *args):
+        self.calls.append(path)
+        if path.startswith("/files/"):
+            raise vt.APIError("NotFoundError", "File not found")
+
+        self.polls -= 1
+        return vt.Object.from_dict(
+            {
+                "type": "analysis",
+                "id": args[0],
+                "attributes": {
+                    "status": "queued" if self.polls else "completed",
+                    "date": int(datetime.now(timezone.utc).timestamp()),
+                    "results": {
+                        "ClamAV": {
+                            "method": "blacklist",
+                            "engine_name": "ClamAV",
+                            "engine_version": "1.4.3.0",
+                            "engine_update": "20250825",
+                            "category": "undetected",
+                            "result": None,
+                        },
+                    },
+                },
+            }
+        )
+
+    def scan_file(self, file):
+        self.calls.append("scan_file")
+        if self.fail_upload:
+            raise vt.APIError("QuotaExceededError", "Quota exceeded")
+        return vt.Object.from_dict({"type": "analysis", "id": "analysis-1"})
+
+
+class VirusTotalPollerTestCase(TestCase):
+    def setUp(self):
+        self.state_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.state_dir)
+        (self.state_dir / "locks").mkdir()
+
+        self.file_path = self.state_dir / "file.exe"
+        self.file_path.write_bytes(b"MZ")
+
+        self.client = FakeVirusTotalClient()
+        self.poller = VirusTotalPoller()
+        patches = [
+            patch.object(config, "STATE_DIRECTORY", self.state_dir),
+            patch.object(config, "VIRUS_TOTAL_API_KEY", "key"),
+            patch(
+                "handtokening.signing.virustotal.get_configured_client",
+                lambda: self.client,
+            ),
+            patch("handtokening.signing.virustotal.get_poller", lambda: self.poller),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_due(self):
+        VirusTotalSubmission.objects.update(next_poll=datetime.now(timezone.utc))
+
+    def test_coalesce_and_backoff(self):
+        first = request_vt_analysis(self.file_path, SHA256)
+        second = request_vt_analysis(self.file_path, SHA256)
+        self.assertEqual(VirusTotalSubmission.objects.count(), 1)
+
+        self.poller.run_once()
+        submission = VirusTotalSubmission.objects.get()
+        self.assertEqual(submission.status, VirusTotalSubmission.Status.POLLING)
+        self.assertEqual(submission.poll_interval, self.poller.initial_poll_delay)
+
+        # Not due yet
+        self.poller.run_once()
+        self.assertEqual(self.client.calls, ["/files/" + SHA256, "scan_file"])
+
+        self.make_due()
+        self.poller.run_once()
+        submission.refresh_from_db()
+        self.assertEqual(submission.poll_interval, 15 * self.poller.poll_backoff)
+        self.assertFalse(first.done())
+
+        # Requests arriving while polling are attached to the same analysis
+        third = request_vt_analysis(self.file_path, SHA256)
+
+        self.make_due()
+        self.poller.run_once()
+
+        analysis = first.result(timeout=0)
+        self.assertEqual(second.result(timeout=0), analysis)
+        self.assertEqual(third.result(timeout=0), analysis)
+        self.assertEqual(analysis.api_calls, 4)
+        self.assertEqual(len(self.client.calls), 4)
+
+        # Recent analyses are reused without any calls
+        self.assertEqual(
+            request_vt_analysis(self.file_path, SHA256).result(0), analysis
+        )
+        self.assertEqual(len(self.client.calls), 4)
+
+    def test_failure_and_retry(self):
+        self.client.fail_upload = True
+        future = request_vt_analysis(self.file_path, SHA256)
+        with self.assertLogs("handtokening.signing.virustotal", "WARNING"):
+            self.poller.run_once()
+
+        with self.assertRaisesRegex(VirusTotalError, "Quota exceeded"):
+            future.result(timeout=0)
+
+        self.client.fail_upload = False
+        future = request_vt_analysis(self.file_path, SHA256)
+        submission = VirusTotalSubmission.objects.get()
+        self.assertEqual(submission.status, VirusTotalSubmission.Status.QUEUED)
+        self.assertEqual(submission.api_calls, 0)
+
+    def test_client_error(self):
+        def fail():
+            raise RuntimeError("No client")
+
+        future = request_vt_analysis(self.file_path, SHA256)
+        with (
+            patch("handtokening.signing.virustotal.get_configured_client", fail),
+            self.assertLogs("handtokening.signing.virustotal", "WARNING"),
+        ):
+            self.poller.run_once()
+
+        with self.assertRaisesRegex(VirusTotalError, "No client"):
+            future.result(timeout=0)
+
+    def test_not_configured(self):
+        with patch.object(config, "VIRUS_TOTAL_API_KEY", None):
+            with self.assertRaisesMessage(RuntimeError, "No VirusTotal API key"):
+                request_vt_analysis(self.file_path, SHA256)
+        self.assertFalse(VirusTotalSubmission.objects.exists())
+
+    def test_analysis_timeout(self):
+        future = request_vt_analysis(self.file_path, SHA256)
+        self.poller.run_once()
+        self.assertFalse(future.done())
+
+        VirusTotalSubmission.objects.update(
+            queued=datetime.now(timezone.utc) - self.poller.max_analysis_time
+        )
+        self.poller.run_once()
+        with self.assertRaisesMessage(VirusTotalError, "Timed out"):
+            future.result(timeout=0)
+
+    def test_expired_analysis(self):
+        VirusTotalAnalysis.objects.create(
+            sha256=SHA256, date=datetime.now(timezone.utc) - timedelta(days=30)
+        )
+        future = request_vt_analysis(self.file_path, SHA256)
+        self.assertFalse(future.done())
+
+    def test_single_leader(self):
+        other = VirusTotalPoller()
+        self.assertTrue(self.poller.is_leader())
+        self.assertFalse(other.is_leader())
+
+        request_vt_analysis(self.file_path, SHA256)
+        other.run_once()
+        self.assertEqual(self.client.calls, [])
+
+    def test_other_server(self):
+        # Its file is on the other server, only that server's poller has it
+        request_vt_analysis(self.file_path, SHA256)
+        VirusTotalSubmission.objects.update(host="other-server")
+        self.poller.run_once()
+        self.assertEqual(self.client.calls, [])
+
+        VirusTotalSubmission.objects.update(host=socket.gethostname())
+        self.poller.run_once()
+        self.assertEqual(self.client.calls, ["/files/" + SHA256, "scan_file"])
+
+    def test_quota(self):
+        with patch.object(config, "VIRUS_TOTAL_REQUESTS_PER_MINUTE", 2):
+            self.assertEqual(quota.acquire(), 0)
+            self.assertEqual(quota.acquire(), 0)
+            self.assertAlmostEqual(quota.wait_time(), 30, delta=1)
+
+            # Submissions stay queued until there's quota
+            future = request_vt_analysis(self.file_path, SHA256)
+            self.poller.run_once()
+            self.assertEqual(self.client.calls, [])
+            self.assertFalse(future.done())
+
+        with (
+            patch.object(config, "VIRUS_TOTAL_REQUESTS_PER_MINUTE", 0),
+            patch.object(config, "VIRUS_TOTAL_REQUESTS_PER_DAY", 3),
+        ):
+            self.assertEqual(quota.acquire(), 0)
+            self.assertGreater(quota.acquire(), 0)
+
+    def test_quota_exhausted(self):
+        stale = VirusTotalAnalysis.objects.create(
+            sha256=SHA256, date=datetime.now(timezone.utc) - timedelta(days=30)
+        )
+
+        with patch.object(config, "VIRUS_TOTAL_REQUESTS_PER_DAY", 1):
+            quota.acquire()
+
+            # Until the end of the day is longer than the request waits
+            with self.assertRaises(VirusTotalQuotaExhausted):
+                request_vt_analysis(self.file_path, SHA256, max_wait=1)
+
+            with self.assertLogs("handtokening.signing.virustotal", "WARNING"):
+                future = request_vt_analysis(
+                    self.file_path, SHA256, max_wait=1, allow_stale=True
+                )
+            self.assertEqual(future.result(timeout=0), stale)
+
+    def test_stale_while_revalidate(self):
+        stale = VirusTotalAnalysis.objects.create(
+            sha256=SHA256, date=datetime.now(timezone.utc) - timedelta(days=12)
+        )
+
+        future = request_vt_analysis(
+            self.file_path,
+            SHA256,
+            fresh_for=timedelta(days=10),
+            stale_for=timedelta(days=5),
+        )
+        self.assertEqual(future.result(timeout=0), stale)
+
+        submission = VirusTotalSubmission.objects.get()
+        self.assertEqual(submission.status, VirusTotalSubmission.Status.QUEUED)
+        self.assertEqual(submission.max_age, timedelta(days=10))
+
+        # Past the stale window the request waits for the new analysis
+        future = request_vt_analysis(
+            self.file_path,
+            SHA256,
+            fresh_for=timedelta(days=5),
+            stale_for=timedelta(days=5),
+        )
+        self.assertFalse(future.done())
+        submission.refresh_from_db()
+        self.assertEqual(submission.max_age, timedelta(days=5))
+
+    def test_files_due_for_refresh(self):
+        profile = SigningProfile.objects.create(
+            name="vt", vt_scan=SigningProfile.VirusTotalScanSetting.ATTEMPT
+        )
+        now = datetime.now(timezone.utc)
+
+        for sha256, age in [("a" * 64, 9.5), ("b" * 64, 5)]:
+            analysis = VirusTotalAnalysis.objects.create(
+                sha256=sha256, date=now - timedelta(days=age)
+            )
+            SigningLog.objects.create(
+                ip="127.0.0.1",
+                client_name="test",
+                signing_profile=profile,
+                in_path=f"/tmp/{sha256}",
+                in_file_sha256=sha256,
+                vt_analysis=analysis,
+            )
+
+        self.assertEqual(
+            files_due_for_refresh(timedelta(days=1), timedelta(days=30)),
+            {"a" * 64: "/tmp/" + "a" * 64},
+        )
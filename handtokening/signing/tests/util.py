@@ -0,0 +1,50 @@
+import base64
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+from django.core.management import call_command
+
+from handtokening.clients.models import Client
+from handtokening.signing.apps import set_up_directories
+from handtokening.signing.conf import config
+
+
+def basic_auth(user, pwd):
+    return "Basic " + base64.b64encode(f"{user}:{pwd}".encode()).decode()
+
+
+class SigningTestMixin:
+    """Test signing setup in a temporary state directory.
+
+    Sets up the test signing profile and certificate and a client with a new
+    secret, sent with the `auth` header.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.run_dir = Path(tempfile.mkdtemp())
+        cls.addClassCleanup(shutil.rmtree, cls.run_dir)
+        os.chmod(cls.run_dir, 0o755)  # ClamAV needs to be able to access this
+
+        dirs = ["PIN_COMMS_LOCATION", "STATE_DIRECTORY", "TEST_CERTIFICATE_DIRECTORY"]
+        for dir in dirs:
+            cls.patch_config(dir, cls.run_dir)
+
+        set_up_directories()
+        call_command("set_up_test_signing")
+
+        cls.sign_client = Client.objects.first()
+        cls.sign_client.set_new_secret()
+        cls.auth = basic_auth("test", cls.sign_client.new_secret)
+
+    @classmethod
+    def patch_config(cls, name: str, value):
+        """Change a setting for the whole test case."""
+        patcher = patch.object(config, name, value)
+        patcher.start()
+        cls.addClassCleanup(patcher.stop)
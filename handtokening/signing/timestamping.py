@@ -0,0 +1,182 @@
+"""Timestamp server health and ordering.
+
+Every timestamp request made while signing, and every probe made by
+`django-admin probe_timestamp_servers`, is recorded on the TimestampServer.
+Servers are tried best first: the ones that failed fewest times in a row,
+then by the expected time to get a timestamp. A server that failed
+TSA_FAILURE_THRESHOLD times in a row is skipped for TSA_CIRCUIT_BREAK
+seconds, unless there's nothing else left to try.
+"""
+
+from dataclasses import dataclass, field
+import hashlib
+import logging
+import os
+from pathlib import Path
+import random
+from time import monotonic
+import urllib.request
+
+from asn1crypto import cms, core, tsp
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .conf import config
+from .models import TimestampServer
+from .osslsigncode import RunningCommand
+
+
+logger = logging.getLogger(__name__)
+
+
+# Weight of the newest request in average_latency
+LATENCY_WEIGHT = 0.2
+
+# Seconds assumed for a server that hasn't been tried yet, so it's tried after
+# servers known to be quick but before slow ones
+UNKNOWN_LATENCY = 5.0
+
+
+class TimeStampResp(core.Sequence):
+    """RFC 3161 response, asn1crypto's requires the token even when rejected."""
+
+    _fields = [
+        ("status", tsp.PKIStatusInfo),
+        ("time_stamp_token", cms.ContentInfo, {"optional": True}),
+    ]
+
+
+def _server_score(server: TimestampServer) -> float:
+    """Expected time to get a timestamp, lower is better."""
+    # Add one success and one failure so new servers get a fair chance
+    success_rate = (server.success_count + 1) / (
+        server.success_count + server.failure_count + 2
+    )
+    latency = server.average_latency
+    if latency is None:
+        latency = UNKNOWN_LATENCY
+    return latency / success_rate
+
+
+@dataclass
+class TimestampAttempt:
+    """Running `osslsigncode add` for a single timestamp server."""
+
+    server: TimestampServer
+    out_path: Path
+    process: RunningCommand
+    start: float = field(default_factory=monotonic)
+
+    @property
+    def latency(self) -> float:
+        return monotonic() - self.start
+
+
+def rank_timestamp_servers(servers: list[TimestampServer]) -> list[TimestampServer]:
+    """Order servers best first, servers with an open circuit go last."""
+    # Shuffle first so load is spread over servers that score the same
+    servers = random.sample(servers, len(servers))
+    return sorted(
+        servers,
+        key=lambda s: (s.is_circuit_open, s.consecutive_failures, _server_score(s)),
+    )
+
+
+def record_timestamp_result(
+    server: TimestampServer, success: bool, latency: float, error: str | None = None
+):
+    """Update the server's health after a request.
+
+    The latency of failed requests counts too, it's the time lost on the server
+    before trying the next one.
+    """
+    servers = TimestampServer.objects.filter(id=server.id)
+    now = timezone.now()
+    average_latency = Coalesce(
+        F("average_latency") * (1 - LATENCY_WEIGHT) + Value(latency * LATENCY_WEIGHT),
+        Value(latency),
+    )
+
+    if success:
+        servers.update(
+            success_count=F("success_count") + 1,
+            consecutive_failures=0,
+            average_latency=average_latency,
+            last_success=now,
+            circuit_open_until=None,
+        )
+    else:
+        servers.update(
+            failure_count=F("failure_count") + 1,
+            consecutive_failures=F("consecutive_failures") + 1,
+            average_latency=average_latency,
+            last_failure=now,
+            last_error=error,
+        )
+        if not config.TSA_CIRCUIT_BREAK:
+            return
+
+        tripped = servers.filter(
+            consecutive_failures__gte=config.TSA_FAILURE_THRESHOLD
+        ).update(circuit_open_until=now + config.TSA_CIRCUIT_BREAK)
+
+        if tripped:
+            logger.warning(
+                "Timestamp server %s failed %s times in a row, skipping it until %s",
+                server.name,
+                config.TSA_FAILURE_THRESHOLD,
+                now + config.TSA_CIRCUIT_BREAK,
+            )
+
+
+@dataclass
+class ProbeResult:
+    success: bool
+    latency: float
+    error: str | None = None
+
+
+def probe_timestamp_server(server: TimestampServer) -> ProbeResult:
+    """Request an RFC 3161 timestamp for a random digest."""
+    request = tsp.TimeStampReq(
+        {
+            "version": "v1",
+            "message_imprint": {
+                "hash_algorithm": {"algorithm": "sha256"},
+                "hashed_message": hashlib.sha256(os.urandom(32)).digest(),
+            },
+            "nonce": int.from_bytes(os.urandom(8)),
+            "cert_req": True,
+        }
+    )
+    http_request = urllib.request.Request(
+        server.url,
+        data=request.dump(),
+        headers={"Content-Type": "application/timestamp-query"},
+    )
+
+    start = monotonic()
+    try:
+        with urllib.request.urlopen(
+            http_request, timeout=config.TSA_PROBE_TIMEOUT
+        ) as response:
+            body = response.read()
+
+        status = TimeStampResp.load(body)["status"]["status"].native
+        if status not in ("granted", "granted_with_mods"):
+            return ProbeResult(False, monotonic() - start, f"Status: {status}")
+    except Exception as exc:
+        return ProbeResult(False, monotonic() - start, f"{type(exc).__name__}: {exc}")
+
+    return ProbeResult(True, monotonic() - start)
+
+
+def probe_timestamp_servers() -> list[tuple[TimestampServer, ProbeResult]]:
+    results = []
+    for server in TimestampServer.objects.filter(is_enabled=True):
+        result = probe_timestamp_server(server)
+        record_timestamp_result(server, result.success, result.latency, result.error)
+        results.append((server, result))
+
+    return results
@@ -0,0 +1,247 @@
+"""Timing the stages of a signing request, and their latency percentiles.
+
+Every request records how long each stage took in SigningLog.stage_timings,
+next to the AV scans in scan_timings. The admin's latency page aggregates
+these over a recent window.
+
+The maintenance task roll_up_stage_timings sums up every finished hour into
+StageLatencyRollup histograms, so the page reads a few rows per hour of the
+window, and only the logs of the partial hours at either end. The histogram
+buckets are about 12% wide, the percentiles are the upper bound of their
+bucket.
+"""
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import math
+from time import monotonic
+
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import SigningLog, StageLatencyRollup
+
+
+# In the order they happen. "hash" is part of "ingest", and ClamAV and
+# VirusTotal run alongside each other during "scan".
+STAGES = {
+    "upload": "Receiving the request body",
+    "profile": "Resolving the signing profile and certificate",
+    "ingest": "Writing the file, streaming it to clamd",
+    "hash": "Hashing the file",
+    "clamav": "ClamAV scan",
+    "virustotal": "VirusTotal analysis",
+    "scan": "Waiting for the scans",
+    "cache_wait": "Waiting for an identical request",
+    "queue": "Waiting for the signing slot",
+    "pin": "Waiting for the PIN",
+    "sign": "Signing",
+    "timestamp": "Timestamping",
+    "response": "Preparing the response",
+}
+
+WINDOWS = {
+    "1h": timedelta(hours=1),
+    "24h": timedelta(days=1),
+    "7d": timedelta(days=7),
+    "30d": timedelta(days=30),
+}
+
+GROUP_FIELDS = {
+    "stage": None,
+    "profile": "signing_profile_name",
+    "certificate": "certificate_name",
+}
+
+# Histogram buckets, the first one is everything up to a millisecond
+BUCKET_MIN = 0.001
+BUCKETS_PER_DECADE = 20
+
+# Logs are written in the background, give them time before their hour is
+# rolled up
+ROLLUP_DELAY = timedelta(minutes=5)
+HOUR = timedelta(hours=1)
+
+
+class StageTimer:
+    """Seconds spent in each stage, summed when a stage is entered again."""
+
+    def __init__(self):
+        self.timings: dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        self.timings[name] = round(self.timings.get(name, 0) + seconds, 3)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, monotonic() - start)
+
+
+def bucket(seconds: float) -> int:
+    if seconds <= BUCKET_MIN:
+        return 0
+    return math.ceil(math.log10(seconds / BUCKET_MIN) * BUCKETS_PER_DECADE - 1e-9)
+
+
+def bucket_value(index: int) -> float:
+    """Upper bound of the bucket."""
+    return round(BUCKET_MIN * 10 ** (index / BUCKETS_PER_DECADE), 3)
+
+
+def percentile(histogram: Counter[int], p: float) -> float:
+    """Nearest-rank percentile of the timings in the histogram."""
+    rank = max(math.ceil(p / 100 * histogram.total()), 1)
+    seen = 0
+    for index in sorted(histogram):
+        seen += histogram[index]
+        if seen >= rank:
+            return bucket_value(index)
+    raise ValueError("Empty histogram")
+
+
+@dataclass
+class StageLatency:
+    stage: str
+    group: str | None
+    count: int
+    p50: float
+    p95: float
+    p99: float
+
+    @property
+    def description(self) -> str:
+        return STAGES.get(self.stage, "")
+
+
+def floor_hour(time: datetime) -> datetime:
+    return time.replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_hour(time: datetime) -> datetime:
+    hour = floor_hour(time)
+    return hour if hour == time else hour + HOUR
+
+
+def log_timings(since: datetime, until: datetime | None, fields: list[str]):
+    """Yield the timings of the logs finished in the range with the fields."""
+    logs = SigningLog.objects.filter(finished__gte=since)
+    if until:
+        logs = logs.filter(finished__lt=until)
+
+    rows = logs.values_list("stage_timings", "scan_timings", *fields)
+    for row in rows.iterator(chunk_size=2000):
+        stage_timings, scan_timings = row[0] or {}, row[1] or {}
+        yield {**scan_timings, **stage_timings}, row[2:]
+
+
+def roll_up_stage_timings() -> str:
+    """Add the hours that finished since the last run to the rollups.
+
+    The first run starts from the longest window ago, rollups older than that
+    are deleted.
+    """
+    now = timezone.now()
+    keep_from = floor_hour(now - max(WINDOWS.values()))
+    end = floor_hour(now - ROLLUP_DELAY)
+
+    last = StageLatencyRollup.objects.aggregate(Max("hour"))["hour__max"]
+    start = max(last + HOUR, keep_from) if last else keep_from
+
+    histograms: dict[tuple, Counter[int]] = defaultdict(Counter)
+    fields = ["finished", "signing_profile_name", "certificate_name"]
+    for timings, (finished, profile, certificate) in log_timings(start, end, fields):
+        hour = floor_hour(finished)
+        for stage, seconds in timings.items():
+            histograms[hour, stage, profile, certificate][bucket(seconds)] += 1
+
+    rollups = [
+        StageLatencyRollup(
+            hour=hour,
+            stage=stage,
+            signing_profile_name=profile,
+            certificate_name=certificate,
+            count=histogram.total(),
+            histogram=dict(histogram),
+        )
+        for (hour, stage, profile, certificate), histogram in histograms.items()
+    ]
+
+    with transaction.atomic():
+        StageLatencyRollup.objects.filter(hour__lt=keep_from).delete()
+        StageLatencyRollup.objects.bulk_create(rollups, batch_size=500)
+
+    return f"Rolled up {max(end - start, timedelta(0)) // HOUR} hours"
+
+
+def stage_latencies(
+    since: datetime, group_by: str = "stage", until: datetime | None = None
+) -> list[StageLatency]:
+    """p50/p95/p99 of every stage for the logs finished since `since`.
+
+    group_by is a key of GROUP_FIELDS, to split every stage up further by
+    signing profile or certificate. The whole hours that were rolled up are
+    read from StageLatencyRollup, the rest from the logs.
+    """
+    group_field = GROUP_FIELDS[group_by]
+    fields = [group_field] if group_field else []
+
+    histograms: dict[tuple[str, str | None], Counter[int]] = defaultdict(Counter)
+
+    def add_logs(since: datetime, until: datetime | None):
+        for timings, row in log_timings(since, until, fields):
+            group = row[0] if group_field else None
+            for stage, seconds in timings.items():
+                histograms[stage, group][bucket(seconds)] += 1
+
+    rolled = StageLatencyRollup.objects.aggregate(Min("hour"), Max("hour"))
+    if rolled["hour__min"]:
+        rolled_from = max(ceil_hour(since), rolled["hour__min"])
+        rolled_until = rolled["hour__max"] + HOUR
+        if until:
+            rolled_until = min(rolled_until, floor_hour(until))
+    else:
+        rolled_from = rolled_until = since
+
+    if rolled_from < rolled_until:
+        rollups = StageLatencyRollup.objects.filter(
+            hour__gte=rolled_from, hour__lt=rolled_until
+        ).values_list("stage", "histogram", *fields)
+        for stage, histogram, *group in rollups.iterator(chunk_size=2000):
+            group = group[0] if group_field else None
+            histograms[stage, group].update(
+                {int(index): count for index, count in histogram.items()}
+            )
+
+        add_logs(since, rolled_from)
+        add_logs(rolled_until, until)
+    else:
+        add_logs(since, until)
+
+    order = {stage: i for i, stage in enumerate(STAGES)}
+
+    def sort_key(key: tuple[str, str | None]):
+        stage, group = key
+        return (order.get(stage, len(order)), stage, group or "")
+
+    latencies = []
+    for stage, group in sorted(histograms, key=sort_key):
+        histogram = histograms[stage, group]
+        latencies.append(
+            StageLatency(
+                stage=stage,
+                group=group,
+                count=histogram.total(),
+                p50=percentile(histogram, 50),
+                p95=percentile(histogram, 95),
+                p99=percentile(histogram, 99),
+            )
+        )
+
+    return latencies
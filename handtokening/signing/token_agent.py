@@ -0,0 +1,309 @@
+"""Long running PKCS #11 signer that keeps the token logged in.
+
+Every osslsigncode process loads the PKCS #11 module, scans the slots, and
+logs in to the token again, which takes seconds on most hardware tokens. The
+token agent (`django-admin token_agent <certificate>`) opens the token once
+and keeps the session logged in for a window approved by the operator entering
+the PIN. The web workers talk to it over a unix socket, one JSON request per
+connection.
+
+Only used for certificates with use_token_agent enabled, python-pkcs11 is
+imported when the agent starts so it's not required otherwise.
+"""
+
+import base64
+import json
+import logging
+import os
+from pathlib import Path
+import socket
+import socketserver
+import threading
+from time import monotonic
+from urllib.parse import unquote
+
+from .conf import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenAgentError(RuntimeError):
+    pass
+
+
+def token_agent_socket(certificate_id: int) -> Path:
+    return config.PIN_COMMS_LOCATION / "token-agents" / f"{certificate_id}.sock"
+
+
+def parse_pkcs11_uri(uri: str) -> dict[str, str]:
+    """Path attributes of a PKCS #11 URI (RFC 7512), percent-decoded."""
+    scheme, _, rest = uri.partition(":")
+    if scheme != "pkcs11":
+        raise ValueError(f"Not a PKCS #11 URI: {uri!r}")
+
+    path, _, _ = rest.partition("?")
+
+    attributes = {}
+    for attribute in path.split(";"):
+        if attribute:
+            name, _, value = attribute.partition("=")
+            attributes[name] = value
+    return attributes
+
+
+class TokenSession:
+    """Logged in session on the token that holds the certificate's key."""
+
+    def __init__(self, module: str, key_uri: str, cert_uri: str | None = None):
+        import pkcs11
+
+        self.pkcs11 = pkcs11
+        self.lib = pkcs11.lib(module)
+        self.key_attributes = parse_pkcs11_uri(key_uri)
+        self.cert_attributes = parse_pkcs11_uri(cert_uri) if cert_uri else None
+
+        token_kwargs = {}
+        if "token" in self.key_attributes:
+            token_kwargs["token_label"] = unquote(self.key_attributes["token"])
+        if "serial" in self.key_attributes:
+            token_kwargs["token_serial"] = unquote(self.key_attributes["serial"])
+        self.token = self.lib.get_token(**token_kwargs)
+
+        self.session = None
+        self.key = None
+
+    def _search(self, attributes: dict[str, str]) -> dict:
+        search = {}
+        if "object" in attributes:
+            search["label"] = unquote(attributes["object"])
+        if "id" in attributes:
+            search["id"] = unquote(attributes["id"], encoding="latin-1").encode(
+                "latin-1"
+            )
+        return search
+
+    def open(self, pin: str):
+        self.session = self.token.open(user_pin=pin)
+        self.key = self.session.get_key(
+            object_class=self.pkcs11.ObjectClass.PRIVATE_KEY,
+            **self._search(self.key_attributes),
+        )
+
+    def close(self):
+        if self.session:
+            self.session.close()
+        self.session = None
+        self.key = None
+
+    def sign(self, data: bytes, digest_algorithm: str) -> bytes:
+        from pkcs11.util.ec import encode_ecdsa_signature
+
+        Mechanism = self.pkcs11.Mechanism
+        key_type = self.key.key_type
+        hash_name = digest_algorithm.upper()
+
+        if key_type == self.pkcs11.KeyType.RSA:
+            return self.key.sign(data, mechanism=Mechanism[f"{hash_name}_RSA_PKCS"])
+        elif key_type == self.pkcs11.KeyType.EC:
+            signature = self.key.sign(data, mechanism=Mechanism[f"ECDSA_{hash_name}"])
+            return encode_ecdsa_signature(signature)
+        else:
+            raise TokenAgentError(f"Unsupported key type: {key_type}")
+
+    def certificates(self) -> list[bytes]:
+        Attribute = self.pkcs11.Attribute
+
+        attributes = {Attribute.CLASS: self.pkcs11.ObjectClass.CERTIFICATE}
+        search = self._search(self.cert_attributes or self.key_attributes)
+        if "label" in search:
+            attributes[Attribute.LABEL] = search["label"]
+        if "id" in search:
+            attributes[Attribute.ID] = search["id"]
+
+        return [obj[Attribute.VALUE] for obj in self.session.get_objects(attributes)]
+
+
+class TokenAgent:
+    """Keeps a TokenSession logged in until the approved window is over.
+
+    Token operations are done one at a time.
+    """
+
+    def __init__(self, session: TokenSession, max_window: float):
+        self.session = session
+        self.max_window = max_window
+        self.lock = threading.Lock()
+        self.expires: float | None = None
+        self.logout_timer: threading.Timer | None = None
+
+    def _require_login(self):
+        if self.expires is None or monotonic() >= self.expires:
+            raise TokenAgentError("Not logged in")
+
+    def status(self) -> dict:
+        with self.lock:
+            if self.expires is None:
+                return {"logged_in": False, "remaining": 0}
+
+            remaining = max(self.expires - monotonic(), 0)
+            return {"logged_in": remaining > 0, "remaining": remaining}
+
+    def login(self, pin: str, window: float) -> dict:
+        window = min(window, self.max_window)
+
+        with self.lock:
+            self._logout()
+            self.session.open(pin)
+            self.expires = monotonic() + window
+
+            self.logout_timer = threading.Timer(window, self.logout)
+            self.logout_timer.daemon = True
+            self.logout_timer.start()
+
+        logger.info("Logged in to token for %s seconds", window)
+        return {"remaining": window}
+
+    def _logout(self):
+        if self.logout_timer:
+            self.logout_timer.cancel()
+            self.logout_timer = None
+
+        if self.expires is not None:
+            self.expires = None
+            self.session.close()
+            logger.info("Logged out of token")
+
+    def logout(self) -> dict:
+        with self.lock:
+            self._logout()
+        return {}
+
+    def sign(self, data: str, digest_algorithm: str) -> dict:
+        with self.lock:
+            self._require_login()
+            signature = self.session.sign(base64.b64decode(data), digest_algorithm)
+        return {"signature": base64.b64encode(signature).decode()}
+
+    def certificates(self) -> dict:
+        with self.lock:
+            self._require_login()
+            certificates = self.session.certificates()
+        return {"certificates": [base64.b64encode(c).decode() for c in certificates]}
+
+    def handle(self, request: dict) -> dict:
+        operations = {
+            "status": self.status,
+            "login": self.login,
+            "logout": self.logout,
+            "sign": self.sign,
+            "certificates": self.certificates,
+        }
+
+        operation = operations.get(request.pop("op", None))
+        if operation is None:
+            return {"error": "Unknown operation"}
+
+        try:
+            return operation(**request)
+        except TokenAgentError as exc:
+            return {"error": str(exc)}
+        except Exception as exc:
+            logger.exception("Token agent operation failed")
+            return {"error": f"{type(exc).__name__}: {exc}"}
+
+
+class TokenAgentRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            response = {"error": "Invalid request"}
+        else:
+            response = self.server.agent.handle(request)
+
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class TokenAgentServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path, agent: TokenAgent):
+        self.agent = agent
+
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+        # Only the service user may talk to the agent
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(str(path), TokenAgentRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+
+class TokenAgentClient:
+    def __init__(self, path: Path, timeout: float = 30):
+        self.path = path
+        self.timeout = timeout
+
+    def _request(self, op: str, **kwargs) -> dict:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(str(self.path))
+                sock.sendall(json.dumps({"op": op, **kwargs}).encode() + b"\n")
+
+                with sock.makefile("rb") as f:
+                    response = json.loads(f.readline())
+        except (OSError, ValueError) as exc:
+            raise TokenAgentError(f"Token agent unavailable: {exc}") from exc
+
+        if "error" in response:
+            raise TokenAgentError(response["error"])
+
+        return response
+
+    def status(self) -> dict:
+        return self._request("status")
+
+    def login(self, pin: str, window: float) -> dict:
+        return self._request("login", pin=pin, window=window)
+
+    def logout(self):
+        self._request("logout")
+
+    def sign(self, data: bytes, digest_algorithm: str) -> bytes:
+        response = self._request(
+            "sign",
+            data=base64.b64encode(data).decode(),
+            digest_algorithm=digest_algorithm,
+        )
+        return base64.b64decode(response["signature"])
+
+    def certificates(self) -> list[bytes]:
+        response = self._request("certificates")
+        return [base64.b64decode(c) for c in response["certificates"]]
+
+
+def serve(certificate, max_window: float, session_factory=TokenSession):
+    """Run the token agent for the certificate until interrupted."""
+    session = session_factory(
+        certificate.pkcs11_module or config.PKCS11_MODULE_PATH,
+        certificate.key_path,
+        certificate.cert_path if certificate.cert_path.startswith("pkcs11:") else None,
+    )
+
+    path = token_agent_socket(certificate.id)
+    path.parent.mkdir(mode=0o700, exist_ok=True)
+
+    agent = TokenAgent(session, max_window)
+    with TokenAgentServer(path, agent) as server:
+        logger.info("Token agent for %s listening on %s", certificate.name, path)
+        try:
+            server.serve_forever()
+        finally:
+            agent.logout()
+            os.unlink(path)
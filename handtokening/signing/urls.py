@@ -1,7 +1,23 @@
 from django.urls import path
 
-from .views import SignView
+from .views import (
+    BatchSignView,
+    CatalogSignView,
+    DigestSignView,
+    JobResultView,
+    JobStatusView,
+    JobSubmitView,
+    SignView,
+)
 
 
 app_name = "signing"
-urlpatterns = [path("sign", SignView.as_view())]
+urlpatterns = [
+    path("sign", SignView.as_view(), name="sign"),
+    path("sign-batch", BatchSignView.as_view(), name="sign-batch"),
+    path("sign-catalog", CatalogSignView.as_view(), name="sign-catalog"),
+    path("sign-digest", DigestSignView.as_view(), name="sign-digest"),
+    path("jobs", JobSubmitView.as_view(), name="job-submit"),
+    path("jobs/<int:job_id>", JobStatusView.as_view(), name="job-status"),
+    path("jobs/<int:job_id>/result", JobResultView.as_view(), name="job-result"),
+]
@@ -1,102 +1,142 @@
-import hashlib
 import logging
-import os
-import random
 from pathlib import Path
-import string
-import subprocess
-import tempfile
-import base64
+from time import monotonic, sleep
 
-from asn1crypto import cms
 from django.core.files.uploadedfile import UploadedFile
-from django.http import FileResponse, HttpResponse
 from django.shortcuts import get_object_or_404
-from django.utils import timezone
-from django.utils.text import slugify
-from ipware import get_client_ip
+from django.urls import reverse
 from rest_framework.parsers import FileUploadParser
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .conf import config
-from .external_value import ExternalValue
-from .models import SigningProfile, SigningLog
-from .osslsigncode import (
-    OSSLSignCodeCommand,
-    OSSLSignCodePkcs11,
-    OSSLSignCodeResult,
-    command_log_string,
+from .batch import BatchSigning
+from .jobs import submit_job
+from .models import SigningLog
+from .pipeline import (
+    CatalogSigningPipeline,
+    DigestSigningPipeline,
+    SigningError,
+    SigningPipeline,
+    signed_file_response,
+)
+from .serializers import (
+    BatchSigningRequestSerializer,
+    CatalogSigningRequestSerializer,
+    DigestSigningRequestSerializer,
+    JobStatusSerializer,
+    SigningRequestSerializer,
 )
-from .serializers import SigningRequestSerializer
-from .virustotal import vt_scan_file
 
 
 logger = logging.getLogger(__name__)
 
 
-SUPPORTED_FILE_EXTENSIONS = [
-    "dll",
-    "exe",
-    "sys",
-    "msi",
-    "ps1",
-    "ps1xml",
-    "psc1",
-    "psd1",
-    "psm1",
-    "cdxml",
-    "mof",
-    "js",
-    "cab",
-    "cat",
-    "appx",
-]
+class SignView(APIView):
+    parser_classes = [FileUploadParser]
+
+    query_serializer_class = SigningRequestSerializer
+    pipeline_class = SigningPipeline
 
+    def post(self, request: Request, format=None):
+        query_serializer = self.query_serializer_class(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        query = query_serializer.validated_data
 
-class SigningError(RuntimeError):
-    result = SigningLog.Result.SIGN_ERROR
+        # The body is read when the request's data is first accessed
+        upload_start = monotonic()
+        incoming_file: UploadedFile = request.data["file"]
+        upload_time = monotonic() - upload_start
 
+        pipeline = self.pipeline_class.from_request(request, query, incoming_file.name)
+        pipeline.timer.add("upload", upload_time)
 
-class AVPositive(SigningError):
-    result = SigningLog.Result.AV_POSITIVE
+        try:
+            pipeline.prepare(incoming_file)
+            pipeline.sign()
+            with pipeline.timer.stage("response"):
+                return pipeline.response()
+        except Exception as exc:
+            pipeline.record_error(exc)
 
+            if isinstance(exc, SigningError):
+                return Response(
+                    {"detail": str(exc)}, status=exc.status_code, headers=exc.headers
+                )
+            else:
+                raise
+        finally:
+            pipeline.finish()
 
-class VirusTotalPositive(AVPositive):
-    pass
 
+class DigestSignView(SignView):
+    """Sign the data content extracted with `osslsigncode extract-data`."""
 
-class NoCertificates(SigningError):
-    result = SigningLog.Result.NO_CERTIFICATES
+    query_serializer_class = DigestSigningRequestSerializer
+    pipeline_class = DigestSigningPipeline
 
 
-class UnsupportedExtension(SigningError):
-    result = SigningLog.Result.UNSUPPORTED_EXTENSION
+class BatchSignView(APIView):
+    """Sign the supported files in a zip archive, see batch.py."""
 
+    parser_classes = [FileUploadParser]
 
-class SigningCancelled(SigningError):
-    result = SigningLog.Result.CANCELLED
+    def post(self, request: Request, format=None):
+        query_serializer = BatchSigningRequestSerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        query = query_serializer.validated_data
 
+        incoming_file: UploadedFile = request.data["file"]
 
-class PinTimeout(SigningError):
-    result = SigningLog.Result.PIN_TIMEOUT
+        batch = BatchSigning.from_request(request, query, incoming_file.name)
 
+        try:
+            batch.prepare(incoming_file)
+            batch.sign()
+            return batch.response()
+        except Exception as exc:
+            batch.record_error(exc)
 
-def sha256_file_path(path: str | Path) -> str:
-    """Return SHA256 hash of the bytes in the file at the provided path."""
-    with open(path, "rb") as f:
-        return hashlib.file_digest(f, "sha256").hexdigest()
+            if isinstance(exc, SigningError):
+                return Response(
+                    {"detail": str(exc), "files": batch.file_results()},
+                    status=exc.status_code,
+                    headers=exc.headers,
+                )
+            else:
+                raise
+        finally:
+            batch.finish()
 
 
-_random_chars = string.ascii_letters + string.digits
+class CatalogSignView(SignView):
+    """Generate and sign a catalog for a zip archive or manifest of files."""
 
+    query_serializer_class = CatalogSigningRequestSerializer
+    pipeline_class = CatalogSigningPipeline
 
-def random_file_name() -> Path:
-    return Path(tempfile.gettempdir()) / "".join(random.choices(_random_chars, k=10))
 
+def job_status(signing_log: SigningLog, request: Request) -> dict:
+    return {
+        "id": signing_log.id,
+        "result": signing_log.result,
+        "detail": signing_log.result_detail,
+        "status-url": request.build_absolute_uri(
+            reverse("signing:job-status", args=[signing_log.id])
+        ),
+        "result-url": request.build_absolute_uri(
+            reverse("signing:job-result", args=[signing_log.id])
+        ),
+    }
+
+
+class JobSubmitView(APIView):
+    """Receive a file and sign it in the background.
+
+    The upload and ClamAV scan still happen inside the request, the rest of the
+    pipeline (VirusTotal, pin entry, and osslsigncode) runs as a job.
+    """
 
-class SignView(APIView):
     parser_classes = [FileUploadParser]
 
     def post(self, request: Request, format=None):
@@ -104,241 +144,79 @@ class SignView(APIView):
         query_serializer.is_valid(raise_exception=True)
         query = query_serializer.validated_data
 
+        upload_start = monotonic()
         incoming_file: UploadedFile = request.data["file"]
+        upload_time = monotonic() - upload_start
 
-        result: OSSLSignCodeResult | None = None
-        cmd = OSSLSignCodeCommand()
-        cmd.program_path = config.OSSLSIGNCODE_PATH
-        cmd.description = query.get("description")
-        cmd.url = query.get("url")
-
-        ip, _ = get_client_ip(request)
-        signing_log = SigningLog(
-            ip=ip,
-            user_agent=request.META.get("HTTP_USER_AGENT"),
-            client=request.user.client,
-            client_name=request.user.username,
-            signing_profile_name=query["signing-profile"],
-            description=query.get("description"),
-            url=query.get("url"),
-            submitted_file_name=incoming_file.name,
-        )
-        signing_log.save()
-
-        in_path_sha256: str | None = None
+        pipeline = SigningPipeline.from_request(request, query, incoming_file.name)
+        pipeline.signing_log.is_job = True
+        pipeline.timer.add("upload", upload_time)
 
         try:
-            file_basename, _, file_extension = incoming_file.name.rpartition(".")
-            file_extension = file_extension.lower()
+            pipeline.prepare(incoming_file)
+        except Exception as exc:
+            pipeline.record_error(exc)
+            pipeline.finish()
 
-            if file_extension not in SUPPORTED_FILE_EXTENSIONS:
-                raise UnsupportedExtension(
-                    f"Unsupported file extension: '{file_extension}'"
+            if isinstance(exc, SigningError):
+                return Response(
+                    {"detail": str(exc)}, status=exc.status_code, headers=exc.headers
                 )
+            else:
+                raise
 
-            signing_profile: SigningProfile = get_object_or_404(
-                SigningProfile.objects.filter(
-                    users_with_access__id__contains=request.user.id,
-                    name=query["signing-profile"],
-                )
-            )
-            signing_log.signing_profile = signing_profile
+        pipeline.signing_log.save()
+        submit_job(pipeline)
 
-            certificates = signing_profile.certificates.filter(
-                is_enabled=True, expires__gt=timezone.now()
-            )
+        return Response(job_status(pipeline.signing_log, request), status=202)
 
-            if not certificates:
-                raise NoCertificates(
-                    f"No valid certificates in signing profile '{signing_profile.name}'"
-                )
 
-            certificate = random.choice(certificates)
+def get_job_log(request: Request, job_id: int) -> SigningLog:
+    return get_object_or_404(
+        SigningLog.objects.filter(is_job=True, client=request.user.client),
+        id=job_id,
+    )
 
-            signing_log.certificate = certificate
-            signing_log.certificate_name = certificate.name
 
-            cmd.cert_path = certificate.cert_path
-            cmd.key_path = certificate.key_path
+class JobStatusView(APIView):
+    # How often the database is checked while waiting for a job to finish
+    poll_interval = 0.5
+    # Longest wait, a waiting request takes up one of the worker's threads
+    max_wait = 10
 
-            # PKCS #11
-            if certificate.is_pkcs11:
-                cmd.pkcs11 = OSSLSignCodePkcs11(
-                    module=certificate.pkcs11_module or config.PKCS11_MODULE_PATH,
-                    provider=config.OSSL_PROVIDER_PATH,
-                    engine=config.OSSL_ENGINE_PATH,
-                )
+    def get(self, request: Request, job_id: int, format=None):
+        query_serializer = JobStatusSerializer(data=request.query_params)
+        query_serializer.is_valid(raise_exception=True)
+        wait = min(query_serializer.validated_data["wait"], self.max_wait)
 
-            cmd.timestamp_servers = list(
-                signing_profile.timestamp_servers.filter(is_enabled=True)
-            )
-            cmd.shuffle_timestamp_servers()
-
-            local_file_name = (
-                f"{signing_log.id}-{slugify(file_basename)}.{file_extension}"
-            )
-
-            cmd.in_path = config.STATE_DIRECTORY / "in" / local_file_name
-
-            # Write submitted file to local path
-            with open(cmd.in_path, "wb") as on_disk:
-                for chunk in incoming_file.chunks():
-                    on_disk.write(chunk)
-
-            in_path_sha256 = sha256_file_path(cmd.in_path)
-
-            # ClamAV scan
-            clamscan = subprocess.run(
-                [
-                    config.CLAMSCAN_PATH,
-                    "--no-summary",
-                    cmd.in_path,
-                ],
-                timeout=30,
-                text=True,
-                capture_output=True,
-            )
-
-            if clamscan.returncode != 0:
-                raise AVPositive(f"ClamAV: {clamscan.stdout.strip()}")
-
-            if signing_profile.vt_scan != SigningProfile.VirusTotalScanSetting.NO:
-                try:
-                    analysis = vt_scan_file(cmd.in_path, in_path_sha256)
-                    engine_results = list(analysis.results.all())
-
-                    signing_log.vt_analysis = analysis
-
-                    fatal_candidates = signing_profile.get_vt_fatal_engines_list()
-                    fatal_engines: list[str] = []
-                    for engine_result in engine_results:
-                        if (
-                            engine_result.bad
-                            and engine_result.name.lower() in fatal_candidates
-                        ):
-                            fatal_engines.append(str(engine_result))
-
-                    if fatal_engines:
-                        raise VirusTotalPositive(
-                            f"Detected as bad by required engine: {', '.join(fatal_engines)}"
-                        )
-
-                    bad_count = sum(r.bad for r in engine_results)
-                    percent_bad = bad_count / len(engine_results) * 100
-                    if percent_bad > signing_profile.vt_max_bad_percent:
-                        raise VirusTotalPositive(
-                            "Too many engines marked the code as bad"
-                        )
-                except Exception as exc:
-                    if isinstance(exc, SigningError):
-                        raise  # Pass on up
-                    elif (
-                        signing_profile.vt_scan
-                        == SigningProfile.VirusTotalScanSetting.REQUIRED
-                    ):
-                        raise  # VirusTotal analysis is required so abort signing process
-                    else:
-                        # Not required, so we log the error and continue
-                        logger.exception("VirusTotal scan error")
-
-            if certificate.is_pkcs11:
-                # Get pin for accessing the hardware token
-                request = {
-                    "user": request.user.username,
-                    "certificate": certificate.name,
-                    "description": query.get("description") or "No description",
-                }
-                with ExternalValue(request) as external:
-                    try:
-                        resp = external.read_for(60)
-                    except TimeoutError:
-                        raise PinTimeout("Didn't receive pin on time")
-
-                if resp["result"] == "cancelled":
-                    raise SigningCancelled("Received cancelled response")
-                elif resp["result"] != "approve":
-                    raise SigningError(
-                        f"Unexpected response result: {repr(resp['result'])}"
-                    )
-
-                cmd.pin = resp["code"]
-
-            cmd.out_path = config.STATE_DIRECTORY / "out" / local_file_name
-            signing_log.osslsigncode_command = command_log_string(cmd.build_command())
-            result = cmd.run()
-
-            if not result.success:
-                raise SigningError(f"osslsigncode error code: {result.returncode}")
-
-            signing_log.result = SigningLog.Result.SUCCESS
-
-            if query["response-type"] == "complete":
-                return FileResponse(
-                    open(cmd.out_path, "rb"),
-                    as_attachment=True,
-                    filename=local_file_name,
-                )
-            elif query["response-type"] == "pkcs7":
-                pkcs7_temp_path = random_file_name()
-                subprocess.run(
-                    [
-                        config.OSSLSIGNCODE_PATH,
-                        "extract-signature",
-                        "-in",
-                        cmd.out_path,
-                        "-out",
-                        pkcs7_temp_path,
-                    ],
-                    check=True,
-                    stdin=subprocess.DEVNULL,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                )
-                with open(pkcs7_temp_path, "rb") as f:
-                    pkcs7_data = f.read()
-                pkcs7_temp_path.unlink()
-
-                signer_info = cms.ContentInfo.load(pkcs7_data)["content"][
-                    "signer_infos"
-                ][0]
-                signature = base64.b64encode(signer_info["signature"].native)
-                return HttpResponse(
-                    pkcs7_data,
-                    content_type="application/pkcs7-signature",
-                    headers={
-                        "ht-signed": signature,
-                    },
-                )
-        except Exception as exc:
-            signing_log.exception = repr(exc)
+        signing_log = get_job_log(request, job_id)
 
-            if isinstance(exc, SigningError):
-                signing_log.result = exc.result
-                return Response({"detail": str(exc)}, status=400)
-            else:
-                signing_log.result = SigningLog.Result.INTERNAL_ERROR
-                raise
-        finally:
-            if cmd.in_path:
-                signing_log.in_path = str(cmd.in_path)
-                try:
-                    signing_log.in_file_size = os.path.getsize(cmd.in_path)
-                    signing_log.in_file_sha256 = in_path_sha256
-                except Exception:
-                    pass
-
-            if cmd.out_path:
-                signing_log.out_path = str(cmd.out_path)
-                try:
-                    signing_log.out_file_size = os.path.getsize(cmd.out_path)
-                    signing_log.out_file_sha256 = sha256_file_path(cmd.out_path)
-                except Exception:
-                    pass
-
-            if result:
-                signing_log.osslsigncode_returncode = result.returncode
-                signing_log.osslsigncode_stdout = result.stdout
-                signing_log.osslsigncode_stderr = result.stderr
-
-            signing_log.finished = timezone.now()
-            signing_log.save()
+        deadline = monotonic() + wait
+        while (
+            signing_log.result == SigningLog.Result.PENDING and monotonic() < deadline
+        ):
+            sleep(self.poll_interval)
+            signing_log.refresh_from_db(fields=["result", "result_detail"])
+
+        return Response(job_status(signing_log, request))
+
+
+class JobResultView(APIView):
+    def get(self, request: Request, job_id: int, format=None):
+        signing_log = get_job_log(request, job_id)
+
+        if signing_log.result == SigningLog.Result.PENDING:
+            return Response({"detail": "Job hasn't finished yet"}, status=409)
+        elif signing_log.result == SigningLog.Result.INTERNAL_ERROR:
+            return Response({"detail": "Internal error"}, status=500)
+        elif signing_log.result != SigningLog.Result.SUCCESS:
+            return Response({"detail": signing_log.result_detail}, status=400)
+
+        # Cleared when the file was removed by the remove_old_files task
+        out_path = signing_log.out_path and Path(signing_log.out_path)
+        if not out_path or not out_path.exists():
+            return Response({"detail": "Signed file no longer available"}, status=410)
+
+        return signed_file_response(
+            out_path, out_path.name, signing_log.response_type or "complete"
+        )
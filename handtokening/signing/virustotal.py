@@ -1,21 +1,43 @@
-from datetime import datetime, timezone, timedelta
-from time import sleep, time
+from collections import defaultdict
+from concurrent.futures import Future
+from datetime import datetime, time, timezone, timedelta
+import fcntl
+import json
+import logging
+import os
 from pathlib import Path
+import socket
+import threading
+from typing import IO
 
+from django.db import close_old_connections
+from django.db.models import Q
 import vt
 from vt.utils import make_sync as vt_make_sync
 
-from .models import VirusTotalAnalysis, VirusTotalEngineResult
+from .models import (
+    SigningLog,
+    SigningProfile,
+    VirusTotalAnalysis,
+    VirusTotalEngineResult,
+    VirusTotalSubmission,
+)
 from .conf import config
 
 
+logger = logging.getLogger(__name__)
+
+
 ANALYSIS_REUSE_TIME = timedelta(days=10)
 
 
-def get_configured_client() -> vt.Client:
+def check_configured():
     if not config.VIRUS_TOTAL_API_KEY:
         raise RuntimeError("No VirusTotal API key configured")
 
+
+def get_configured_client() -> vt.Client:
+    check_configured()
     return vt.Client(config.VIRUS_TOTAL_API_KEY, "handtokening")
 
 
@@ -27,9 +49,8 @@ def create_analysis_from_object(
         date=datetime.fromtimestamp(object.get(f"{key_prefix}date"), timezone.utc),
         **extra_fields,
     )
-    analysis.save()
 
-    analysis.results.bulk_create(
+    results = [
         VirusTotalEngineResult(
             analysis=analysis,
             category=result.get("category"),
@@ -40,60 +61,499 @@ def create_analysis_from_object(
             result=result.get("result"),
         )
         for result in object.get(f"{key_prefix}results").values()
-    )
+    ]
+    analysis.summarize_results(results)
+    analysis.save()
+
+    VirusTotalEngineResult.objects.bulk_create(results)
 
     return analysis
 
 
-def can_reuse_file_analysis(file: vt.Object):
+def can_reuse_file_analysis(file: vt.Object, max_age: timedelta = ANALYSIS_REUSE_TIME):
     if not file.get("last_analysis_date"):
         return False
 
     now = datetime.now(timezone.utc)
     last_analysis = datetime.fromtimestamp(file.get("last_analysis_date"), timezone.utc)
 
-    return now - last_analysis < ANALYSIS_REUSE_TIME
+    return now - last_analysis < max_age
 
 
-def vt_scan_file(path: str | Path, sha256: str) -> VirusTotalAnalysis:
-    existing_analysis = (
-        VirusTotalAnalysis.objects.filter(sha256=sha256).order_by("-date").first()
-    )
-    if existing_analysis and existing_analysis.get_age() < ANALYSIS_REUSE_TIME:
-        return existing_analysis
+class VirusTotalError(Exception):
+    pass
+
+
+class VirusTotalQuotaExhausted(VirusTotalError):
+    def __init__(self, retry_after: float):
+        super().__init__(f"VirusTotal API quota used up, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class VirusTotalQuota:
+    """Token bucket for the VirusTotal API quota, shared by all processes.
+
+    Allows VIRUS_TOTAL_REQUESTS_PER_MINUTE requests per minute, with bursts of
+    up to a minute's worth, and VIRUS_TOTAL_REQUESTS_PER_DAY per UTC day. The
+    state is kept in STATE_DIRECTORY and updated under a lock.
+    """
+
+    def acquire(self) -> float:
+        """Take a request, or return the seconds until one is available."""
+        return self._update(consume=True)
+
+    def wait_time(self) -> float:
+        """Return the seconds until a request is available."""
+        return self._update(consume=False)
+
+    def _update(self, consume: bool) -> float:
+        per_minute = config.VIRUS_TOTAL_REQUESTS_PER_MINUTE
+        per_day = config.VIRUS_TOTAL_REQUESTS_PER_DAY
+        state_path = config.STATE_DIRECTORY / "virustotal-quota.json"
+        lock_path = config.STATE_DIRECTORY / "locks" / "virustotal-quota.lock"
+
+        now = datetime.now(timezone.utc)
+        today = now.date().isoformat()
+
+        with open(lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            try:
+                state = json.loads(state_path.read_text())
+            except (FileNotFoundError, ValueError):
+                state = {"tokens": per_minute, "updated": now.timestamp()}
+
+            elapsed = max(now.timestamp() - state["updated"], 0)
+            tokens = min(per_minute, state["tokens"] + elapsed * per_minute / 60)
+            day_count = state.get("day_count", 0) if state.get("day") == today else 0
+
+            if per_day and day_count >= per_day:
+                tomorrow = datetime.combine(
+                    now.date() + timedelta(days=1), time(), timezone.utc
+                )
+                return (tomorrow - now).total_seconds()
+
+            if per_minute and tokens < 1:
+                return (1 - tokens) * 60 / per_minute
+
+            if consume:
+                state = {
+                    "tokens": tokens - 1,
+                    "updated": now.timestamp(),
+                    "day": today,
+                    "day_count": day_count + 1,
+                }
+                state_path.write_text(json.dumps(state))
+
+        return 0
+
+
+quota = VirusTotalQuota()
+
+
+class VirusTotalPoller:
+    """Moves every outstanding VirusTotalSubmission along to an analysis.
+
+    Each process runs a poller thread that resolves the futures of the
+    requests waiting in that process. On each server, only the poller holding
+    the lock talks to VirusTotal, on behalf of all processes, so a submission
+    is uploaded and polled once however many requests are waiting for it. It
+    takes the submissions queued on its own server, the file is only there.
+    It keeps a single client, and with it the HTTP connection, for as long as
+    it runs.
+    """
+
+    # How often the database is checked for due and finished submissions
+    tick = 1.0
+
+    # The analysis takes a while, don't poll until some time has passed. After
+    # that back off so slow analyses don't eat the API quota.
+    initial_poll_delay = 15.0
+    poll_backoff = 1.5
+    max_poll_interval = 60.0
+
+    # Submissions still outstanding this long after they were queued fail, so
+    # the requests waiting for them don't wait forever when the server that
+    # has the file is gone or the quota stays used up
+    max_analysis_time = timedelta(hours=1)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiting: dict[str, list[Future]] = defaultdict(list)
+        self.wake_up = threading.Event()
+        self.leader_lock_file: IO | None = None
+        self.client: vt.Client | None = None
+
+    def start(self):
+        thread = threading.Thread(
+            target=self.run, name="virustotal-poller", daemon=True
+        )
+        thread.start()
+
+    def watch(self, sha256: str) -> Future:
+        future = Future()
+        with self.lock:
+            self.waiting[sha256].append(future)
+        self.wake_up.set()
+        return future
+
+    def run(self):
+        while True:
+            self.wake_up.wait(self.tick)
+            self.wake_up.clear()
+
+            close_old_connections()
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("VirusTotal poller error")
+
+    def run_once(self):
+        if self.is_leader():
+            self.process_due_submissions()
+        self.resolve_waiting()
+
+    def is_leader(self) -> bool:
+        if self.leader_lock_file:
+            return True
+
+        lock_file = open(
+            config.STATE_DIRECTORY / "locks" / "virustotal-poller.lock", "w"
+        )
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        self.leader_lock_file = lock_file
+        return True
+
+    def process_due_submissions(self):
+        now = datetime.now(timezone.utc)
+        VirusTotalSubmission.objects.filter(
+            status__in=[
+                VirusTotalSubmission.Status.QUEUED,
+                VirusTotalSubmission.Status.POLLING,
+            ],
+            queued__lt=now - self.max_analysis_time,
+        ).update(
+            status=VirusTotalSubmission.Status.FAILED,
+            error="Timed out waiting for the analysis",
+            updated=now,
+        )
+
+        due = list(
+            VirusTotalSubmission.objects.filter(
+                # Submissions from before they had a host are taken by any
+                Q(host=socket.gethostname()) | Q(host=""),
+                status__in=[
+                    VirusTotalSubmission.Status.QUEUED,
+                    VirusTotalSubmission.Status.POLLING,
+                ],
+                next_poll__lte=datetime.now(timezone.utc),
+            ).order_by("next_poll")
+        )
+        if not due:
+            return
+
+        if self.client is None:
+            try:
+                self.client = get_configured_client()
+            except Exception as exc:
+                logger.warning("Couldn't start VirusTotal analyses: %r", exc)
+                for submission in due:
+                    submission.status = VirusTotalSubmission.Status.FAILED
+                    submission.error = f"{type(exc).__name__}: {exc}"
+                    submission.save()
+                return
+
+        for submission in due:
+            try:
+                if submission.status == VirusTotalSubmission.Status.QUEUED:
+                    self.submit(self.client, submission)
+                else:
+                    self.poll(self.client, submission)
+            except VirusTotalQuotaExhausted as exc:
+                # The rest waits in the queue until there's quota again
+                logger.info("%s", exc)
+                submission.save()
+                break
+            except Exception as exc:
+                logger.warning(
+                    "VirusTotal analysis of %s failed: %r", submission.sha256, exc
+                )
+                submission.status = VirusTotalSubmission.Status.FAILED
+                submission.error = f"{type(exc).__name__}: {exc}"
+
+            submission.save()
+
+    def use_api(self, submission: VirusTotalSubmission):
+        retry_after = quota.acquire()
+        if retry_after:
+            raise VirusTotalQuotaExhausted(retry_after)
+
+        submission.api_calls += 1
+
+    def submit(self, client: vt.Client, submission: VirusTotalSubmission):
+        sha256 = submission.sha256
 
-    with get_configured_client() as client:
         existing_file: vt.Object | None = None
         try:
+            self.use_api(submission)
             existing_file = client.get_object(f"/files/{sha256}")
         except vt.APIError as exc:
             if exc.code != "NotFoundError":
                 raise
 
-        if existing_file and can_reuse_file_analysis(existing_file):
-            return create_analysis_from_object(sha256, existing_file, "last_analysis_")
+        if existing_file and can_reuse_file_analysis(existing_file, submission.max_age):
+            analysis = create_analysis_from_object(
+                sha256, existing_file, "last_analysis_"
+            )
+            self.complete(submission, analysis)
+            return
 
         # Need to (re)scan
+        self.use_api(submission)
         if existing_file:
             analysis = vt_make_sync(
                 client._response_to_object(client.post(f"/files/{sha256}/analyse"))
             )
         else:
-            with open(path, "rb") as f:
+            with open(submission.path, "rb") as f:
                 analysis = client.scan_file(f)
 
-        analysis_start = time()
+        submission.status = VirusTotalSubmission.Status.POLLING
+        submission.vt_id = analysis.id
+        self.schedule_poll(submission, self.initial_poll_delay)
+
+    def poll(self, client: vt.Client, submission: VirusTotalSubmission):
+        self.use_api(submission)
+        analysis = client.get_object("/analyses/{}", submission.vt_id)
+
+        if analysis.get("status") != "completed":
+            self.schedule_poll(
+                submission,
+                min(
+                    submission.poll_interval * self.poll_backoff, self.max_poll_interval
+                ),
+            )
+            return
+
+        analysis_time = (datetime.now(timezone.utc) - submission.queued).total_seconds()
+        self.complete(
+            submission,
+            create_analysis_from_object(
+                submission.sha256, analysis, "", {"analysis_time": analysis_time}
+            ),
+        )
+
+    def schedule_poll(self, submission: VirusTotalSubmission, interval: float):
+        submission.poll_interval = interval
+        submission.next_poll = datetime.now(timezone.utc) + timedelta(seconds=interval)
+
+    def complete(self, submission: VirusTotalSubmission, analysis: VirusTotalAnalysis):
+        analysis.api_calls = submission.api_calls
+        analysis.save(update_fields=["api_calls"])
+
+        submission.status = VirusTotalSubmission.Status.COMPLETED
+        submission.analysis = analysis
+
+    def resolve_waiting(self):
+        with self.lock:
+            sha256s = list(self.waiting)
+        if not sha256s:
+            return
+
+        finished = VirusTotalSubmission.objects.filter(
+            sha256__in=sha256s,
+            status__in=[
+                VirusTotalSubmission.Status.COMPLETED,
+                VirusTotalSubmission.Status.FAILED,
+            ],
+        ).select_related("analysis")
+
+        for submission in finished:
+            with self.lock:
+                futures = self.waiting.pop(submission.sha256, [])
+
+            for future in futures:
+                if not future.set_running_or_notify_cancel():
+                    continue  # The request stopped waiting
+                if submission.analysis:
+                    future.set_result(submission.analysis)
+                else:
+                    future.set_exception(
+                        VirusTotalError(submission.error or "Analysis was deleted")
+                    )
+
+
+_poller: VirusTotalPoller | None = None
+_poller_pid: int | None = None
+_poller_lock = threading.Lock()
+
+
+def get_poller() -> VirusTotalPoller:
+    """Return this process's poller, starting it on first use."""
+    global _poller, _poller_pid
+
+    with _poller_lock:
+        if _poller is None or _poller_pid != os.getpid():
+            _poller = VirusTotalPoller()
+            _poller.start()
+            _poller_pid = os.getpid()
+
+        return _poller
+
+
+def _completed_future(analysis: VirusTotalAnalysis) -> Future:
+    future = Future()
+    future.set_result(analysis)
+    return future
+
 
-        # It'll take some time for the analysis to complete. Sleep for some extra
-        # time before fetching a new analysis object.
-        sleep(15)
+def latest_analysis(sha256: str) -> VirusTotalAnalysis | None:
+    return VirusTotalAnalysis.objects.filter(sha256=sha256).order_by("-date").first()
 
-        while analysis.get("status") != "completed":
-            sleep(20)
-            analysis = client.get_object("/analyses/{}", analysis.id)
 
-        analysis_end = time()
+def queue_vt_analysis(
+    path: str | Path, sha256: str, max_age: timedelta = ANALYSIS_REUSE_TIME
+):
+    """Queue the file for a new analysis, unless it's already queued.
 
-        return create_analysis_from_object(
-            sha256, analysis, "", {"analysis_time": analysis_end - analysis_start}
+    VirusTotal's own last analysis of the file is used if it's younger than
+    `max_age`.
+    """
+    now = datetime.now(timezone.utc)
+    submission, created = VirusTotalSubmission.objects.get_or_create(
+        sha256=sha256,
+        defaults={
+            "host": socket.gethostname(),
+            "path": str(path),
+            "max_age": max_age,
+            "queued": now,
+            "next_poll": now,
+        },
+    )
+    if not created and submission.status in [
+        VirusTotalSubmission.Status.COMPLETED,
+        VirusTotalSubmission.Status.FAILED,
+    ]:
+        # The previous analysis is too old or failed, start again. Only one of
+        # the requests racing to do this needs to succeed.
+        VirusTotalSubmission.objects.filter(
+            id=submission.id, status=submission.status
+        ).update(
+            status=VirusTotalSubmission.Status.QUEUED,
+            host=socket.gethostname(),
+            path=str(path),
+            max_age=max_age,
+            vt_id=None,
+            analysis=None,
+            error=None,
+            api_calls=0,
+            poll_interval=0,
+            queued=now,
+            next_poll=now,
+        )
+    elif not created:
+        # Already queued, make sure it's as fresh as this request needs
+        VirusTotalSubmission.objects.filter(
+            id=submission.id, max_age__gt=max_age
+        ).update(max_age=max_age)
+
+    # Start this process's poller, in case no process is running one yet
+    get_poller()
+
+
+def refresh_vt_analysis(path: str | Path, sha256: str) -> Future:
+    """Return a future for a new analysis of the file."""
+    queue_vt_analysis(path, sha256, max_age=timedelta(0))
+    return get_poller().watch(sha256)
+
+
+def request_vt_analysis(
+    path: str | Path,
+    sha256: str,
+    max_wait: float | None = None,
+    allow_stale: bool = False,
+    fresh_for: timedelta = ANALYSIS_REUSE_TIME,
+    stale_for: timedelta = timedelta(0),
+) -> Future:
+    """Return a future for a recent analysis of the file.
+
+    An analysis in the database younger than `fresh_for` is returned straight
+    away. One that's up to `stale_for` older than that is returned too, while
+    a new analysis is queued for the next request. Otherwise the file is
+    queued for the poller, or if it's already queued the future is attached to
+    that submission.
+
+    If the API quota won't allow a request within `max_wait` seconds, the last
+    analysis is returned with `allow_stale`, otherwise VirusTotalQuotaExhausted
+    is raised. Without an API key it raises right away, nothing is queued.
+    """
+    check_configured()
+
+    existing_analysis = latest_analysis(sha256)
+    if existing_analysis:
+        age = existing_analysis.get_age()
+        if age < fresh_for:
+            return _completed_future(existing_analysis)
+
+        if age < fresh_for + stale_for:
+            queue_vt_analysis(path, sha256, fresh_for)
+            return _completed_future(existing_analysis)
+
+    if max_wait is not None:
+        retry_after = quota.wait_time()
+        if retry_after > max_wait:
+            if existing_analysis and allow_stale:
+                logger.warning(
+                    "VirusTotal quota used up, using the analysis of %s from %s",
+                    sha256,
+                    existing_analysis.date,
+                )
+                return _completed_future(existing_analysis)
+
+            raise VirusTotalQuotaExhausted(retry_after)
+
+    queue_vt_analysis(path, sha256, fresh_for)
+    return get_poller().watch(sha256)
+
+
+def files_due_for_refresh(margin: timedelta, recent: timedelta) -> dict[str, str]:
+    """Find recently signed files whose analysis goes stale within `margin`.
+
+    Returns the input paths by SHA-256. Each profile that scans with
+    VirusTotal is checked against its own freshness window.
+    """
+    now = datetime.now(timezone.utc)
+    due: dict[str, str] = {}
+
+    profiles = SigningProfile.objects.exclude(
+        vt_scan=SigningProfile.VirusTotalScanSetting.NO
+    )
+    for profile in profiles:
+        fresh_for = timedelta(days=profile.vt_fresh_days)
+        signed_files = (
+            SigningLog.objects.filter(
+                signing_profile=profile,
+                created__gte=now - recent,
+                vt_analysis__isnull=False,
+                in_path__isnull=False,
+            )
+            .order_by("-created")
+            .values_list("in_file_sha256", "in_path")
         )
+
+        checked = set()
+        for sha256, path in signed_files:
+            if sha256 in due or sha256 in checked:
+                continue
+            checked.add(sha256)
+
+            analysis = latest_analysis(sha256)
+            if analysis and analysis.get_age(now) + margin >= fresh_for:
+                due[sha256] = path
+
+    return due